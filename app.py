@@ -1,627 +1,90 @@
-import base64
-import os
-from io import StringIO
-import csv
-from dotenv import load_dotenv
-from bson import ObjectId
-from flask import Flask, request, jsonify
-from pymongo import MongoClient
-from datetime import datetime, timedelta, timezone
-import pytz
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
+import click
+from flask import Flask
 from flask_cors import CORS
-from celery_config import make_celery
-import logging
+from pymongo.errors import ExecutionTimeout
+from config import Config
+from indexes import ensure_indexes, check_query_plans, QueryPlanError, DuplicateKeysError
+from compression import init_compression
+from listing import query_timeout
+from services import db, redis_client, metrics_registry, parcels_collection, report_rollups, overdue_index
+import ops
+import parcels
+import reports
+import statuses
 # from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, create_access_token
 
-load_dotenv()  # Load environment variables from .env file
 
-app = Flask(__name__)
-CORS(app)
+# Build the web app: gunicorn 'app:create_app()', flask --app app.
+# The Celery workers load the tasks module alone and never import Flask or the blueprints.
+def create_app():
+    app = Flask(__name__)
+    # The frontend reads the pagination, delta sync and ETag headers
+    CORS(app, expose_headers=['ETag', 'X-Next-After', 'X-Sync-Since'])
 
-# Load config from config.py
-app.config.from_object('config.Config')
+    # Load config from config.py
+    app.config.from_object(Config)
 
-# Set up Celery
-celery = make_celery(app)
+    # Compress the responses with br or gzip
+    init_compression(app, min_size=app.config['COMPRESS_MIN_SIZE'], level=app.config['COMPRESS_LEVEL'])
 
-# Set up MongoDB connection
-mongo_uri = os.getenv('MONGO_URI')
-client = MongoClient(mongo_uri)
-db = client['logistics_DB']
-parcels_collection = db['Parcels']
-statuses_collection = db['Statuses']
-audits_collection = db['Audits']
-exelot_codes_collection = db['Exelot Codes']
-distributors_collection = db['Distributors']
+    # Request metrics and the Server-Timing header
+    metrics_registry.init_app(app)
 
+    # A query that ran past its maxTimeMS budget is answered with a 503
+    app.register_error_handler(ExecutionTimeout, query_timeout)
 
-# Load secret key from environment variable
-# app.config['JWT_SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
-# jwt = JWTManager(app)
+    # Load secret key from environment variable
+    # app.config['JWT_SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY')
+    # jwt = JWTManager(app)
 
+    for module in (ops, parcels, statuses, reports):
+        app.register_blueprint(module.blueprint)
+    register_commands(app)
+    return app
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+def register_commands(app):
+    @app.cli.command('ensure-indexes')
+    def ensure_indexes_command():
+        """Create the declared MongoDB indexes (idempotent), failing on duplicates that block a unique one."""
+        try:
+            created = ensure_indexes(db)
+        except DuplicateKeysError as e:
+            raise click.ClickException(str(e))
+        for collection_name, index_names in created.items():
+            click.echo(f"{collection_name}: {', '.join(index_names)}")
 
-# Function to send email
-def send_email(to_email, subject, body):
-    try:
-        smtp_server = "smtp.gmail.com"
-        smtp_port = 587
-        sender_email = os.getenv('SENDING_EMAIL')
-        app_password = os.getenv('EMAIL_PASSWORD')
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Explain each endpoint's representative query and fail on a collection scan."""
+        try:
+            check_query_plans(db)
+        except QueryPlanError as e:
+            raise click.ClickException(str(e))
+        click.echo("All representative queries use an index")
 
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = to_email
-        msg['Subject'] = subject
+    @app.cli.command('rebuild-rollups')
+    def rebuild_rollups_command():
+        """Rebuild the report rollups from the parcels (also the initial backfill)."""
+        click.echo(f"Report rollups rebuilt: {report_rollups.rebuild()} buckets")
 
-        msg.attach(MIMEText(body, 'plain'))
+    @app.cli.command('reconcile-overdue-index')
+    def reconcile_overdue_index_command():
+        """Rebuild the overdue index from the parcels (also the initial backfill)."""
+        if redis_client is None:
+            raise click.ClickException("The overdue index requires REDIS_URL")
+        click.echo(f"Overdue index rebuilt: {overdue_index.reconcile(parcels_collection)} open parcels")
 
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(sender_email, app_password)
-            server.sendmail(sender_email, to_email, msg.as_string())
+    @app.cli.command('archive-audits')
+    def archive_audits_command():
+        """Move the audits older than AUDIT_ARCHIVE_AFTER_DAYS to the monthly archive collections."""
+        from tasks import archive_audits
 
-        logging.info(f"Email successfully sent to {to_email}")
-    except Exception as e:
-        logging.error(f"Error sending email to {to_email}: {e}")
+        click.echo(f"Archived {archive_audits()} audits")
 
 
-def check_parcels_and_notify():
-    try:
-        logging.info("Executing check_parcels_and_notify")
-        forty_eight_hours_ago = datetime.now(pytz.utc) - timedelta(hours=48)
-        query = {"Status DT": {"$lt": forty_eight_hours_ago}}
-        parcels = list(parcels_collection.find(query))
-        logging.info(f"Found {len(parcels)} parcels that need updates.")
-
-        if parcels:
-            distributor_names = {parcel["Distributor"] for parcel in parcels}
-            logging.info(f"Distributor Names: {distributor_names}")
-
-            distributors_cursor = distributors_collection.find({"Name": {"$in": list(distributor_names)}})
-            distributors = list(distributors_cursor)
-            logging.info(f"Found {len(distributors)} distributors.")
-
-            for distributor in distributors:
-                distributor_email = distributor["Email"]
-                distributor_name = distributor["Name"]
-                subject = "Parcels status update is required"
-                body = (f"Hello {distributor_name},"
-                        f"\n\nWe have identified parcels whose status has not been updated for over 48 hours.\n")
-
-                total_parcels = sum(1 for parcel in parcels if parcel["Distributor"] == distributor["Name"])
-                body += f"Total parcels requiring update: {total_parcels}\n"
-
-                max_parcels_to_show = 5
-                shown_parcels = 0
-                for parcel in parcels:
-                    if parcel["Distributor"] == distributor["Name"]:
-                        body += (f"- Parcel ID: {parcel['ID']}, Status: {parcel['Status']}, "
-                                 f"Last Update: {parcel['Status DT']}\n")
-                        shown_parcels += 1
-                        if shown_parcels >= max_parcels_to_show:
-                            break
-
-                if total_parcels > max_parcels_to_show:
-                    body += f"\n...and {total_parcels - max_parcels_to_show} more parcels."
-
-                body += ("\n\nPlease update the status of these parcels as soon as possible, at the link:"
-                         "\nhttps://aviachen.wixsite.com/overdue-system-manag"
-                         ".\n\nBest regards,"
-                         "\nOverdue Management System Team")
-
-                logging.info(f"Sending email to {distributor_email}")
-                send_email(distributor_email, subject, body)
-        else:
-            logging.info("No parcels found that need updates.")
-    except Exception as e:
-        logging.error(f"Error in check_parcels_and_notify: {e}")
-
-
-@app.route('/')
-def home():
-    return "Hello, Flask is running!"
-
-
-@app.route('/get_parcels', methods=['GET'])
-def get_parcels():
-    try:
-        print("get_parcels endpoint called")
-        parcels = list(parcels_collection.find({}))
-        for parcel in parcels:
-            parcel['_id'] = str(parcel['_id'])  # Convert ObjectId to string
-        return jsonify(parcels)
-    except Exception as e:
-        print(f"Error occurred: {str(e)}")
-        return jsonify({"error": str(e)}), 500
-
-
-@app.route('/get_parcels_for_parcels_management', methods=['GET'])
-def get_parcels_for_parcels_management():
-    try:
-        print("get_parcels endpoint called")
-
-        # Calculate the datetime for 48 hours ago
-        forty_eight_hours_ago = datetime.now(timezone.utc) - timedelta(hours=48)
-
-        # Query to filter parcels
-        query = {
-            "Status DT": {"$lt": forty_eight_hours_ago},
-            "Exelot Code": {"$nin": ["73", "52", "99"]}
-        }
-
-        parcels = list(parcels_collection.find(query))
-        for parcel in parcels:
-            parcel['_id'] = str(parcel['_id'])  # Convert ObjectId to string
-
-        return jsonify(parcels)
-    except Exception as e:
-        print(f"Error occurred: {str(e)}")
-        return jsonify({"error": str(e)}), 500
-
-
-@app.route('/update_parcel/<parcel_id>', methods=['PATCH'])
-def update_parcel(parcel_id):
-    data = request.get_json()
-    print("Received data:", data)
-
-    # Validate input
-    if 'Status' not in data or not isinstance(data['Status'], str):
-        return jsonify({"error": "Status is required and must be a string"}), 400
-    if 'Comments' in data and not isinstance(data['Comments'], str):
-        return jsonify({"error": "Comments, if provided, must be a string"}), 400
-
-    # Fetch the parcel to get the current distributor and old status
-    parcel = parcels_collection.find_one({"ID": parcel_id})
-    if not parcel:
-        return jsonify({"error": "Parcel not found"}), 404
-
-    distributor = parcel["Distributor"]
-    print("Distributor:", distributor)
-
-    # Validate the status for the given distributor
-    valid_status = statuses_collection.find_one({"Distributor": distributor, "Status": data["Status"]})
-    print("Valid status found:", valid_status)
-    if not valid_status:
-        return jsonify({"error": "Invalid status for the given distributor"}), 400
-
-    # Get the old Exelot Code and the new Exelot Code
-    old_exelot_code = parcel.get("Exelot Code", "")
-    new_exelot_code = valid_status["Exelot Code"]
-
-    # Update the parcel with the new status, comments, and Exelot Code
-    update_fields = {
-        "Status": data["Status"],
-        "Comments": data.get("Comments", ""),
-        "Exelot Code": new_exelot_code,
-        "Status DT": datetime.now(pytz.utc)
-    }
-    result = parcels_collection.update_one(
-        {"ID": parcel_id},
-        {"$set": update_fields}
-    )
-
-    if result.matched_count == 0:
-        return jsonify({"error": "Parcel not found"}), 404
-
-    # Create an audit record
-    audit_record = {
-        "Parcel ID": parcel_id,
-        "Old Status": parcel["Status"],
-        "New Status": data["Status"],
-        "Old Exelot Code": old_exelot_code,
-        "New Exelot Code": new_exelot_code,
-        "Change DT": datetime.now(pytz.utc)  # Current UTC date and time
-    }
-    audits_collection.insert_one(audit_record)
-
-    return jsonify({"message": "Parcel updated successfully"}), 200
-
-
-@app.route('/get_valid_statuses/<distributor>', methods=['GET'])
-def get_valid_statuses(distributor):
-    try:
-        statuses = statuses_collection.find({
-            "Distributor": distributor,
-            "Active": True  # Only fetch active statuses
-        })
-        valid_statuses = [status["Status"] for status in statuses]
-        return jsonify(valid_statuses), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-
-@app.route('/update_parcels_with_csv', methods=['POST'])
-def update_parcels_with_csv():
-    try:
-        print('starting to process csv file')
-        data = request.get_json()
-        print(f'got the data from request: {data}')  # Print the entire data to check its structure
-        csv_content_base64 = data.get('csvContent', '')
-        if not csv_content_base64:
-            raise ValueError("No CSV file data found in the request")
-
-        # Decode the base64 encoded CSV content
-        csv_content = base64.b64decode(csv_content_base64).decode('utf-8')
-        print(f'Decoded CSV content:\n{csv_content}')  # Print the decoded CSV content to ensure it's correct
-
-        # Ensure csv_content is being read correctly by printing it before parsing
-        print(f"CSV Content Length: {len(csv_content)}")
-        if len(csv_content) < 50:
-            print(f"CSV Content (first 50 chars): {csv_content[:50]}")
-
-        csv_reader = csv.DictReader(StringIO(csv_content))
-        print('i have csv reader')
-
-        # Process the CSV rows asynchronously
-        update_parcels_task.delay(list(csv_reader))
-
-        return jsonify({"message": "CSV processing started"}), 200
-    except Exception as e:
-        print(f"Error processing CSV: {str(e)}")
-        return jsonify({"error": str(e)}), 400
-
-
-@celery.task
-def update_parcels_task(rows):
-    updated_parcels = 0
-    for row in rows:
-        parcel_id = row['ID']
-        new_status = row['Status']
-        new_comments = row['Comments']
-        new_status_dt_str = row['Status DT']
-        print('the fields are:')
-        print(parcel_id, new_status, new_comments, new_status_dt_str)
-
-        # Convert "Status DT" to datetime object
-        new_status_dt = datetime.strptime(new_status_dt_str, '%d/%m/%Y')
-        print(f"Converted Status DT: {new_status_dt}")
-
-        print(f"Processing parcel with ID: {parcel_id}")
-
-        parcel = parcels_collection.find_one({"ID": parcel_id})
-        if not parcel:
-            print(f"Parcel with ID {parcel_id} not found.")
-            continue
-
-        distributor = parcel["Distributor"]
-        valid_status = statuses_collection.find_one({"Distributor": distributor, "Status": new_status})
-        if not valid_status:
-            print(f"Invalid status {new_status} for distributor {distributor}.")
-            continue
-
-        old_exelot_code = parcel.get("Exelot Code", "")
-        new_exelot_code = valid_status["Exelot Code"]
-
-        audit_record = {
-            "Parcel ID": parcel_id,
-            "Old Status": parcel["Status"],
-            "New Status": new_status,
-            "Old Exelot Code": old_exelot_code,
-            "New Exelot Code": new_exelot_code,
-            "Change DT": new_status_dt  # Use the parsed datetime object
-        }
-        audits_collection.insert_one(audit_record)
-
-        update_fields = {
-            "Status": new_status,
-            "Comments": new_comments,
-            "Exelot Code": new_exelot_code,
-            "Status DT": new_status_dt   # Use the parsed datetime object
-        }
-        parcels_collection.update_one({"ID": parcel_id}, {"$set": update_fields})
-
-        updated_parcels += 1
-
-        print(f"Updated parcel with ID: {parcel_id}")
-
-    print(f"Updated {updated_parcels} parcels")
-
-
-@app.route('/get_statuses', methods=['GET'])
-def get_statuses():
-    statuses = list(statuses_collection.find({'Active': True}))  # Only fetch active statuses
-    for status in statuses:
-        status['_id'] = str(status['_id'])
-    return jsonify(statuses), 200
-
-
-@app.route('/add_status', methods=['POST'])
-def add_status():
-    data = request.get_json()
-    result = statuses_collection.insert_one(data)
-    return jsonify({'inserted_id': str(result.inserted_id)}), 201
-
-
-@app.route('/update_status/<status_id>', methods=['PATCH'])
-def update_status(status_id):
-    data = request.get_json()
-    result = statuses_collection.update_one({'_id': ObjectId(status_id)}, {'$set': data})
-    if result.matched_count == 0:
-        return jsonify({'error': 'Status not found'}), 404
-    return jsonify({'message': 'Status updated successfully'}), 200
-
-
-@app.route('/deactivate_status/<status_id>', methods=['PATCH'])
-def deactivate_status(status_id):
-    try:
-        # Set the Active field to false
-        result = statuses_collection.update_one(
-            {'_id': ObjectId(status_id)},
-            {'$set': {'Active': False}}
-        )
-        if result.matched_count == 0:
-            return jsonify({'error': 'Status not found'}), 404
-        return jsonify({'message': 'Status deactivated successfully'}), 200
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
-
-@app.route('/get_parcel_history/<parcel_id>', methods=['GET'])
-def get_parcel_history(parcel_id):
-    try:
-        history = list(audits_collection.find({"Parcel ID": parcel_id}))
-        for record in history:
-            record['_id'] = str(record['_id'])
-        return jsonify(history)
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-
-
-@app.route('/get_parcels_by_status_and_distributor', methods=['GET'])
-def get_parcels_by_status_and_distributor():
-    start_date_str = request.args.get('startDate')
-    end_date_str = request.args.get('endDate')
-    distributors = request.args.getlist('distributors')  # Get the list of distributors
-
-    try:
-        # Parse the ISO string dates to datetime objects
-        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-    except ValueError:
-        return jsonify({"error": "Invalid date format"}), 400
-
-    # Query MongoDB with the date range
-    query = {
-        "Status DT": {"$gte": start_date, "$lte": end_date},
-    }
-    if distributors and 'all' not in distributors:
-        query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
-    parcels = list(parcels_collection.find(query))
-
-    # Fetch all Exelot Codes
-    exelot_codes = {code['Exelot Code']: code['Description'] for code in exelot_codes_collection.find()}
-
-    # Process the parcels to count by status and distributor
-    report = {}
-    for parcel in parcels:
-        status = parcel.get('Status', 'Unknown')
-        distributor = parcel.get('Distributor', 'Unknown')
-        exelot_code = parcel.get('Exelot Code', 'Unknown')
-        exelot_description = exelot_codes.get(exelot_code, 'No description')
-
-        key = (status, distributor, exelot_description)
-        if key in report:
-            report[key] += 1
-        else:
-            report[key] = 1
-
-    # Format the report as a list of dictionaries
-    report_data = [
-        {"Status": k[0], "Distributor": k[1], "ExelotCodeDescription": k[2], "Count": v}
-        for k, v in report.items()
-    ]
-
-    return jsonify(report_data)
-
-
-@app.route('/get_lost_parcels', methods=['GET'])
-def get_lost_parcels():
-    start_date_str = request.args.get('startDate')
-    end_date_str = request.args.get('endDate')
-    distributors = request.args.getlist('distributors')  # Get the list of distributors
-    sites = request.args.getlist('sites')  # Get the list of sites
-    status = request.args.get('status')  # Status code for lost parcels
-    print(
-        f"Received start date: {start_date_str}, end date: {end_date_str}, distributors: {distributors},"
-        f" sites: {sites}, status: {status}")
-
-    try:
-        # Parse the ISO string dates to datetime objects
-        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-    except ValueError:
-        return jsonify({"error": "Invalid date format"}), 400
-
-    # Query MongoDB with the date range
-    lost_parcels_query = {
-        'Status': status,
-        "Status DT": {"$gte": start_date, "$lte": end_date},
-    }
-
-    # Build the query filter
-    if distributors and 'all' not in distributors:
-        lost_parcels_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
-    if sites and 'all' not in sites:
-        lost_parcels_query['Site'] = {'$in': sites}
-
-    print(f"MongoDB query: {lost_parcels_query}")
-
-    parcels = list(parcels_collection.find(lost_parcels_query))
-    print(f"Found parcels: {parcels}")
-
-    # Process the parcels to count by status and distributor
-    report = {}
-    for parcel in parcels:
-        distributor = parcel.get('Distributor', 'Unknown')
-        site = parcel.get('Site', 'Unknown')
-
-        key = (distributor, site)
-        if key in report:
-            report[key] += 1
-        else:
-            report[key] = 1
-
-    # Format the report as a list of dictionaries
-    report_data = [
-        {"Distributor": k[0], "Site": k[1], "TotalLost": v}
-        for k, v in report.items()
-    ]
-    print(f"Generated report data: {report_data}")
-
-    return jsonify(report_data)
-
-
-@app.route('/get_parcels_for_held_report', methods=['GET'])
-def get_parcels_for_held_report():
-    start_date_str = request.args.get('startDate')
-    end_date_str = request.args.get('endDate')
-    distributors = request.args.getlist('distributors')  # Get the list of distributors
-    sites = request.args.getlist('sites')  # Get the list of sites
-    exelot_codes = request.args.getlist('exelotCodes')  # Get the list of exelot codes for held parcels
-    print(
-        f"Received start date: {start_date_str}, end date: {end_date_str}, distributors: {distributors},"
-        f" sites: {sites}, exelot codes: {exelot_codes}")
-
-    try:
-        # Parse the ISO string dates to datetime objects
-        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-    except ValueError:
-        return jsonify({"error": "Invalid date format"}), 400
-
-    # Query MongoDB with the date range
-    parcels_for_held_report_query = {
-        "Exelot Code": {"$in": exelot_codes},
-        "Status DT": {"$gte": start_date, "$lte": end_date},
-    }
-
-    # Build the query filter
-    if distributors and 'all' not in distributors:
-        parcels_for_held_report_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
-    if sites and 'all' not in sites:
-        parcels_for_held_report_query['Site'] = {'$in': sites}
-
-    print(f"MongoDB query: {parcels_for_held_report_query}")
-
-    parcels = list(parcels_collection.find(parcels_for_held_report_query))
-    print(f"Found parcels: {parcels}")
-
-    # Process the parcels to count by site and distributor
-    report = {}
-    for parcel in parcels:
-        distributor = parcel.get('Distributor', 'Unknown')
-        site = parcel.get('Site', 'Unknown')
-
-        key = (distributor, site)
-        if key in report:
-            report[key] += 1
-        else:
-            report[key] = 1
-
-    # Format the report as a list of dictionaries
-    report_data = [
-        {"Distributor": k[0], "Site": k[1], "TotalParcels": v}
-        for k, v in report.items()
-    ]
-    print(f"Generated report data: {report_data}")
-
-    return jsonify(report_data)
-
-
-@app.route('/get_parcels_for_pudo_report', methods=['GET'])
-def get_parcels_for_pudo_report():
-    start_date_str = request.args.get('startDate')
-    end_date_str = request.args.get('endDate')
-    distributors = request.args.getlist('distributors')  # Get the list of distributors
-    sites = request.args.getlist('sites')  # Get the list of sites
-    exelot_codes = request.args.getlist('exelotCodes')  # Get the list of exelot codes for held parcels
-    print(
-        f"Received start date: {start_date_str}, end date: {end_date_str}, distributors: {distributors},"
-        f" sites: {sites}, exelot codes: {exelot_codes}")
-
-    try:
-        # Parse the ISO string dates to datetime objects
-        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
-        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
-        seven_days_ago = datetime.now(timezone.utc) - timedelta(hours=168)
-    except ValueError:
-        return jsonify({"error": "Invalid date format"}), 400
-
-    # Query MongoDB with the date range and the 7-day threshold
-    parcels_for_pudo_report_query = {
-        "Exelot Code": {"$in": exelot_codes},
-        "Status DT": {"$gte": start_date, "$lte": end_date},
-    }
-
-    # Build the query filter
-    if distributors and 'all' not in distributors:
-        parcels_for_pudo_report_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
-    if sites and 'all' not in sites:
-        parcels_for_pudo_report_query['Site'] = {'$in': sites}
-
-    print(f"MongoDB query: {parcels_for_pudo_report_query}")
-
-    try:
-        # Query MongoDB
-        parcels = list(parcels_collection.find(parcels_for_pudo_report_query))
-        print(f"Found parcels: {parcels}")
-    except Exception as e:
-        print(f"Error querying MongoDB: {e}")
-        return jsonify({"error": "Error querying database"}), 500
-
-    try:
-        # Filter parcels to exclude those not older than 7 days
-        filtered_parcels = [
-            parcel for parcel in parcels
-            if parcel['Status DT'].replace(tzinfo=timezone.utc) < seven_days_ago
-        ]
-        print(f"Filtered parcels: {filtered_parcels}")
-    except KeyError as e:
-        print(f"KeyError during filtering: {e}")
-        return jsonify({"error": "Missing 'Status DT' in parcel data"}), 500
-
-    # Process the parcels to count by site and distributor
-    report = {}
-    for parcel in filtered_parcels:
-        distributor = parcel.get('Distributor', 'Unknown')
-        site = parcel.get('Site', 'Unknown')
-
-        key = (distributor, site)
-        if key in report:
-            report[key] += 1
-        else:
-            report[key] = 1
-
-    # Format the report as a list of dictionaries
-    report_data = [
-        {"Distributor": k[0], "Site": k[1], "TotalParcels": v}
-        for k, v in report.items()
-    ]
-    print(f"Generated report data: {report_data}")
-
-    return jsonify(report_data)
-
-
-# Scheduler setup for worker process
-if os.getenv('WORKER') == 'true':
-    logging.info("Worker process detected. Setting up scheduler.")
-    scheduler = BackgroundScheduler()
-    trigger = CronTrigger(day_of_week='sun,mon,tue,wed,thu', hour=9, minute=0, timezone='Asia/Jerusalem')
-    scheduler.add_job(check_parcels_and_notify, trigger, name='check_parcels_and_notify')
-    scheduler.start()
-    logging.info("Scheduler started with job check_parcels_and_notify.")
-
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
+    create_app().run(debug=True, host='0.0.0.0')
 
 
 # @app.route('/get_parcels', methods=['GET'])
@@ -0,0 +1,110 @@
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from database import DUPLICATE_KEY
+from dates import to_utc
+
+
+# Pagination token of an audit record: its Change DT in milliseconds and its _id
+def history_token(record):
+    change_dt = record["Change DT"].replace(tzinfo=timezone.utc)
+    return f"{int(change_dt.timestamp() * 1000)}:{record['_id']}"
+
+
+def parse_history_token(token):
+    milliseconds, _, object_id = token.partition(':')
+    if not milliseconds.isdigit() or not ObjectId.is_valid(object_id):
+        raise ValueError("Invalid after token")
+    change_dt = datetime.fromtimestamp(int(milliseconds) / 1000, timezone.utc).replace(tzinfo=None)
+    return change_dt, ObjectId(object_id)
+
+
+# Audits older than a cutoff are moved to one archive collection per month of Change DT
+# ("Audits Archive 2024-01"), created with a compressed block storage and the same
+# (Parcel ID, Change DT) index as Audits. History reads query Audits and every archive
+# collection in a single aggregation through $unionWith (MongoDB 4.4+).
+class AuditArchive:
+    PREFIX = 'Audits Archive '
+
+    def __init__(self, db, audits_collection, compressor='zstd', batch_size=1000, partitions_check_interval=60.0):
+        self.db = db
+        self.audits_collection = audits_collection
+        self.compressor = compressor
+        self.batch_size = batch_size
+        self.partitions_check_interval = partitions_check_interval
+        self._partitions = []
+        self._partitions_checked_at = None
+
+    def partition_name(self, change_dt):
+        return f"{self.PREFIX}{change_dt:%Y-%m}"
+
+    # Names of the archive collections, oldest first, listed again at most every partitions_check_interval
+    def partitions(self):
+        now = time.monotonic()
+        if self._partitions_checked_at is None or now - self._partitions_checked_at >= self.partitions_check_interval:
+            names = self.db.list_collection_names(filter={"name": {"$regex": f"^{self.PREFIX}"}})
+            self._partitions = sorted(names)
+            self._partitions_checked_at = now
+        return self._partitions
+
+    def _create_partition(self, name):
+        options = {}
+        if self.compressor:
+            options["storageEngine"] = {"wiredTiger": {"configString": f"block_compressor={self.compressor}"}}
+        try:
+            self.db.create_collection(name, **options)
+        except CollectionInvalid:
+            pass  # created by an earlier run
+        self.db[name].create_index([("Parcel ID", ASCENDING), ("Change DT", ASCENDING)],
+                                   name="Parcel ID_Change DT")
+
+    # History of the given parcels from Audits and the archive, sorted by parcel then Change DT.
+    # after is a (Change DT, _id) pair returned by parse_history_token.
+    def history(self, parcel_ids, after=None, limit=None, max_time_ms=None):
+        match = {"Parcel ID": parcel_ids[0] if len(parcel_ids) == 1 else {"$in": parcel_ids}}
+        if after is not None:
+            change_dt, object_id = after
+            match = {**match, "$or": [{"Change DT": {"$gt": change_dt}},
+                                      {"Change DT": change_dt, "_id": {"$gt": object_id}}]}
+        pipeline = [{"$match": match}]
+        pipeline += [{"$unionWith": {"coll": name, "pipeline": [{"$match": match}]}}
+                     for name in self.partitions()]
+        pipeline.append({"$sort": {"Parcel ID": 1, "Change DT": 1, "_id": 1}})
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+        return list(self.audits_collection.aggregate(pipeline, **options))
+
+    # Move the audits whose Change DT is before older_than into the archive, batch by batch.
+    # Records are copied before being deleted and keep their _id, so an interrupted run is simply resumed.
+    def archive(self, older_than):
+        older_than = to_utc(older_than)
+        archived = 0
+        known = set(self.partitions())
+        while True:
+            batch = list(self.audits_collection.find({"Change DT": {"$lt": older_than}})
+                         .sort("Change DT", 1).limit(self.batch_size))
+            if not batch:
+                break
+
+            records_by_partition = {}
+            for record in batch:
+                records_by_partition.setdefault(self.partition_name(record["Change DT"]), []).append(record)
+            for name, records in records_by_partition.items():
+                if name not in known:
+                    self._create_partition(name)
+                    known.add(name)
+                try:
+                    self.db[name].insert_many(records, ordered=False)
+                except BulkWriteError as e:
+                    # Records already copied by an interrupted run
+                    if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+                        raise
+
+            self.audits_collection.delete_many({"_id": {"$in": [record["_id"] for record in batch]}})
+            archived += len(batch)
+
+        self._partitions_checked_at = None
+        return archived
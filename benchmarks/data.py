@@ -0,0 +1,114 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+DISTRIBUTORS = ['YDM', 'HFD', 'Buzzr', 'Cheetah', 'Kexpress', 'Done']
+SITES = ['Tel Aviv', 'Jerusalem', 'Haifa', 'Beer Sheva', 'Ashdod', 'Netanya', 'Eilat']
+
+# Exelot Codes and their descriptions
+EXELOT_CODES = {
+    "10": "Received at distributor hub",
+    "20": "Out for delivery",
+    "30": "Delivery attempt failed",
+    "40": "Held at distributor",
+    "52": "Waiting at PUDO point",
+    "60": "Returned to sender",
+    "73": "Delivered",
+    "99": "Lost",
+}
+
+# Distributor status names mapped to Exelot Codes, every distributor uses its own wording
+STATUS_NAMES = {
+    "10": ["Received", "At hub", "Sorted"],
+    "20": ["Out for delivery", "On the way"],
+    "30": ["Customer not home", "Wrong address"],
+    "40": ["Held", "Held for payment"],
+    "52": ["At pickup point"],
+    "60": ["Returned"],
+    "73": ["Delivered"],
+    "99": ["Lost"],
+}
+
+# Share of the parcels currently in each Exelot Code
+CODE_WEIGHTS = {"10": 20, "20": 15, "30": 8, "40": 6, "52": 10, "60": 3, "73": 35, "99": 3}
+
+# Parcels are spread over the last 120 days, most of them updated in the last few days
+STATUS_DT_SPREAD_DAYS = 120
+STATUS_DT_MEAN_DAYS = 6
+
+
+def build_statuses():
+    statuses = []
+    for distributor in DISTRIBUTORS:
+        for code, names in STATUS_NAMES.items():
+            for name in names:
+                statuses.append({"Distributor": distributor, "Status": name, "Exelot Code": code, "Active": True})
+    return statuses
+
+
+def build_distributors():
+    return [{"Name": name, "Email": f"ops+{name.lower()}@example.com"} for name in DISTRIBUTORS]
+
+
+def build_exelot_codes():
+    return [{"Exelot Code": code, "Description": description} for code, description in EXELOT_CODES.items()]
+
+
+def random_status_dt(rng, now):
+    age_days = min(rng.expovariate(1 / STATUS_DT_MEAN_DAYS), STATUS_DT_SPREAD_DAYS)
+    return (now - timedelta(days=age_days)).replace(microsecond=0)
+
+
+def parcel_id(index):
+    return f"EX{index:09d}"
+
+
+# Yield parcels and their audit records in batches of batch_size parcels
+def iter_parcel_batches(count, rng, now, audits_per_parcel=1, batch_size=10000):
+    codes = list(CODE_WEIGHTS)
+    weights = [CODE_WEIGHTS[code] for code in codes]
+    for batch_start in range(0, count, batch_size):
+        parcels, audits = [], []
+        for index in range(batch_start, min(batch_start + batch_size, count)):
+            distributor = rng.choice(DISTRIBUTORS)
+            code = rng.choices(codes, weights)[0]
+            status = rng.choice(STATUS_NAMES[code])
+            status_dt = random_status_dt(rng, now)
+            parcels.append({
+                "ID": parcel_id(index),
+                "Distributor": distributor,
+                "Site": rng.choice(SITES),
+                "Status": status,
+                "Exelot Code": code,
+                "Status DT": status_dt,
+                "Comments": "",
+            })
+            change_dt = status_dt
+            for _ in range(audits_per_parcel):
+                old_code = rng.choice(["10", "20"])
+                change_dt -= timedelta(hours=rng.randint(2, 72))
+                audits.append({
+                    "Parcel ID": parcel_id(index),
+                    "Old Status": rng.choice(STATUS_NAMES[old_code]),
+                    "New Status": status,
+                    "Old Exelot Code": old_code,
+                    "New Exelot Code": code,
+                    "Change DT": change_dt,
+                })
+        yield parcels, audits
+
+
+# Drop and refill the benchmark database with count parcels
+def generate_dataset(db, count, seed=42, audits_per_parcel=1):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+
+    for collection_name in db.list_collection_names():
+        db.drop_collection(collection_name)
+
+    db['Distributors'].insert_many(build_distributors())
+    db['Exelot Codes'].insert_many(build_exelot_codes())
+    db['Statuses'].insert_many(build_statuses())
+    for parcels, audits in iter_parcel_batches(count, rng, now, audits_per_parcel):
+        db['Parcels'].insert_many(parcels, ordered=False)
+        if audits:
+            db['Audits'].insert_many(audits, ordered=False)
@@ -0,0 +1,86 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.run import percentile
+
+# What each process imports at startup. 'monolith' loads everything, as every process did before the
+# app was split into the web factory and the tasks module.
+ROLES = {
+    "monolith": "import app; app.create_app(); import tasks, scheduling, mailer",
+    "web": "import app; app.create_app()",
+    "worker": "import tasks",
+}
+
+# Modules a role must never load, as top-level packages or dotted prefixes
+FORBIDDEN_MODULES = {
+    "web": ("apscheduler", "smtplib", "email.mime", "mailer", "scheduling"),
+    "worker": ("flask", "flask_cors", "app", "parcels", "statuses", "reports", "ops", "listing", "compression"),
+}
+
+# Run in a fresh interpreter: time the role's imports, not the interpreter startup
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+{statements}
+print(json.dumps({{"seconds": time.perf_counter() - started, "modules": sorted(sys.modules)}}))
+"""
+
+
+def is_loaded(modules, name):
+    return any(module == name or module.startswith(f"{name}.") for module in modules)
+
+
+def measure_role(statements, iterations):
+    env = {**os.environ, 'REDIS_URL': '', 'WORKER': 'false'}
+    durations = []
+    modules = []
+    for _ in range(iterations):
+        output = subprocess.check_output([sys.executable, '-c', CHILD.format(statements=statements)],
+                                         env=env, text=True)
+        result = json.loads(output.strip().splitlines()[-1])
+        durations.append(result["seconds"])
+        modules = result["modules"]
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(durations, 50) * 1000, 1),
+        "min_ms": round(min(durations) * 1000, 1),
+        "modules": len(modules),
+    }, modules
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the startup imports of the web and worker processes")
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--output', default=None, help="Result file (JSON)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    results = {}
+    leaks = []
+    for role, statements in ROLES.items():
+        results[role], modules = measure_role(statements, args.iterations)
+        leaks += [f"{role} imports {name}" for name in FORBIDDEN_MODULES.get(role, ()) if is_loaded(modules, name)]
+
+    baseline = results["monolith"]["p50_ms"]
+    for role, result in results.items():
+        saved = baseline - result["p50_ms"]
+        result["saved_ms"] = round(saved, 1)
+        result["saved_pct"] = round(saved / baseline * 100, 1) if baseline else 0
+        print(f"{role:<10} p50 {result['p50_ms']:>8} ms  min {result['min_ms']:>8} ms  "
+              f"{result['modules']:>5} modules  saved {result['saved_ms']:>8} ms ({result['saved_pct']:+.1f}%)")
+
+    if args.output:
+        with open(args.output, 'w') as result_file:
+            json.dump(results, result_file, indent=2)
+        print(f"Results written to {args.output}")
+    if leaks:
+        sys.exit("\n".join(leaks))
+
+
+if __name__ == '__main__':
+    main()
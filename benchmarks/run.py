@@ -0,0 +1,291 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+from pymongo import monitoring
+
+from benchmarks.data import DISTRIBUTORS, SITES, STATUS_NAMES, build_statuses, parcel_id, generate_dataset
+
+# Metrics compared by --compare, with the direction that counts as a regression
+COMPARED_METRICS = {
+    "p50_ms": "higher", "p95_ms": "higher", "p99_ms": "higher",
+    "units_per_s": "lower", "round_trips_per_call": "higher", "peak_memory_kb": "higher",
+}
+
+
+# Counts the commands sent to MongoDB, i.e. the DB round trips
+class RoundTripCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Stand-in for tasks.queue_emails so check_parcels_and_notify only measures the grouping and the emails it builds,
+# not the outbox (whose daily keys would skip every run after the first) or the delivery
+def queue_no_emails(emails):
+    return [key for key, *_ in emails]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# Run func iterations times and report its latency percentiles, throughput, round trips and peak memory.
+# units is the amount of work done per call (1 request, or the number of CSV rows).
+def measure(func, iterations, counter, units=1):
+    func()  # warm up connections, caches and the status catalog
+
+    latencies = []
+    counter.count = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    round_trips = counter.count / iterations
+
+    # Peak memory is measured on a separate call, tracemalloc slows everything down
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+        "units_per_s": round(iterations * units / elapsed, 2),
+        "round_trips_per_call": round(round_trips, 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def checked_get(client, url, query_string=None):
+    def call():
+        response = client.get(url, query_string=query_string)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        response.get_data()
+    return call
+
+
+def run_scenarios(web_app, counter, size, args):
+    import services
+    import tasks
+
+    client = web_app.test_client()
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    report_range = {
+        "startDate": (now - timedelta(days=30)).isoformat(),
+        "endDate": now.isoformat(),
+    }
+    statuses_by_distributor = {}
+    for status in build_statuses():
+        statuses_by_distributor.setdefault(status["Distributor"], []).append(status["Status"])
+
+    results = {}
+
+    def run(name, func, iterations, units=1):
+        print(f"[{size}] {name} ...", flush=True)
+        results[name] = measure(func, iterations, counter, units)
+        print(f"[{size}] {name}: {results[name]}", flush=True)
+
+    iterations = args.iterations
+    listing_iterations = max(1, iterations // 10) if size >= 100000 else iterations
+    run("get_parcels", checked_get(client, '/get_parcels'), listing_iterations)
+    run("get_parcels_page", checked_get(client, '/get_parcels', {"limit": 1000}), iterations)
+    run("get_parcels_for_parcels_management",
+        checked_get(client, '/get_parcels_for_parcels_management'), listing_iterations)
+    run("get_parcels_by_status_and_distributor",
+        checked_get(client, '/get_parcels_by_status_and_distributor',
+                    {**report_range, "distributors": ["all"]}), iterations)
+    run("get_lost_parcels",
+        checked_get(client, '/get_lost_parcels',
+                    {**report_range, "distributors": ["all"], "sites": ["all"], "status": "Lost"}), iterations)
+    run("get_parcels_for_held_report",
+        checked_get(client, '/get_parcels_for_held_report',
+                    {**report_range, "distributors": ["all"], "sites": ["all"], "exelotCodes": ["30", "40"]}),
+        iterations)
+    run("get_parcels_for_pudo_report",
+        checked_get(client, '/get_parcels_for_pudo_report',
+                    {**report_range, "distributors": ["all"], "sites": ["all"], "exelotCodes": ["52"]}),
+        iterations)
+
+    # The parcel IDs follow the generator's numbering, their distributor is read back for a valid status
+    sample_ids = [parcel_id(rng.randrange(size)) for _ in range(200)]
+    sample_parcels = list(services.parcels_collection.find({"ID": {"$in": sample_ids}},
+                                                             {"ID": 1, "Distributor": 1}))
+
+    def update_one_parcel():
+        parcel = rng.choice(sample_parcels)
+        response = client.patch(f"/update_parcel/{parcel['ID']}", json={
+            "Status": rng.choice(statuses_by_distributor[parcel["Distributor"]]),
+            "Comments": "benchmark",
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"PATCH /update_parcel returned {response.status_code}")
+
+    run("update_parcel", update_one_parcel, iterations)
+
+    csv_rows = min(args.csv_rows, size)
+
+    def update_parcels_from_csv():
+        rows = []
+        for _ in range(csv_rows):
+            distributor = rng.choice(DISTRIBUTORS)
+            rows.append({
+                # A few unknown IDs exercise the missing-parcel path
+                "ID": parcel_id(rng.randrange(int(size * 1.01))),
+                "Status": rng.choice(STATUS_NAMES[rng.choice(list(STATUS_NAMES))]),
+                "Comments": f"benchmark {distributor}",
+                "Status DT": (now - timedelta(days=rng.randint(0, 10))).strftime('%d/%m/%Y'),
+            })
+        tasks.update_parcels_task.apply(args=[rows]).get()
+
+    run("update_parcels_task", update_parcels_from_csv, max(1, iterations // 10), units=csv_rows)
+
+    def ingest_parcels():
+        lines = []
+        for _ in range(csv_rows):
+            distributor = rng.choice(DISTRIBUTORS)
+            lines.append(json.dumps({
+                # About one record in ten creates a parcel
+                "ID": parcel_id(rng.randrange(int(size * 1.1))),
+                "Distributor": distributor,
+                "Site": rng.choice(SITES),
+                "Status": rng.choice(statuses_by_distributor[distributor]),
+                "Status DT": (now - timedelta(minutes=rng.randint(0, 14400))).isoformat(),
+            }))
+        response = client.post('/ingest_parcels', data="\n".join(lines), content_type='application/x-ndjson')
+        if response.status_code != 200:
+            raise RuntimeError(f"POST /ingest_parcels returned {response.status_code}")
+
+    run("ingest_parcels", ingest_parcels, max(1, iterations // 10), units=csv_rows)
+
+    original_queue_emails = tasks.queue_emails
+    tasks.queue_emails = queue_no_emails
+    try:
+        run("check_parcels_and_notify", tasks.check_parcels_and_notify, max(1, iterations // 10))
+    finally:
+        tasks.queue_emails = original_queue_emails
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Print the relative change of every metric between two result files
+def compare(baseline, current, threshold):
+    regressions = 0
+    for size, scenarios in current["sizes"].items():
+        for name, metrics in scenarios.items():
+            old_metrics = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not old_metrics:
+                continue
+            for metric, worse in COMPARED_METRICS.items():
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                regressed = change > threshold if worse == "higher" else change < -threshold
+                regressions += regressed
+                flag = "  REGRESSION" if regressed else ""
+                print(f"{size:>8} {name:<40} {metric:<22} {old:>12} -> {new:>12} ({change:+.1f}%){flag}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the endpoints and tasks on synthetic parcel data")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--db-name', default='logistics_DB_benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--csv-rows', type=int, default=5000)
+    parser.add_argument('--audits-per-parcel', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--no-rollups', action='store_true', help="Run the reports on the raw parcels")
+    parser.add_argument('--output', default=None, help="Result file (default benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', default=None, help="Baseline result file to diff against")
+    parser.add_argument('--threshold', type=float, default=10.0, help="Change in percent flagged as a regression")
+    parser.add_argument('--allow-remote', action='store_true', help="Allow a MongoDB that is not on localhost")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if urlparse(args.mongo_uri).hostname not in ('localhost', '127.0.0.1') and not args.allow_remote:
+        sys.exit("The benchmark drops and refills its database, point it at a local mongod "
+                 "(or pass --allow-remote)")
+
+    # Configure the app before importing it: benchmark database, no Redis caches, no scheduler
+    os.environ['MONGO_URI'] = args.mongo_uri
+    os.environ['MONGO_DB_NAME'] = args.db_name
+    os.environ['REDIS_URL'] = ''
+    os.environ['WORKER'] = 'false'
+
+    counter = RoundTripCounter()
+    monitoring.register(counter)
+
+    from app import create_app
+    from indexes import ensure_indexes
+    import services
+    import tasks
+    # Old-style name, like the rest of the Celery settings loaded from Config: Celery refuses a mix
+    tasks.celery.conf.CELERY_ALWAYS_EAGER = True
+    web_app = create_app()
+
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "rollups": not args.no_rollups,
+        "sizes": {},
+    }
+    for size in args.sizes:
+        print(f"Generating {size} parcels ...", flush=True)
+        generate_dataset(services.db, size, seed=args.seed, audits_per_parcel=args.audits_per_parcel)
+        ensure_indexes(services.db)
+        if not args.no_rollups:
+            services.report_rollups.rebuild()
+        services.status_catalog.invalidate()
+        results["sizes"][str(size)] = run_scenarios(web_app, counter, size, args)
+
+    output = args.output or os.path.join('benchmarks', 'results', f"{results['git_commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as result_file:
+        json.dump(results, result_file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(json.load(baseline_file), results, args.threshold)
+        if regressions:
+            sys.exit(f"{regressions} metrics regressed by more than {args.threshold}%")
+
+
+if __name__ == '__main__':
+    main()
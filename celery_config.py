@@ -1,20 +1,12 @@
 from celery import Celery
 
 
-def make_celery(app):
+# Celery app configured from the Config mapping, without a Flask app: the worker processes never import Flask
+def make_celery(name, config):
     celery = Celery(
-        app.import_name,
-        backend=app.config['CELERY_RESULT_BACKEND'],
-        broker=app.config['CELERY_BROKER_URL']
+        name,
+        backend=config['CELERY_RESULT_BACKEND'],
+        broker=config['CELERY_BROKER_URL']
     )
-    celery.conf.update(app.config)
-
-    class ContextTask(celery.Task):
-        def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return super().__call__(*args, **kwargs)
-
-    # Register the custom task class with celery
-    celery.Task = ContextTask
-
+    celery.conf.update(config)
     return celery
@@ -0,0 +1,77 @@
+import gzip
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # br is only offered when the Brotli package is installed
+    brotli = None
+
+# Content types worth compressing
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain')
+
+
+def _negotiate():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+# Compress a streamed body chunk by chunk
+def _iter_compressed(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, wbits=31)
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield finish()
+
+
+# The ETag of a compressed response carries its encoding, so each representation has its own strong ETag
+def encoded_etags(etag):
+    return [etag, f"{etag}-gzip", f"{etag}-br"]
+
+
+# Compress the JSON, NDJSON, CSV and text responses with br or gzip, as accepted by the client.
+# Buffered bodies smaller than min_size are sent as is, streamed bodies are compressed on the fly.
+def init_compression(app, min_size=1024, level=6):
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        encoding = _negotiate()
+        response.vary.add('Accept-Encoding')
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = _iter_compressed(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(_compress(data, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak=weak)
+        return response
@@ -1,6 +1,125 @@
 import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()  # Load environment variables from .env file
 
 
 class Config:
     CELERY_BROKER_URL = os.getenv('REDIS_URL')
     CELERY_RESULT_BACKEND = os.getenv('REDIS_URL')
+    # Keep the logging set up by log_setup in the worker too
+    CELERYD_HIJACK_ROOT_LOGGER = False
+
+    # Name of the MongoDB database holding the collections
+    MONGO_DB_NAME = os.getenv('MONGO_DB_NAME', 'logistics_DB')
+    # Connection pool of each process' MongoDB client
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '300000'))
+    # maxTimeMS of the listing and report queries per endpoint as "endpoint=ms,...", 'default' for the others
+    # (0 for no budget). A query over its budget is answered with a 503.
+    QUERY_TIME_BUDGETS_MS = os.getenv(
+        'QUERY_TIME_BUDGETS_MS',
+        'default=30000,get_parcels_by_status_and_distributor=15000,get_lost_parcels=15000,'
+        'get_parcels_for_held_report=15000,get_parcels_for_pudo_report=15000'
+    )
+
+    # Number of CSV rows applied per bulk write in update_parcels_task
+    CSV_BATCH_SIZE = int(os.getenv('CSV_BATCH_SIZE', '1000'))
+
+    # Where uploaded CSV files are spooled before the worker parses them: 'gridfs' or 'local'
+    CSV_SPOOL_BACKEND = os.getenv('CSV_SPOOL_BACKEND', 'gridfs')
+    CSV_SPOOL_DIR = os.getenv('CSV_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'csv_uploads'))
+
+    # Number of CSV rows handed to each worker task when a job is fanned out
+    CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '5000'))
+    # Maximum number of row errors kept on a CSV job
+    CSV_JOB_MAX_ERRORS = int(os.getenv('CSV_JOB_MAX_ERRORS', '100'))
+
+    # Redis instance shared by Celery and the in-process caches
+    REDIS_URL = os.getenv('REDIS_URL')
+    # How often each process compares its status catalog with the version stamp in Redis
+    STATUS_CATALOG_CHECK_SECONDS = float(os.getenv('STATUS_CATALOG_CHECK_SECONDS', '1'))
+
+    # Largest page size accepted by the paginated parcel listings
+    PARCELS_PAGE_MAX = int(os.getenv('PARCELS_PAGE_MAX', '5000'))
+
+    # SMTP server used for the notification emails
+    SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+    SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+    SMTP_USE_TLS = os.getenv('SMTP_USE_TLS', 'true').lower() == 'true'
+
+    # Delivery of the email outbox: attempts after the first one, delay before the first retry (doubled
+    # on each retry), sends allowed overall per minute and per distributor per hour (0 for no limit),
+    # time after which an email stuck in sending is taken again, and age of a pending email queued again
+    EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', '5'))
+    EMAIL_RETRY_BACKOFF_SECONDS = int(os.getenv('EMAIL_RETRY_BACKOFF_SECONDS', '30'))
+    EMAIL_RATE_LIMIT_PER_MINUTE = int(os.getenv('EMAIL_RATE_LIMIT_PER_MINUTE', '20'))
+    EMAIL_RATE_LIMIT_PER_DISTRIBUTOR_PER_HOUR = int(os.getenv('EMAIL_RATE_LIMIT_PER_DISTRIBUTOR_PER_HOUR', '10'))
+    EMAIL_SENDING_TIMEOUT_SECONDS = int(os.getenv('EMAIL_SENDING_TIMEOUT_SECONDS', '600'))
+    EMAIL_REDELIVER_AFTER_SECONDS = int(os.getenv('EMAIL_REDELIVER_AFTER_SECONDS', '900'))
+
+    # Lifetime of the cached report responses, and the rounding of their dates in the cache key
+    # (0 keeps MongoDB's millisecond precision so a cached report is always exact)
+    REPORT_CACHE_TTL_SECONDS = int(os.getenv('REPORT_CACHE_TTL_SECONDS', '300'))
+    REPORT_CACHE_DATE_ROUNDING_SECONDS = int(os.getenv('REPORT_CACHE_DATE_ROUNDING_SECONDS', '0'))
+
+    # How often each process pushes its metrics to Redis
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '1'))
+
+    # Logging: 'text' or 'json' lines, the root level, per-module levels as "module=LEVEL,..."
+    # and the number of DEBUG records let through per call site every second
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.getenv('LOG_LEVELS', 'pymongo=WARNING')
+    LOG_DEBUG_SAMPLES_PER_SECOND = int(os.getenv('LOG_DEBUG_SAMPLES_PER_SECOND', '5'))
+
+    # How update_parcel writes the audit record next to the parcel update:
+    # 'write_behind' (the audit unacknowledged, the rollup increments still acknowledged)
+    # or 'transaction' (requires a replica set)
+    AUDIT_WRITE_MODE = os.getenv('AUDIT_WRITE_MODE', 'write_behind')
+
+    # Largest number of parcels accepted by one PATCH /update_parcels request
+    BULK_UPDATE_MAX_ITEMS = int(os.getenv('BULK_UPDATE_MAX_ITEMS', '1000'))
+
+    # Live events of GET /events: events kept for the reconnecting clients, open streams per web process
+    # (each one holds a gunicorn thread), heartbeat interval and lifetime of a stream before the browser
+    # reconnects, in seconds
+    EVENTS_STREAM_MAX_LEN = int(os.getenv('EVENTS_STREAM_MAX_LEN', '10000'))
+    EVENTS_MAX_CONNECTIONS = int(os.getenv('EVENTS_MAX_CONNECTIONS', '8'))
+    EVENTS_HEARTBEAT_SECONDS = float(os.getenv('EVENTS_HEARTBEAT_SECONDS', '15'))
+    EVENTS_MAX_STREAM_SECONDS = float(os.getenv('EVENTS_MAX_STREAM_SECONDS', '600'))
+
+    # Number of NDJSON records upserted per bulk write by POST /ingest_parcels,
+    # and the number of record errors reported back
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '1000'))
+    INGEST_MAX_ERRORS = int(os.getenv('INGEST_MAX_ERRORS', '100'))
+
+    # Largest number of parcels accepted by one POST /get_parcels_history request
+    HISTORY_BATCH_MAX_IDS = int(os.getenv('HISTORY_BATCH_MAX_IDS', '500'))
+
+    # Audits older than this many days are moved to the monthly archive collections,
+    # compressed with the given WiredTiger block compressor (empty for the server default)
+    AUDIT_ARCHIVE_AFTER_DAYS = int(os.getenv('AUDIT_ARCHIVE_AFTER_DAYS', '180'))
+    AUDIT_ARCHIVE_COMPRESSOR = os.getenv('AUDIT_ARCHIVE_COMPRESSOR', 'zstd')
+    AUDIT_ARCHIVE_BATCH_SIZE = int(os.getenv('AUDIT_ARCHIVE_BATCH_SIZE', '1000'))
+
+    # Responses of at least COMPRESS_MIN_SIZE bytes are compressed with br or gzip at COMPRESS_LEVEL
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+    # X-Sync-Since is set this many seconds in the past, so a delta never misses a write still in flight
+    SYNC_OVERLAP_SECONDS = int(os.getenv('SYNC_OVERLAP_SECONDS', '5'))
+
+    # Crontab schedules ("minute hour day month day_of_week", empty to disable) of the scheduled jobs,
+    # in SCHEDULE_TIMEZONE. A run missed while no worker was up is caught up within SCHEDULE_CATCHUP_HOURS.
+    SCHEDULE_TIMEZONE = os.getenv('SCHEDULE_TIMEZONE', 'Asia/Jerusalem')
+    SCHEDULE_CHECK_PARCELS_AND_NOTIFY = os.getenv('SCHEDULE_CHECK_PARCELS_AND_NOTIFY', '0 9 * * sun,mon,tue,wed,thu')
+    SCHEDULE_RECONCILE_OVERDUE_INDEX = os.getenv('SCHEDULE_RECONCILE_OVERDUE_INDEX', '30 8 * * *')
+    SCHEDULE_REBUILD_REPORT_ROLLUPS = os.getenv('SCHEDULE_REBUILD_REPORT_ROLLUPS', '0 3 * * *')
+    SCHEDULE_ARCHIVE_AUDITS = os.getenv('SCHEDULE_ARCHIVE_AUDITS', '0 2 * * *')
+    SCHEDULE_REDELIVER_EMAILS = os.getenv('SCHEDULE_REDELIVER_EMAILS', '*/10 * * * *')
+    SCHEDULE_PUBLISH_OVERDUE_COUNTS = os.getenv('SCHEDULE_PUBLISH_OVERDUE_COUNTS', '*/5 * * * *')
+    SCHEDULE_CATCHUP_HOURS = float(os.getenv('SCHEDULE_CATCHUP_HOURS', '12'))
+    # Lease of the scheduler leader lock in Redis, renewed every third of it
+    SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', '30'))
@@ -0,0 +1,61 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+
+# Columns read by the CSV import, exported by default so an export can be uploaded back
+IMPORT_COLUMNS = ("ID", "Status", "Comments", "Status DT")
+# Date format of the Status DT column, on import and export
+CSV_DATE_FORMAT = '%d/%m/%Y'
+# Size of the chunks handed to the WSGI server
+CHUNK_SIZE = 64 * 1024
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.strftime(CSV_DATE_FORMAT)
+    return value
+
+
+# Encode rows (dicts) as CSV with a header line, yielding UTF-8 chunks of about CHUNK_SIZE bytes
+# so only one chunk is ever held in memory
+def iter_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(row.get(column)) for column in columns])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+# Compress a stream of chunks into a gzip file on the fly
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# Streaming download of rows as filename.csv, or filename.csv.gz when compress is set.
+# rows is consumed lazily (a MongoDB cursor is read batch by batch as the client downloads).
+def csv_response(rows, columns, filename, compress=False):
+    from flask import Response, stream_with_context
+
+    chunks = iter_csv(rows, columns)
+    if compress:
+        chunks = iter_gzip(chunks)
+        filename, mimetype = f"{filename}.csv.gz", 'application/gzip'
+    else:
+        filename, mimetype = f"{filename}.csv", 'text/csv'
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,127 @@
+import csv
+import os
+import uuid
+from bson import ObjectId
+from gridfs import GridFSBucket
+
+# Size of the blocks read from the request body and written to the spool
+CHUNK_SIZE = 64 * 1024
+
+
+# Yield a binary stream block by block until it is exhausted
+def read_in_chunks(stream, chunk_size=CHUNK_SIZE):
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+# Spool backed by GridFS, shared by the web and worker dynos through MongoDB
+class GridFSSpool:
+    def __init__(self, db, bucket_name='csv_uploads'):
+        self.db = db
+        self.bucket_name = bucket_name
+
+    # Built on use, so it always runs on the MongoDB client of the current process
+    @property
+    def bucket(self):
+        return GridFSBucket(self.db.client[self.db.name], bucket_name=self.bucket_name)
+
+    def save(self, chunks, filename):
+        size = 0
+        with self.bucket.open_upload_stream(filename) as upload:
+            for chunk in chunks:
+                upload.write(chunk)
+                size += len(chunk)
+        return str(upload._id), size
+
+    def open(self, ref):
+        return self.bucket.open_download_stream(ObjectId(ref))
+
+    def delete(self, ref):
+        self.bucket.delete(ObjectId(ref))
+
+
+# Spool backed by a local directory, for setups where web and worker share a disk
+class LocalSpool:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, ref):
+        return os.path.join(self.directory, f"{ref}.csv")
+
+    def save(self, chunks, filename):
+        ref = uuid.uuid4().hex
+        size = 0
+        with open(self._path(ref), 'wb') as spool_file:
+            for chunk in chunks:
+                spool_file.write(chunk)
+                size += len(chunk)
+        return ref, size
+
+    def open(self, ref):
+        return open(self._path(ref), 'rb')
+
+    def delete(self, ref):
+        try:
+            os.remove(self._path(ref))
+        except FileNotFoundError:
+            pass
+
+
+def make_csv_spool(config, db):
+    if config['CSV_SPOOL_BACKEND'] == 'local':
+        return LocalSpool(config['CSV_SPOOL_DIR'])
+    return GridFSSpool(db)
+
+
+# Yield the decoded lines of a spooled file between two byte offsets,
+# recording in position['offset'] how far the consumer has read
+def _iter_lines(spool_file, end, position):
+    while end is None or position['offset'] < end:
+        line = spool_file.readline()
+        if not line:
+            return
+        position['offset'] += len(line)
+        yield line.decode('utf-8')
+
+
+# Read the header of a spooled CSV and return the field names and the offset of the first data row
+def read_csv_header(spool_file):
+    header_line = spool_file.readline()
+    fieldnames = next(csv.reader([header_line.decode('utf-8-sig')]), [])
+    return fieldnames, len(header_line)
+
+
+# Lazily parse the rows of a spooled CSV between two byte offsets.
+# A start of 0 means the first data row, an end of None means the end of the file.
+def iter_csv_rows(spool, ref, start=0, end=None):
+    with spool.open(ref) as spool_file:
+        fieldnames, data_start = read_csv_header(spool_file)
+        start = max(start, data_start)
+        spool_file.seek(start)
+        position = {'offset': start}
+        for row in csv.DictReader(_iter_lines(spool_file, end, position), fieldnames=fieldnames):
+            yield row
+
+
+# Split a spooled CSV into chunks of rows_per_chunk data rows.
+# Yields (start, end, first_row, rows) with byte offsets that fall on row boundaries,
+# so quoted fields spanning several lines are never cut in half.
+def iter_chunk_offsets(spool, ref, rows_per_chunk):
+    with spool.open(ref) as spool_file:
+        _, start = read_csv_header(spool_file)
+        position = {'offset': start}
+        rows = 0
+        first_row = 1
+        for _ in csv.reader(_iter_lines(spool_file, None, position)):
+            rows += 1
+            if rows == rows_per_chunk:
+                yield start, position['offset'], first_row, rows
+                start = position['offset']
+                first_row += rows
+                rows = 0
+        if rows:
+            yield start, position['offset'], first_row, rows
@@ -0,0 +1,81 @@
+import os
+import threading
+from pymongo import MongoClient
+
+# MongoDB error code of a duplicate key
+DUPLICATE_KEY = 11000
+
+
+# One MongoClient per process, created on first use. A client created before a fork
+# (gunicorn --preload, the Celery prefork pool) is never reused by the child: the first
+# access in a new process opens a client of its own.
+class MongoConnection:
+    def __init__(self, uri, db_name, **client_options):
+        self.uri = uri
+        self.db_name = db_name
+        self.client_options = client_options
+        self._lock = threading.Lock()
+        self._client = None
+        self._pid = None
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = MongoClient(self.uri, **self.client_options)
+                    self._pid = os.getpid()
+        return self._client
+
+    def database(self, **options):
+        return LazyDatabase(self, **options)
+
+
+# Stands for a pymongo Database of the current process' client, with the given options
+# (read_preference, write_concern...). Attribute access is forwarded to the real Database.
+class LazyDatabase:
+    def __init__(self, connection, **options):
+        self._connection = connection
+        self._options = options
+
+    def get(self):
+        return self._connection.client.get_database(self._connection.db_name, **self._options)
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Stands for a pymongo Collection of the current process' client, with the given options.
+# The real Collection is cached per process.
+class LazyCollection:
+    def __init__(self, database, name, **options):
+        self._database = database
+        self._name = name
+        self._options = options
+        self._collection = None
+        self._pid = None
+
+    def get(self):
+        if self._pid != os.getpid():
+            self._collection = self._database.get().get_collection(self._name, **self._options)
+            self._pid = os.getpid()
+        return self._collection
+
+    def with_options(self, **options):
+        return LazyCollection(self._database, self._name, **{**self._options, **options})
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+# Parse "default=30000,get_lost_parcels=15000" into {endpoint: maxTimeMS}, 0 meaning no budget
+def parse_time_budgets(value):
+    budgets = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, milliseconds = item.split('=', 1)
+            budgets[name.strip()] = int(milliseconds)
+    return budgets
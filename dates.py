@@ -0,0 +1,8 @@
+from datetime import timezone
+
+
+# Convert a datetime to the naive UTC form MongoDB hands back
+def to_utc(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
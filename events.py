@@ -0,0 +1,121 @@
+import json
+import re
+import time
+from datetime import datetime
+import redis
+
+# Delay before the browser reconnects after the stream ends, in milliseconds
+RECONNECT_MS = 5000
+
+STREAM_ID = re.compile(r'^\d+-\d+$')
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _parse_stream_id(value):
+    milliseconds, sequence = value.split('-')
+    return int(milliseconds), int(sequence)
+
+
+def _format_event(event_type, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id else []
+    return "\n".join(lines + [f"event: {event_type}", f"data: {data}"]) + "\n\n"
+
+
+# Parcel events shared by every process through a Redis stream capped at about max_len entries.
+# A stream rather than pub/sub keeps the recent events: a client reconnecting with its Last-Event-ID
+# gets the ones it missed. Event IDs are the stream entry IDs.
+# The stream is trimmed here rather than by XADD MAXLEN, so the ID of the last trimmed entry is known:
+# a client whose Last-Event-ID is at or after it missed nothing.
+class EventFeed:
+    STREAM_KEY = 'events:parcels'
+    TRIMMED_KEY = 'events:parcels:trimmed'
+    TRIM_LOCK_KEY = 'events:parcels:trim_lock'
+
+    def __init__(self, redis_client, max_len=10000):
+        self.redis = redis_client
+        self.max_len = max_len
+
+    # Add events given as (type, data) pairs. Live updates are best effort, the listings stay authoritative.
+    def publish(self, events):
+        if self.redis is None:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for event_type, data in events:
+                pipeline.xadd(self.STREAM_KEY, {"type": event_type, "data": json.dumps(data, default=_json_default)})
+            pipeline.xlen(self.STREAM_KEY)
+            length = pipeline.execute()[-1]
+            # Trimmed once it is a tenth over max_len, so the trims are spread over many publishes
+            if length > self.max_len + self.max_len // 10:
+                self.trim(length)
+        except redis.RedisError:
+            pass
+
+    # Drop the oldest entries down to max_len, one process at a time. The last dropped ID is recorded
+    # before the entries go, so a reader never misses a gap.
+    def trim(self, length):
+        if not self.redis.set(self.TRIM_LOCK_KEY, 1, nx=True, ex=10):
+            return
+        try:
+            entries = self.redis.xrange(self.STREAM_KEY, count=length - self.max_len)
+            if not entries:
+                return
+            last_trimmed = entries[-1][0].decode('utf-8')
+            self.redis.set(self.TRIMMED_KEY, last_trimmed)
+            milliseconds, sequence = _parse_stream_id(last_trimmed)
+            # MINID keeps the entries from the given ID on
+            self.redis.xtrim(self.STREAM_KEY, minid=f"{milliseconds}-{sequence + 1}", approximate=False)
+        finally:
+            self.redis.delete(self.TRIM_LOCK_KEY)
+
+    # ID of the latest event, where a new subscriber starts
+    def latest_id(self):
+        entries = self.redis.xrevrange(self.STREAM_KEY, count=1)
+        return entries[0][0].decode('utf-8') if entries else '0-0'
+
+    # Whether an event following last_id was trimmed from the stream. Losing last_id itself is no gap.
+    def trimmed_since(self, last_id):
+        last_trimmed = self.redis.get(self.TRIMMED_KEY)
+        return last_trimmed is not None and _parse_stream_id(last_trimmed.decode('utf-8')) > _parse_stream_id(last_id)
+
+    # Wait up to block_ms for the events after last_id: [(id, type, data as JSON)]
+    def read(self, last_id, block_ms, count=500):
+        events = []
+        for _, entries in self.redis.xread({self.STREAM_KEY: last_id}, count=count, block=block_ms) or []:
+            for entry_id, fields in entries:
+                events.append((entry_id.decode('utf-8'), fields[b'type'].decode('utf-8'),
+                               fields[b'data'].decode('utf-8')))
+        return events
+
+    # Server-sent events after last_id, as text chunks. A subscriber without a usable last_id starts at the
+    # latest event, after a 'reset' event if its last_id was invalid or trimmed, and gets the (type, data)
+    # pairs of snapshot() first. A comment goes out every heartbeat seconds without events, so dead
+    # connections are noticed, and the stream ends after max_seconds: the browser reconnects with its
+    # Last-Event-ID. A Redis error ends the stream the same way.
+    def iter_sse(self, last_id=None, heartbeat=15, max_seconds=600, snapshot=None):
+        yield f"retry: {RECONNECT_MS}\n\n"
+        try:
+            if last_id is not None and (not STREAM_ID.match(last_id) or self.trimmed_since(last_id)):
+                yield _format_event("reset", "{}")
+                last_id = None
+            if last_id is None:
+                last_id = self.latest_id()
+                for event_type, data in (snapshot() if snapshot else ()):
+                    yield _format_event(event_type, json.dumps(data, default=_json_default))
+
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                events = self.read(last_id, block_ms=int(heartbeat * 1000))
+                if not events:
+                    yield ": heartbeat\n\n"
+                    continue
+                for event_id, event_type, data in events:
+                    last_id = event_id
+                    yield _format_event(event_type, data, event_id)
+        except redis.RedisError:
+            return
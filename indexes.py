@@ -0,0 +1,155 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, IndexModel
+
+# Indexes declared per collection, with the endpoints that rely on them.
+# ensure_indexes creates them idempotently: an index that already exists with the same keys is left alone.
+INDEXES = {
+    'Parcels': [
+        # update_parcel, update_parcels_task, ingest_parcels (unique: two concurrent uploads of a new parcel
+        # cannot both insert it)
+        IndexModel([("ID", ASCENDING)], name="ID", unique=True),
+        # get_parcels_for_parcels_management, check_parcels_and_notify, get_parcels_by_status_and_distributor
+        IndexModel([("Status DT", ASCENDING)], name="Status DT"),
+        # get_parcels and get_parcels_for_parcels_management with since (delta sync)
+        IndexModel([("Updated DT", ASCENDING)], name="Updated DT"),
+        # get_parcels_by_status_and_distributor filtered by distributors
+        IndexModel([("Distributor", ASCENDING), ("Status DT", ASCENDING)], name="Distributor_Status DT"),
+        # get_lost_parcels
+        IndexModel([("Status", ASCENDING), ("Status DT", ASCENDING)], name="Status_Status DT"),
+        # get_parcels_for_held_report, get_parcels_for_pudo_report
+        IndexModel([("Exelot Code", ASCENDING), ("Status DT", ASCENDING)], name="Exelot Code_Status DT"),
+    ],
+    'Statuses': [
+        # get_valid_statuses
+        IndexModel([("Distributor", ASCENDING), ("Active", ASCENDING)], name="Distributor_Active"),
+    ],
+    'Audits': [
+        # get_parcel_history
+        IndexModel([("Parcel ID", ASCENDING), ("Change DT", ASCENDING)], name="Parcel ID_Change DT"),
+        # archive_audits
+        IndexModel([("Change DT", ASCENDING)], name="Change DT"),
+    ],
+    'Report Rollups': [
+        # update_parcel, update_parcels_task ($inc on a bucket) and the report endpoints
+        IndexModel([("Day", ASCENDING), ("Distributor", ASCENDING), ("Site", ASCENDING),
+                    ("Status", ASCENDING), ("Exelot Code", ASCENDING)], name="Day_Bucket", unique=True),
+    ],
+    'Scheduled Runs': [
+        # The scheduler claims each fire time of a job once, get_scheduled_runs
+        IndexModel([("Job", ASCENDING), ("Scheduled DT", ASCENDING)], name="Job_Scheduled DT", unique=True),
+    ],
+    'Email Outbox': [
+        # redeliver_emails
+        IndexModel([("Status", ASCENDING), ("Next Attempt DT", ASCENDING)], name="Status_Next Attempt DT"),
+    ],
+    'Distributors': [
+        # check_parcels_and_notify
+        IndexModel([("Name", ASCENDING)], name="Name"),
+    ],
+}
+
+
+# Representative query of each endpoint: (endpoint, collection, filter).
+# Dates are built when the check runs so the ranges look like real requests.
+def representative_queries():
+    now = datetime.now(timezone.utc)
+    month_ago = now - timedelta(days=30)
+    return [
+        ("get_parcels_for_parcels_management", 'Parcels',
+         {"Status DT": {"$lt": now - timedelta(hours=48)}, "Exelot Code": {"$nin": ["73", "52", "99"]}}),
+        ("update_parcel", 'Parcels', {"ID": "0"}),
+        ("get_parcels", 'Parcels', {"Updated DT": {"$gt": now - timedelta(minutes=5)}}),
+        ("update_parcels_task", 'Parcels', {"ID": {"$in": ["0", "1"]}}),
+        ("get_parcels_by_status_and_distributor", 'Parcels',
+         {"Status DT": {"$gte": month_ago, "$lte": now}, "Distributor": {"$in": ["YDM", "HFD"]}}),
+        ("get_lost_parcels", 'Parcels',
+         {"Status": "Lost", "Status DT": {"$gte": month_ago, "$lte": now}}),
+        ("get_parcels_for_held_report", 'Parcels',
+         {"Exelot Code": {"$in": ["52"]}, "Status DT": {"$gte": month_ago, "$lte": now}}),
+        ("get_parcels_for_pudo_report", 'Parcels',
+         {"Exelot Code": {"$in": ["73"]},
+          "Status DT": {"$gte": month_ago, "$lte": now, "$lt": now - timedelta(days=7)}}),
+        ("get_valid_statuses", 'Statuses', {"Distributor": "YDM", "Active": True}),
+        ("get_parcel_history", 'Audits', {"Parcel ID": "0"}),
+        ("archive_audits", 'Audits', {"Change DT": {"$lt": now - timedelta(days=180)}}),
+        ("check_parcels_and_notify", 'Distributors', {"Name": {"$in": ["YDM", "HFD"]}}),
+    ]
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+class DuplicateKeysError(Exception):
+    pass
+
+
+# Keys shared by several documents of a collection, which block a unique index on them: [(keys, count)]
+def find_duplicates(collection, keys, limit=20):
+    pipeline = [
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "Count": {"$sum": 1}}},
+        {"$match": {"Count": {"$gt": 1}}},
+        {"$limit": limit}
+    ]
+    return [(group["_id"], group["Count"]) for group in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+# A unique index not built yet is checked for duplicates first. Without any, it replaces an existing
+# non-unique index of the same name (dropped first, MongoDB keeps one index per key pattern).
+# With duplicates, the keys keep a non-unique index and DuplicateKeysError lists them once
+# every other index is created, so they can be cleaned before the next run.
+def ensure_indexes(db):
+    created = {}
+    blocked = []
+    for collection_name, index_models in INDEXES.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+        models = []
+        for model in index_models:
+            name, keys = model.document["name"], list(model.document["key"].items())
+            if model.document.get("unique") and not existing.get(name, {}).get("unique"):
+                duplicates = find_duplicates(collection, [key for key, _ in keys])
+                if duplicates:
+                    blocked.append((collection_name, name, duplicates))
+                    model = IndexModel(keys, name=name)
+                elif name in existing:
+                    collection.drop_index(name)
+            models.append(model)
+        created[collection_name] = collection.create_indexes(models)
+
+    if blocked:
+        details = "; ".join(f"{collection_name}.{name}: {', '.join(f'{keys} x{count}' for keys, count in duplicates)}"
+                            for collection_name, name, duplicates in blocked)
+        raise DuplicateKeysError(f"Unique indexes blocked by duplicates, clean them and run again: {details}")
+    return created
+
+
+# Collect the stages of an explain() plan, whatever the nesting of the query engine in use
+def _plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+
+# Explain every representative query and return the endpoints whose winning plan is a collection scan
+def find_collection_scans(db):
+    collection_scans = []
+    for endpoint, collection_name, query in representative_queries():
+        explanation = db[collection_name].find(query).explain()
+        winning_plan = explanation.get('queryPlanner', {}).get('winningPlan', {})
+        if 'COLLSCAN' in set(_plan_stages(winning_plan)):
+            collection_scans.append((endpoint, collection_name, query))
+    return collection_scans
+
+
+def check_query_plans(db):
+    collection_scans = find_collection_scans(db)
+    if collection_scans:
+        details = "; ".join(f"{endpoint} on {collection_name}: {query}"
+                            for endpoint, collection_name, query in collection_scans)
+        raise QueryPlanError(f"COLLSCAN in the winning plan of {len(collection_scans)} queries: {details}")
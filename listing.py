@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+import redis
+from bson import ObjectId
+from flask import Response, current_app, g, request, jsonify, stream_with_context, has_request_context
+from csv_export import csv_response, IMPORT_COLUMNS
+from compression import encoded_etags
+from database import parse_time_budgets
+from services import config, redis_client, metrics_registry, parcels_collection, parcels_reads, report_cache
+
+# Helpers shared by the parcel and report blueprints: query time budgets, parcel listings and ETags
+
+logger = logging.getLogger(__name__)
+
+# maxTimeMS budgets of the queries per endpoint
+query_time_budgets = parse_time_budgets(config['QUERY_TIME_BUDGETS_MS'])
+
+
+# Name of the current view without its blueprint, as used by the per-endpoint settings
+def view_name():
+    return request.endpoint.rpartition('.')[2]
+
+
+# maxTimeMS of the current endpoint's queries, None outside a request or without a budget
+def query_time_budget():
+    if not has_request_context():
+        return None
+    return query_time_budgets.get(view_name(), query_time_budgets.get('default')) or None
+
+
+# Whether the response of the request is stamped with the parcels write generation, as a report going into
+# the report cache is. Such reads go to the primary: a lagging secondary would pair a body older than the
+# generation with it, served until the next write.
+def generation_stamped():
+    return has_request_context() and g.get('generation_stamped', False)
+
+
+# A query that ran past its maxTimeMS budget
+def query_timeout(e):
+    logger.warning("Query of %s exceeded its time budget: %s", request.endpoint, e)
+    response = jsonify({"error": "The query exceeded its time budget, narrow the request or retry later"})
+    response.headers['Retry-After'] = '30'
+    return response, 503
+
+
+# Serialize a MongoDB document the way jsonify does, with its ObjectId as a string
+def serialize_document(document):
+    document['_id'] = str(document['_id'])
+    return current_app.json.dumps(document)
+
+
+# Build the response of a parcel listing from the request parameters:
+# - limit / after: keyset pagination sorted on _id, 'after' being the _id of the last parcel received.
+#   The JSON format also returns the token of the next page in the X-Next-After header.
+# - fields: comma separated list of the fields to return
+# - format: 'json' (default), 'ndjson', 'stream' (a JSON array) or 'csv'; ndjson, stream and csv
+#   serialize the parcels from the cursor one at a time without building the full list.
+#   csv exports the columns of the CSV import (or the fields requested) and is gzipped with compress=gzip.
+# With an etag, a request whose If-None-Match matches gets a 304 without querying.
+# X-Sync-Since is the since value of the next delta request.
+def parcels_listing_response(query, etag=None):
+    sync_since = datetime.now(timezone.utc) - timedelta(seconds=current_app.config['SYNC_OVERLAP_SECONDS'])
+    output_format = request.args.get('format', 'json')
+    if output_format not in ('json', 'ndjson', 'stream', 'csv'):
+        raise ValueError("format must be one of json, ndjson, stream, csv")
+    compress = request.args.get('compress')
+    if compress not in (None, 'gzip'):
+        raise ValueError("compress must be gzip")
+
+    limit = request.args.get('limit')
+    if limit is not None:
+        if not limit.isdigit():
+            raise ValueError("limit must be a positive integer")
+        limit = int(limit)
+        if not 1 <= limit <= current_app.config['PARCELS_PAGE_MAX']:
+            raise ValueError(f"limit must be between 1 and {current_app.config['PARCELS_PAGE_MAX']}")
+
+    after = request.args.get('after')
+    if after:
+        if not ObjectId.is_valid(after):
+            raise ValueError("Invalid after token")
+        query = {**query, "_id": {"$gt": ObjectId(after)}}
+
+    fields = request.args.get('fields')
+    projection = {field.strip(): 1 for field in fields.split(',') if field.strip()} if fields else None
+    if output_format == 'csv' and not projection:
+        projection = {column: 1 for column in IMPORT_COLUMNS}
+
+    not_modified = not_modified_response(etag)
+    if not_modified is not None:
+        return not_modified
+
+    # Delta requests read the primary, a lagging secondary could miss writes older than their since.
+    # So does a response with an ETag, which carries the current write generation.
+    stamped = etag is not None or generation_stamped()
+    collection = parcels_collection if request.args.get('since') or stamped else parcels_reads
+    cursor = collection.find(query, projection)
+    # Streamed formats are paced by the client, only the buffered JSON gets a time budget
+    budget = query_time_budget()
+    if budget and output_format == 'json':
+        cursor = cursor.max_time_ms(budget)
+    if limit is not None or after:
+        cursor = cursor.sort('_id', 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    if output_format == 'csv':
+        columns = [field for field in projection if field != '_id']
+        response = csv_response(cursor, columns, view_name(), compress=compress == 'gzip')
+    elif output_format == 'ndjson':
+        def generate():
+            for parcel in cursor:
+                yield serialize_document(parcel) + '\n'
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    elif output_format == 'stream':
+        def generate():
+            separator = '['
+            for parcel in cursor:
+                yield separator + serialize_document(parcel)
+                separator = ','
+            yield '[]' if separator == '[' else ']'
+        response = Response(stream_with_context(generate()), mimetype='application/json')
+    else:
+        with metrics_registry.phase('query'):
+            parcels = list(cursor)
+        with metrics_registry.phase('serialization'):
+            for parcel in parcels:
+                parcel['_id'] = str(parcel['_id'])  # Convert ObjectId to string
+            response = jsonify(parcels)
+        if limit is not None and len(parcels) == limit:
+            response.headers['X-Next-After'] = parcels[-1]['_id']
+
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['X-Sync-Since'] = sync_since.isoformat()
+    return response
+
+
+# Strong ETag of a listing: its endpoint and parameters, the parcels write generation bumped by every
+# parcel update, and extra values the result depends on. None without Redis, as writes cannot be tracked.
+def listing_etag(*extra):
+    if redis_client is None:
+        return None
+    try:
+        generation = report_cache.generation()
+    except redis.RedisError:
+        return None
+    key = json.dumps([request.endpoint, report_cache.canonical_params(request.args), generation, *extra],
+                     default=str)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+# 304 response when the client's If-None-Match matches the ETag, in any of its encodings
+def not_modified_response(etag):
+    if etag is None:
+        return None
+    for candidate in encoded_etags(etag):
+        if request.if_none_match.contains(candidate):
+            response = Response(status=304)
+            response.set_etag(candidate)
+            return response
+    return None
+
+
+# The since parameter of a delta request: an ISO timestamp, usually the X-Sync-Since of the previous response
+def parse_since():
+    since = request.args.get('since')
+    if not since:
+        return None
+    try:
+        since = datetime.fromisoformat(since.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("since must be an ISO timestamp")
+    return since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+
+
+# Count the parcels matching a query grouped by the given fields inside MongoDB,
+# so only one document per group crosses the network. Missing fields group as 'Unknown'.
+def aggregate_parcels_by(query, fields):
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": {field: {"$ifNull": [f"${field}", "Unknown"]} for field in fields},
+            "Count": {"$sum": 1}
+        }}
+    ]
+    budget = query_time_budget()
+    options = {"maxTimeMS": budget} if budget else {}
+    collection = parcels_collection if generation_stamped() else parcels_reads
+    return [(group["_id"], group["Count"]) for group in collection.aggregate(pipeline, **options)]
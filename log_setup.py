@@ -0,0 +1,98 @@
+import json
+import logging
+import threading
+import time
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# Attributes every LogRecord has, anything else was passed through extra= and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+# Wraps a payload so it is only converted to a string, and cut to limit characters,
+# if the record is actually emitted
+class Truncated:
+    def __init__(self, value, limit=200):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
+    __repr__ = __str__
+
+
+def truncate(value, limit=200):
+    return Truncated(value, limit)
+
+
+# One JSON object per line: time, level, logger, message and the extra= fields
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+# Lets through at most per_second DEBUG records per call site every second and
+# reports how many were dropped on the next one let through. Other levels always pass.
+class DebugSamplingFilter(logging.Filter):
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno != logging.DEBUG:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = int(time.monotonic())
+        with self._lock:
+            window, emitted, dropped = self._windows.get(key, (now, 0, 0))
+            if window != now:
+                window, emitted = now, 0
+            if emitted >= self.per_second:
+                self._windows[key] = (window, emitted, dropped + 1)
+                return False
+            self._windows[key] = (window, emitted + 1, 0)
+        if dropped:
+            record.sampled_out = dropped
+        return True
+
+
+# Parse "app=DEBUG,pymongo=WARNING" into {logger name: level}
+def parse_levels(value):
+    levels = {}
+    for item in (value or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(config):
+    handler = logging.StreamHandler()
+    if config['LOG_FORMAT'] == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handler.addFilter(DebugSamplingFilter(config['LOG_DEBUG_SAMPLES_PER_SECOND']))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(config['LOG_LEVEL'].upper())
+    for name, level in parse_levels(config['LOG_LEVELS']).items():
+        logging.getLogger(name).setLevel(level)
@@ -0,0 +1,71 @@
+import logging
+import smtplib
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+logger = logging.getLogger(__name__)
+
+
+# Sends emails over authenticated SMTP sessions, one per sending thread.
+# Each thread opens its session once (connect, STARTTLS, login) and reuses it
+# for every following email, reconnecting only if the server dropped the connection.
+class SMTPMailer:
+    def __init__(self, host, port, sender_email, password, use_tls=True):
+        self.host = host
+        self.port = port
+        self.sender_email = sender_email
+        self.password = password
+        self.use_tls = use_tls
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._servers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port)
+        if self.use_tls:
+            server.starttls()
+        if self.password:
+            server.login(self.sender_email, self.password)
+        with self._lock:
+            self._servers.append(server)
+        self._local.server = server
+        return server
+
+    def _server(self):
+        server = getattr(self._local, 'server', None)
+        return server if server is not None else self._connect()
+
+    def _build_message(self, to_email, subject, body):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender_email
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg.as_string()
+
+    def send(self, to_email, subject, body):
+        message = self._build_message(to_email, subject, body)
+        try:
+            self._server().sendmail(self.sender_email, to_email, message)
+        except smtplib.SMTPServerDisconnected:
+            # The session timed out or was closed by the server, open a new one and retry once
+            self._connect().sendmail(self.sender_email, to_email, message)
+
+    def close(self):
+        with self._lock:
+            servers, self._servers = self._servers, []
+            self._local = threading.local()
+        for server in servers:
+            try:
+                server.quit()
+            except smtplib.SMTPException:
+                server.close()
+            except OSError:
+                pass
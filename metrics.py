@@ -0,0 +1,247 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+import redis
+from pymongo import monitoring
+
+# Histogram buckets for durations in seconds and for CSV row rates in rows per second
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+ROW_RATE_BUCKETS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+# Exposed metrics: name -> (type, help)
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by endpoint, method and status."),
+    "http_request_duration_seconds": ("histogram", "HTTP request duration by endpoint."),
+    "http_request_phase_seconds_total": ("counter", "Time spent per request phase (query, processing, serialization)."),
+    "celery_tasks_total": ("counter", "Celery tasks run by task and state."),
+    "celery_task_duration_seconds": ("histogram", "Celery task duration by task."),
+    "celery_task_rows_total": ("counter", "CSV rows handled by Celery tasks."),
+    "celery_task_rows_per_second": ("histogram", "CSV row rate of Celery tasks."),
+    "mongodb_commands_total": ("counter", "MongoDB commands (round trips) by endpoint or task and command."),
+    "mongodb_command_seconds_total": ("counter", "MongoDB command time by endpoint or task and command."),
+    "report_cache_requests_total": ("counter", "Report cache lookups by endpoint and outcome."),
+}
+
+# The endpoint or task being executed by the current thread
+_current_operation = contextvars.ContextVar('current_operation', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+def _format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float('inf') else repr(float(bound))
+
+
+# An endpoint or task in progress, collecting the DB time and the phase timings attributed to it
+class Operation:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.db_commands = 0
+        self.db_seconds = 0.0
+        self.phases = {}
+
+
+# Attributes every MongoDB command to the endpoint or task running in the same thread
+class CommandListener(monitoring.CommandListener):
+    def __init__(self, registry):
+        self.registry = registry
+
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        operation = _current_operation.get()
+        labels = {"source": f"{operation.kind}:{operation.name}" if operation else "other",
+                  "command": event.command_name}
+        if operation:
+            operation.db_commands += 1
+            operation.db_seconds += seconds
+        self.registry.inc("mongodb_commands_total", labels)
+        self.registry.inc("mongodb_command_seconds_total", labels, seconds)
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+
+# Collects counters and histograms in memory and flushes them to a Redis hash at most every
+# flush_interval seconds, so /metrics on any gunicorn worker reports the totals of every web
+# and worker process. Without Redis the totals stay local to the process.
+class MetricsRegistry:
+    REDIS_KEY = 'metrics:series'
+
+    def __init__(self, redis_client=None, flush_interval=1.0):
+        self.redis = redis_client
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._totals = {}
+        self._flushed_at = time.monotonic()
+        self.command_listener = CommandListener(self)
+
+    def inc(self, name, labels=None, value=1):
+        series = _series(name, labels)
+        with self._lock:
+            self._pending[series] = self._pending.get(series, 0) + value
+
+    def observe(self, name, labels, value, buckets=DURATION_BUCKETS):
+        labels = labels or {}
+        # Every bucket is incremented (by 0 above the value) so the series all exist
+        for bound in buckets + (float('inf'),):
+            self.inc(f"{name}_bucket", {**labels, "le": _format_bound(bound)}, 1 if value <= bound else 0)
+        self.inc(f"{name}_sum", labels, value)
+        self.inc(f"{name}_count", labels)
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._flushed_at < self.flush_interval:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = now
+        if not pending:
+            return
+        if self.redis is not None:
+            try:
+                pipeline = self.redis.pipeline(transaction=False)
+                for series, value in pending.items():
+                    pipeline.hincrbyfloat(self.REDIS_KEY, series, value)
+                pipeline.execute()
+                return
+            except redis.RedisError:
+                pass
+        with self._lock:
+            for series, value in pending.items():
+                self._totals[series] = self._totals.get(series, 0) + value
+
+    def totals(self):
+        self.flush(force=True)
+        totals = dict(self._totals)
+        if self.redis is not None:
+            try:
+                for series, value in self.redis.hgetall(self.REDIS_KEY).items():
+                    series = series.decode('utf-8')
+                    totals[series] = totals.get(series, 0) + float(value)
+            except redis.RedisError:
+                pass
+        return totals
+
+    # Prometheus text exposition of every series, grouped under the HELP/TYPE of its metric.
+    # extra_samples are (name, labels, value) computed elsewhere, such as the report cache counters.
+    def render(self, extra_samples=()):
+        totals = self.totals()
+        for name, labels, value in extra_samples:
+            totals[_series(name, labels)] = value
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            series = sorted(
+                (key, value) for key, value in totals.items()
+                if key.split('{', 1)[0] in (name, f"{name}_bucket", f"{name}_sum", f"{name}_count")
+            )
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(f"{key} {_format_value(value)}" for key, value in series)
+        return "\n".join(lines) + "\n"
+
+    def start_operation(self, kind, name):
+        return _current_operation.set(Operation(kind, name))
+
+    def finish_operation(self, token):
+        operation = _current_operation.get()
+        _current_operation.reset(token)
+        return operation
+
+    # Time a phase of the current endpoint or task
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            operation = _current_operation.get()
+            if operation:
+                operation.phases[name] = operation.phases.get(name, 0) + time.perf_counter() - started
+
+    # Request timing for a Flask app, with a Server-Timing header breaking the request down
+    def init_app(self, app):
+        from flask import g, request
+
+        @app.before_request
+        def start_request_metrics():
+            g.metrics_token = self.start_operation("endpoint", request.endpoint or "unknown")
+
+        @app.after_request
+        def record_request_metrics(response):
+            token = g.pop('metrics_token', None)
+            if token is None:
+                return response
+            operation = self.finish_operation(token)
+            duration = time.perf_counter() - operation.started
+            labels = {"endpoint": operation.name}
+            self.inc("http_requests_total", {**labels, "method": request.method,
+                                             "status": response.status_code})
+            self.observe("http_request_duration_seconds", labels, duration)
+            for phase, seconds in operation.phases.items():
+                self.inc("http_request_phase_seconds_total", {**labels, "phase": phase}, seconds)
+
+            timings = [f"db;desc=\"{operation.db_commands} commands\";dur={operation.db_seconds * 1000:.1f}"]
+            timings += [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in operation.phases.items()]
+            timings.append(f"total;dur={duration * 1000:.1f}")
+            response.headers['Server-Timing'] = ", ".join(timings)
+            self.flush()
+            return response
+
+        # A request that raised never reaches after_request, release its operation here
+        @app.teardown_request
+        def discard_request_metrics(exc=None):
+            token = g.pop('metrics_token', None)
+            if token is not None:
+                self.finish_operation(token)
+
+    # Task timing for Celery, with the CSV row rate of tasks returning a summary with 'rows'
+    def init_celery(self):
+        from celery.signals import task_prerun, task_postrun
+
+        tokens = {}
+
+        @task_prerun.connect(weak=False)
+        def start_task_metrics(task_id=None, task=None, **kwargs):
+            tokens[task_id] = self.start_operation("task", task.name)
+
+        @task_postrun.connect(weak=False)
+        def record_task_metrics(task_id=None, task=None, retval=None, state=None, **kwargs):
+            token = tokens.pop(task_id, None)
+            if token is None:
+                return
+            operation = self.finish_operation(token)
+            duration = time.perf_counter() - operation.started
+            labels = {"task": task.name}
+            self.inc("celery_tasks_total", {**labels, "state": state})
+            self.observe("celery_task_duration_seconds", labels, duration)
+            if isinstance(retval, dict) and isinstance(retval.get("rows"), int):
+                self.inc("celery_task_rows_total", labels, retval["rows"])
+                if duration > 0:
+                    self.observe("celery_task_rows_per_second", labels, retval["rows"] / duration,
+                                 ROW_RATE_BUCKETS)
+            self.flush(force=True)
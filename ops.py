@@ -0,0 +1,40 @@
+import redis
+from flask import Blueprint, Response, request, jsonify
+from services import metrics_registry, report_cache, scheduled_runs_collection
+
+# Health check, metrics and scheduler runs
+
+blueprint = Blueprint('ops', __name__)
+
+
+@blueprint.route('/')
+def home():
+    return "Hello, Flask is running!"
+
+
+@blueprint.route('/metrics', methods=['GET'])
+def get_metrics():
+    try:
+        report_cache_samples = [
+            ("report_cache_requests_total", {"endpoint": endpoint, "outcome": outcome}, counters[outcome])
+            for endpoint, counters in report_cache.stats().items()
+            for outcome in ("hits", "misses")
+        ]
+    except redis.RedisError:
+        report_cache_samples = []
+    return Response(metrics_registry.render(report_cache_samples), mimetype='text/plain; version=0.0.4')
+
+
+@blueprint.route('/scheduled_runs', methods=['GET'])
+def get_scheduled_runs():
+    try:
+        query = {"Job": request.args['job']} if request.args.get('job') else {}
+        limit = request.args.get('limit', '50')
+        if not limit.isdigit() or not 1 <= int(limit) <= 1000:
+            return jsonify({"error": "limit must be between 1 and 1000"}), 400
+        runs = list(scheduled_runs_collection.find(query).sort("Scheduled DT", -1).limit(int(limit)))
+        for run in runs:
+            run['_id'] = str(run['_id'])
+        return jsonify(runs), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,122 @@
+import time
+from datetime import datetime, timedelta, timezone
+import redis
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from database import DUPLICATE_KEY
+
+
+# Fixed-window counters in Redis, shared by every delivery worker.
+# Without Redis nothing is limited.
+class RateLimiter:
+    KEY_PREFIX = 'outbox:rate:'
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    # Count one send in scope and return 0 if it fits in limit per period seconds,
+    # otherwise the number of seconds until the window ends
+    def acquire(self, scope, limit, period):
+        if self.redis is None or not limit:
+            return 0
+        now = time.time()
+        window = int(now // period)
+        key = f"{self.KEY_PREFIX}{scope}:{window}"
+        try:
+            pipeline = self.redis.pipeline(transaction=True)
+            pipeline.incr(key)
+            pipeline.expire(key, period)
+            count, _ = pipeline.execute()
+        except redis.RedisError:
+            return 0
+        if count <= limit:
+            return 0
+        return (window + 1) * period - now
+
+    # Give back a send acquired in scope that did not happen
+    def refund(self, scope, limit, period):
+        if self.redis is None or not limit:
+            return
+        key = f"{self.KEY_PREFIX}{scope}:{int(time.time() // period)}"
+        try:
+            pipeline = self.redis.pipeline(transaction=True)
+            pipeline.decr(key)
+            pipeline.expire(key, period)
+            pipeline.execute()
+        except redis.RedisError:
+            pass
+
+
+# Emails waiting to be delivered, one document per idempotency key (its _id).
+# Status: pending -> sending -> sent, back to pending between retries, failed once the retries are exhausted.
+class EmailOutbox:
+    def __init__(self, collection, sending_timeout=600):
+        self.collection = collection
+        self.sending_timeout = sending_timeout
+
+    # Add emails (key, to_email, subject, body, distributor) and return the keys that were not already
+    # in the outbox: enqueuing the same key twice never sends the email twice
+    def enqueue(self, emails):
+        now = datetime.now(timezone.utc)
+        documents = [{
+            "_id": key,
+            "To": to_email,
+            "Subject": subject,
+            "Body": body,
+            "Distributor": distributor,
+            "Status": "pending",
+            "Attempts": 0,
+            "Created DT": now,
+            "Next Attempt DT": now
+        } for key, to_email, subject, body, distributor in emails]
+        if not documents:
+            return []
+        duplicates = set()
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details["writeErrors"]:
+                if error["code"] != DUPLICATE_KEY:
+                    raise
+                duplicates.add(documents[error["index"]]["_id"])
+        return [document["_id"] for document in documents if document["_id"] not in duplicates]
+
+    # Take an email for delivery. Returns None if it was sent already or another worker is sending it;
+    # an email stuck in sending for sending_timeout seconds (its worker died) can be taken again.
+    def claim(self, key):
+        now = datetime.now(timezone.utc)
+        return self.collection.find_one_and_update(
+            {"_id": key, "$or": [
+                {"Status": "pending"},
+                {"Status": "sending", "Claimed DT": {"$lt": now - timedelta(seconds=self.sending_timeout)}}
+            ]},
+            {"$set": {"Status": "sending", "Claimed DT": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    # Put a claimed email back without counting an attempt, due again in retry_in seconds (rate limited)
+    def release(self, key, retry_in=0):
+        self.collection.update_one({"_id": key, "Status": "sending"}, {"$set": {
+            "Status": "pending", "Next Attempt DT": datetime.now(timezone.utc) + timedelta(seconds=retry_in)
+        }})
+
+    def mark_sent(self, key):
+        self.collection.update_one({"_id": key}, {
+            "$set": {"Status": "sent", "Sent DT": datetime.now(timezone.utc)},
+            "$inc": {"Attempts": 1}
+        })
+
+    # Record a failed attempt, leaving the email pending for a retry in retry_in seconds or failed for good
+    def mark_failed(self, key, error, final, retry_in=0):
+        now = datetime.now(timezone.utc)
+        self.collection.update_one({"_id": key}, {
+            "$set": {"Status": "failed" if final else "pending", "Last Error": str(error),
+                     "Next Attempt DT": now + timedelta(seconds=retry_in)},
+            "$inc": {"Attempts": 1}
+        })
+
+    # Keys of the pending emails due for more than older_than seconds, whose delivery task was lost
+    def stale_pending(self, older_than):
+        threshold = datetime.now(timezone.utc) - timedelta(seconds=older_than)
+        return [email["_id"] for email in
+                self.collection.find({"Status": "pending", "Next Attempt DT": {"$lt": threshold}}, {"_id": 1})]
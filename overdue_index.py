@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta, timezone
+import redis
+
+# Exelot Codes of parcels that no longer need updates, they never count as overdue
+CLOSED_EXELOT_CODES = ("73", "52", "99")
+# Number of sorted set members sent per pipeline while reconciling
+RECONCILE_BATCH_SIZE = 5000
+# The parcels written since this long before a reconcile began are recorded again after its swap,
+# which covers the clocks of the processes stamping Updated DT drifting apart
+RECONCILE_OVERLAP = timedelta(minutes=1)
+
+
+# Parcels not updated since threshold that still need an update
+def overdue_query(threshold):
+    return {"Status DT": {"$lt": threshold}, "Exelot Code": {"$nin": list(CLOSED_EXELOT_CODES)}}
+
+
+def _timestamp(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+# Open parcels (Exelot Code not closed) of each distributor, kept in Redis sorted sets scored by Status DT.
+# Every status write updates the sets, so the overdue counts and the oldest overdue IDs of the emails are
+# range reads on the scores instead of a scan of the Parcels collection. The listings keep reading
+# overdue_query from MongoDB, which stays authoritative. reconcile() rebuilds the sets from MongoDB to repair drift,
+# and the index only answers once a reconcile has completed.
+class OverdueIndex:
+    KEY_PREFIX = 'overdue:open:'
+    REBUILD_PREFIX = 'overdue:rebuild:'
+    DISTRIBUTORS_KEY = 'overdue:distributors'
+    READY_KEY = 'overdue:ready'
+
+    def __init__(self, redis_client, closed_codes=CLOSED_EXELOT_CODES):
+        self.redis = redis_client
+        self.closed_codes = set(closed_codes)
+
+    def _key(self, distributor):
+        return f"{self.KEY_PREFIX}{distributor}"
+
+    def ready(self):
+        if self.redis is None:
+            return False
+        try:
+            return bool(self.redis.exists(self.READY_KEY))
+        except redis.RedisError:
+            return False
+
+    # Record the current state of parcels after a status write (ID, Distributor, Exelot Code, Status DT)
+    def record(self, parcels):
+        if self.redis is None:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for parcel in parcels:
+                self._record(pipeline, parcel)
+            pipeline.execute()
+        except redis.RedisError:
+            # The next reconcile repairs whatever was missed
+            pass
+
+    def _record(self, pipeline, parcel):
+        key = self._key(parcel["Distributor"])
+        status_dt = parcel.get("Status DT")
+        if parcel.get("Exelot Code") in self.closed_codes or not isinstance(status_dt, datetime):
+            pipeline.zrem(key, parcel["ID"])
+        else:
+            pipeline.zadd(key, {parcel["ID"]: _timestamp(status_dt)})
+            pipeline.sadd(self.DISTRIBUTORS_KEY, parcel["Distributor"])
+
+    # Drop parcels from the sets of their distributor, when they move to another distributor
+    def forget(self, parcels):
+        if self.redis is None:
+            return
+        try:
+            pipeline = self.redis.pipeline(transaction=False)
+            for parcel in parcels:
+                pipeline.zrem(self._key(parcel["Distributor"]), parcel["ID"])
+            pipeline.execute()
+        except redis.RedisError:
+            pass
+
+    def distributors(self):
+        return sorted(name.decode('utf-8') for name in self.redis.smembers(self.DISTRIBUTORS_KEY))
+
+    # Number of open parcels not updated since threshold, per distributor having some,
+    # or for each of the given distributors (zeros included)
+    def counts(self, threshold, distributors=None):
+        selected = distributors is not None
+        distributors = sorted(distributors) if selected else self.distributors()
+        pipeline = self.redis.pipeline(transaction=False)
+        for distributor in distributors:
+            pipeline.zcount(self._key(distributor), '-inf', f"({_timestamp(threshold)}")
+        return {distributor: count for distributor, count in zip(distributors, pipeline.execute())
+                if count or selected}
+
+    # IDs of the open parcels not updated since threshold, oldest first, at most limit per distributor
+    def overdue_ids(self, threshold, limit=None):
+        distributors = self.distributors()
+        pipeline = self.redis.pipeline(transaction=False)
+        for distributor in distributors:
+            if limit is None:
+                pipeline.zrangebyscore(self._key(distributor), '-inf', f"({_timestamp(threshold)}")
+            else:
+                pipeline.zrangebyscore(self._key(distributor), '-inf', f"({_timestamp(threshold)}",
+                                       start=0, num=limit)
+        return {distributor: [parcel_id.decode('utf-8') for parcel_id in ids]
+                for distributor, ids in zip(distributors, pipeline.execute()) if ids}
+
+    # Rebuild the sets from the open parcels in MongoDB and swap them in.
+    # The swap replaces whatever record() wrote during the rebuild, so the parcels written since the
+    # reconcile began (their Updated DT) are then recorded again from their current state.
+    def reconcile(self, parcels_collection):
+        started = datetime.now(timezone.utc) - RECONCILE_OVERLAP
+        cursor = parcels_collection.find(
+            {"Exelot Code": {"$nin": list(self.closed_codes)}, "Status DT": {"$type": "date"}},
+            {"_id": 0, "ID": 1, "Distributor": 1, "Status DT": 1}
+        )
+        for key in self.redis.scan_iter(f"{self.REBUILD_PREFIX}*"):
+            self.redis.delete(key)
+
+        distributors = set()
+        pipeline = self.redis.pipeline(transaction=False)
+        pending = 0
+        indexed = 0
+        for parcel in cursor:
+            distributors.add(parcel["Distributor"])
+            pipeline.zadd(f"{self.REBUILD_PREFIX}{parcel['Distributor']}",
+                          {parcel["ID"]: _timestamp(parcel["Status DT"])})
+            pending += 1
+            indexed += 1
+            if pending >= RECONCILE_BATCH_SIZE:
+                pipeline.execute()
+                pending = 0
+        pipeline.execute()
+
+        # Swap the rebuilt sets in and drop the sets of distributors without open parcels
+        stale = set(self.distributors()) - distributors
+        swap = self.redis.pipeline(transaction=True)
+        for distributor in distributors:
+            swap.rename(f"{self.REBUILD_PREFIX}{distributor}", self._key(distributor))
+        for distributor in stale:
+            swap.delete(self._key(distributor))
+        swap.delete(self.DISTRIBUTORS_KEY)
+        if distributors:
+            swap.sadd(self.DISTRIBUTORS_KEY, *distributors)
+        swap.set(self.READY_KEY, datetime.now(timezone.utc).isoformat())
+        swap.execute()
+
+        self._record_written_since(parcels_collection, started)
+        return indexed
+
+    # Record again the parcels written since a time, dropping them from the sets of the other distributors:
+    # the rebuild may have read them before a move to another distributor
+    def _record_written_since(self, parcels_collection, since):
+        cursor = parcels_collection.find(
+            {"Updated DT": {"$gte": since}},
+            {"_id": 0, "ID": 1, "Distributor": 1, "Exelot Code": 1, "Status DT": 1}
+        )
+        distributors = self.distributors()
+        pipeline = self.redis.pipeline(transaction=False)
+        pending = 0
+        for parcel in cursor:
+            for distributor in distributors:
+                if distributor != parcel["Distributor"]:
+                    pipeline.zrem(self._key(distributor), parcel["ID"])
+            self._record(pipeline, parcel)
+            pending += 1
+            if pending >= RECONCILE_BATCH_SIZE:
+                pipeline.execute()
+                pending = 0
+        pipeline.execute()
@@ -0,0 +1,425 @@
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import redis
+from pymongo import InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from csv_export import CSV_DATE_FORMAT
+from database import DUPLICATE_KEY
+from dates import to_utc
+from services import (config, parcels_collection, audits_collection, status_catalog, report_rollups,
+                      report_cache, overdue_index, event_feed)
+
+logger = logging.getLogger(__name__)
+
+# Fields of a parcel needed by its audit record and its rollup bucket
+PARCEL_STATE_PROJECTION = {"ID": 1, "Distributor": 1, "Site": 1, "Status": 1, "Exelot Code": 1, "Status DT": 1}
+
+# Counters reported for every batch, chunk and job of CSV rows
+CSV_SUMMARY_COUNTERS = ("rows", "updated", "missing", "invalid")
+
+# Fields of a parcel sent in its status event
+EVENT_FIELDS = ("ID", "Distributor", "Site", "Status", "Exelot Code", "Status DT")
+
+# Fields set by an ingested record, compared with the stored parcel so a replayed record writes nothing
+INGEST_FIELDS = ("Distributor", "Site", "Status", "Exelot Code", "Status DT", "Comments")
+
+# Rounds of a batch whose parcels were written concurrently between their read and their write
+WRITE_CONFLICT_ATTEMPTS = 3
+
+
+# Set a parcel's status in a single find_one_and_update and return the parcel as it was before.
+# The filter only matches parcels of a distributor the status is valid for, and the update picks
+# the Exelot Code of the parcel's own distributor. Returns None when nothing matched.
+def set_parcel_status(parcel_id, status, comments, exelot_codes_by_distributor, status_dt, session=None):
+    exelot_code = {"$switch": {
+        "branches": [{"case": {"$eq": ["$Distributor", distributor]}, "then": {"$literal": code}}
+                     for distributor, code in exelot_codes_by_distributor.items()],
+        "default": "$Exelot Code"
+    }}
+    return parcels_collection.find_one_and_update(
+        {"ID": parcel_id, "Distributor": {"$in": list(exelot_codes_by_distributor)}},
+        # Pipeline update: user input goes through $literal so a leading '$' is never read as a field path
+        [{"$set": {
+            "Status": {"$literal": status},
+            "Comments": {"$literal": comments},
+            "Exelot Code": exelot_code,
+            "Status DT": status_dt,
+            "Updated DT": status_dt
+        }}],
+        projection=PARCEL_STATE_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
+        session=session
+    )
+
+
+# Time of a write, to MongoDB's millisecond precision so the parcels can be read back on it
+def write_time():
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+# Filter matching a parcel only while it still has the state it was read with, so an update prepared
+# from that state (its audit Old Status, its rollup move) never lands on top of a concurrent write
+def unchanged_since_read(parcel):
+    return {field: parcel.get(field) for field in PARCEL_STATE_PROJECTION}
+
+
+# Send one write per parcel ({ID: UpdateOne or InsertOne}) in an unordered bulk_write and return the IDs
+# whose write was applied. Updates are guarded by unchanged_since_read and inserts by the unique ID index,
+# so a write that lost a race is skipped. Only when the counts fall short are the parcels read back:
+# those holding updated_dt were written here.
+def write_parcels(operations, updated_dt):
+    try:
+        result = parcels_collection.bulk_write(list(operations.values()), ordered=False)
+        applied = result.matched_count + result.inserted_count
+    except BulkWriteError as e:
+        if any(error["code"] != DUPLICATE_KEY for error in e.details["writeErrors"]):
+            raise
+        applied = e.details["nMatched"] + e.details["nInserted"]
+    if applied == len(operations):
+        return set(operations)
+    return {parcel["ID"] for parcel in parcels_collection.find({"ID": {"$in": list(operations)},
+                                                                 "Updated DT": updated_dt}, {"_id": 0, "ID": 1})}
+
+
+# Overdue parcel counts of the given distributors (all of them by default) from the overdue index,
+# None while the index is not available
+def overdue_counts(distributors=None):
+    if not overdue_index.ready():
+        return None
+    threshold = datetime.now(timezone.utc) - timedelta(hours=48)
+    try:
+        return overdue_index.counts(threshold, overdue_index.distributors() if distributors is None else distributors)
+    except redis.RedisError:
+        return None
+
+
+# Push the new state of written parcels, and the overdue counts of their distributors, to the /events streams
+def publish_parcel_changes(parcels):
+    parcels = list(parcels)
+    events = [("status", {field: parcel.get(field) for field in EVENT_FIELDS}) for parcel in parcels]
+    counts = overdue_counts({parcel["Distributor"] for parcel in parcels})
+    if counts is not None:
+        events.append(("overdue", {"Counts": counts}))
+    event_feed.publish(events)
+
+
+# Split an iterable of CSV rows into lists of at most batch_size rows
+def iter_batches(rows, batch_size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+# Parse and apply one batch of CSV rows.
+# first_row is the CSV row number of rows[0], used to point errors at their row.
+def process_parcel_updates_batch(rows, first_row=1):
+    summary = {"rows": len(rows), "updated": 0, "missing": 0, "invalid": 0, "errors": []}
+
+    # Parse the rows before touching the DB, skipping rows with missing fields or a bad date
+    parsed_rows = []
+    for row_number, row in enumerate(rows, start=first_row):
+        try:
+            parsed_rows.append({
+                "Row": row_number,
+                "ID": row['ID'],
+                "Status": row['Status'],
+                "Comments": row.get('Comments') or "",
+                "Status DT": datetime.strptime(row['Status DT'], CSV_DATE_FORMAT)
+            })
+        except (KeyError, TypeError, ValueError) as e:
+            summary["invalid"] += 1
+            summary["errors"].append({"Row": row_number, "ID": row.get('ID'), "Error": f"Invalid row: {e}"})
+
+    return apply_parcel_updates_batch(parsed_rows, summary)
+
+
+# Apply a batch of parsed updates ({Row, ID, Status, Comments, Status DT}), statuses validated against
+# the in-memory catalog. The rows of parcels written concurrently between their read and their write are
+# read again and retried, up to WRITE_CONFLICT_ATTEMPTS rounds, then reported as errors.
+# Counters and errors are added to summary, which is returned.
+def apply_parcel_updates_batch(parsed_rows, summary):
+    for _ in range(WRITE_CONFLICT_ATTEMPTS):
+        if not parsed_rows:
+            return summary
+        parsed_rows = apply_parcel_updates_round(parsed_rows, summary)
+
+    for row in parsed_rows:
+        summary["invalid"] += 1
+        summary["errors"].append({"Row": row["Row"], "ID": row["ID"],
+                                  "Error": "Parcel changed concurrently, the update was not applied"})
+    return summary
+
+
+# One round of apply_parcel_updates_batch with a fixed number of round trips: one $in prefetch of the
+# parcels, one bulk_write of updates guarded on the prefetched state and one insert_many for the audits.
+# Returns the rows of the parcels whose update lost a race.
+def apply_parcel_updates_round(parsed_rows, summary):
+    # Prefetch every parcel referenced by the batch
+    parcel_ids = list({row["ID"] for row in parsed_rows})
+    parcels = {
+        parcel["ID"]: parcel
+        for parcel in parcels_collection.find({"ID": {"$in": parcel_ids}}, PARCEL_STATE_PROJECTION)
+    }
+
+    # Time of the write, for the delta sync (Status DT comes from the CSV)
+    updated_dt = write_time()
+    audit_records = {}
+    update_fields_by_id = {}
+    original_parcels = {}
+    rows_by_id = {}
+    for row in parsed_rows:
+        parcel_id = row["ID"]
+        parcel = parcels.get(parcel_id)
+        if not parcel:
+            summary["missing"] += 1
+            summary["errors"].append({"Row": row["Row"], "ID": parcel_id, "Error": "Parcel not found"})
+            continue
+
+        distributor = parcel["Distributor"]
+        new_exelot_code = status_catalog.exelot_code(distributor, row["Status"])
+        if new_exelot_code is None:
+            summary["invalid"] += 1
+            summary["errors"].append({"Row": row["Row"], "ID": parcel_id,
+                                      "Error": f"Invalid status {row['Status']} for distributor {distributor}"})
+            continue
+
+        audit_records.setdefault(parcel_id, []).append({
+            "Parcel ID": parcel_id,
+            "Old Status": parcel["Status"],
+            "New Status": row["Status"],
+            "Old Exelot Code": parcel.get("Exelot Code", ""),
+            "New Exelot Code": new_exelot_code,
+            "Change DT": row["Status DT"]
+        })
+
+        update_fields = {
+            "Status": row["Status"],
+            "Comments": row["Comments"],
+            "Exelot Code": new_exelot_code,
+            "Status DT": row["Status DT"],
+            "Updated DT": updated_dt
+        }
+        # A parcel repeated in the batch keeps only its last update,
+        # while the in-memory copy makes the next audit see the right old status
+        original_parcels.setdefault(parcel_id, dict(parcel))
+        update_fields_by_id[parcel_id] = update_fields
+        rows_by_id.setdefault(parcel_id, []).append(row)
+        parcel.update(update_fields)
+
+    if not update_fields_by_id:
+        return []
+    updated = write_parcels({
+        parcel_id: UpdateOne(unchanged_since_read(original_parcels[parcel_id]), {"$set": update_fields})
+        for parcel_id, update_fields in update_fields_by_id.items()
+    }, updated_dt)
+
+    summary["updated"] += sum(len(rows_by_id[parcel_id]) for parcel_id in updated)
+    audits = [audit for parcel_id in updated for audit in audit_records[parcel_id]]
+    if audits:
+        audits_collection.insert_many(audits, ordered=False)
+    if updated:
+        report_rollups.apply_changes((original_parcels[parcel_id], parcels[parcel_id]) for parcel_id in updated)
+        report_cache.bump_generation()
+        overdue_index.record(parcels[parcel_id] for parcel_id in updated)
+        publish_parcel_changes(parcels[parcel_id] for parcel_id in updated)
+
+    return [row for parcel_id, rows in rows_by_id.items() if parcel_id not in updated for row in rows]
+
+
+# Add the counters and errors of a summary into an aggregated result, keeping at most max_errors errors
+def merge_summary(result, summary, max_errors):
+    for key in CSV_SUMMARY_COUNTERS:
+        result[key] += summary[key]
+    result["errors"].extend(summary["errors"][:max_errors - len(result["errors"])])
+
+
+# Apply CSV rows batch by batch and aggregate the per-batch summaries.
+# on_batch, if given, is called with each batch summary as soon as it is flushed.
+def apply_parcel_updates(rows, first_row=1, on_batch=None):
+    result = {"rows": 0, "updated": 0, "missing": 0, "invalid": 0, "errors": [], "batches": []}
+    max_errors = config['CSV_JOB_MAX_ERRORS']
+    for batch in iter_batches(rows, config['CSV_BATCH_SIZE']):
+        summary = process_parcel_updates_batch(batch, first_row + result["rows"])
+        counters = {key: summary[key] for key in CSV_SUMMARY_COUNTERS}
+        logger.debug("Processed batch %d: %s", len(result['batches']) + 1, counters)
+        if on_batch:
+            on_batch(summary)
+        merge_summary(result, summary, max_errors)
+        result["batches"].append(counters)
+
+    logger.info("Updated %d parcels", result['updated'])
+    return result
+
+
+# Split an NDJSON body, given as byte chunks and gunzipped on the fly if gzipped, into (line number, line).
+# Blank lines are skipped but keep their number.
+def iter_ndjson_lines(chunks, gzipped=False):
+    decompressor = zlib.decompressobj(wbits=31) if gzipped else None
+    pending = b''
+    line_number = 0
+    for chunk in chunks:
+        if decompressor is not None:
+            try:
+                chunk = decompressor.decompress(chunk)
+            except zlib.error as e:
+                raise ValueError(f"Invalid gzip body: {e}")
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if decompressor is not None and not decompressor.eof:
+        raise ValueError("Truncated gzip body")
+    if pending.strip():
+        yield line_number + 1, pending
+
+
+# Validate one NDJSON record against the status catalog into the parcel fields it sets.
+# Status DT is required, so the same record always sets the same values. Raises ValueError.
+def parse_ingest_record(line):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError("Invalid JSON")
+    if not isinstance(record, dict):
+        raise ValueError("A record must be a JSON object")
+    for field in ("ID", "Distributor", "Site", "Status", "Status DT"):
+        if not isinstance(record.get(field), str) or not record[field]:
+            raise ValueError(f"{field} is required and must be a non-empty string")
+    comments = record.get("Comments", "")
+    if not isinstance(comments, str):
+        raise ValueError("Comments, if provided, must be a string")
+
+    distributor, status = record["Distributor"], record["Status"]
+    exelot_code = status_catalog.exelot_code(distributor, status)
+    if exelot_code is None:
+        if not status_catalog.statuses(distributor):
+            raise ValueError(f"Unknown distributor {distributor}")
+        raise ValueError(f"Invalid status {status} for distributor {distributor}")
+
+    try:
+        status_dt = datetime.fromisoformat(record["Status DT"].replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("Status DT must be an ISO timestamp")
+    # Stored as MongoDB reads it back (naive UTC, milliseconds) so a replay compares equal
+    status_dt = to_utc(status_dt)
+    status_dt = status_dt.replace(microsecond=status_dt.microsecond // 1000 * 1000)
+
+    return {"ID": record["ID"], "Distributor": distributor, "Site": record["Site"], "Status": status,
+            "Exelot Code": exelot_code, "Status DT": status_dt, "Comments": comments}
+
+
+# Upsert a batch of parsed records ({Line, ID, INGEST_FIELDS}) keyed on ID. Records equal to the stored
+# parcel are counted as unchanged and not written. The records of parcels written concurrently (a retried
+# upload still running, an update) are read again and retried, up to WRITE_CONFLICT_ATTEMPTS rounds.
+def upsert_parcels_batch(parsed_records, summary):
+    for _ in range(WRITE_CONFLICT_ATTEMPTS):
+        if not parsed_records:
+            return summary
+        parsed_records = upsert_parcels_round(parsed_records, summary)
+
+    for record in parsed_records:
+        summary["invalid"] += 1
+        if len(summary["errors"]) < config['INGEST_MAX_ERRORS']:
+            summary["errors"].append({"Line": record["Line"], "Error": "Parcel changed concurrently, not written"})
+    return summary
+
+
+# One round of upsert_parcels_batch, with one $in prefetch, one unordered bulk_write and one insert_many
+# for the audits of the status changes. Returns the records of the parcels whose write lost a race.
+def upsert_parcels_round(parsed_records, summary):
+    parcel_ids = list({record["ID"] for record in parsed_records})
+    parcels = {
+        parcel["ID"]: parcel
+        for parcel in parcels_collection.find({"ID": {"$in": parcel_ids}},
+                                              {**PARCEL_STATE_PROJECTION, "Comments": 1})
+    }
+
+    updated_dt = write_time()
+    audit_records = {}
+    fields_by_id = {}
+    original_parcels = {}
+    outcomes = {}
+    for record in parsed_records:
+        parcel_id = record["ID"]
+        fields = {field: record[field] for field in INGEST_FIELDS}
+        parcel = parcels.get(parcel_id)
+        if parcel is not None and all(parcel.get(field) == value for field, value in fields.items()):
+            summary["unchanged"] += 1
+            continue
+
+        # An empty original has no rollup bucket, for the parcels created by this batch
+        original_parcels.setdefault(parcel_id, dict(parcel) if parcel is not None else {})
+        outcomes.setdefault(parcel_id, []).append((record, "updated" if parcel is not None else "created"))
+        if parcel is None:
+            parcel = parcels[parcel_id] = {"ID": parcel_id}
+        if parcel.get("Status") != fields["Status"]:
+            audit_records.setdefault(parcel_id, []).append({
+                "Parcel ID": parcel_id,
+                "Old Status": parcel.get("Status", ""),
+                "New Status": fields["Status"],
+                "Old Exelot Code": parcel.get("Exelot Code", ""),
+                "New Exelot Code": fields["Exelot Code"],
+                "Change DT": fields["Status DT"]
+            })
+        # A parcel repeated in the batch keeps only its last record
+        fields_by_id[parcel_id] = fields
+        parcel.update(fields)
+
+    if not fields_by_id:
+        return []
+    written = write_parcels({
+        parcel_id: UpdateOne(unchanged_since_read(original_parcels[parcel_id]),
+                             {"$set": {**fields, "Updated DT": updated_dt}})
+        if original_parcels[parcel_id] else
+        InsertOne({"ID": parcel_id, **fields, "Updated DT": updated_dt, "Created DT": updated_dt})
+        for parcel_id, fields in fields_by_id.items()
+    }, updated_dt)
+
+    for parcel_id in written:
+        for _, outcome in outcomes[parcel_id]:
+            summary[outcome] += 1
+    audits = [audit for parcel_id in written for audit in audit_records.get(parcel_id, [])]
+    if audits:
+        audits_collection.insert_many(audits, ordered=False)
+    if written:
+        report_rollups.apply_changes((original_parcels[parcel_id], parcels[parcel_id]) for parcel_id in written)
+        report_cache.bump_generation()
+        overdue_index.forget(original_parcels[parcel_id] for parcel_id in written
+                             if original_parcels[parcel_id].get("Distributor") not in
+                             (None, parcels[parcel_id]["Distributor"]))
+        overdue_index.record(parcels[parcel_id] for parcel_id in written)
+        publish_parcel_changes(parcels[parcel_id] for parcel_id in written)
+
+    return [record for parcel_id, records in outcomes.items() if parcel_id not in written
+            for record, _ in records]
+
+
+# Ingest an NDJSON body batch by batch: each batch is written before the next one is read from chunks,
+# so the reading pace follows the database. Counters and at most INGEST_MAX_ERRORS errors go into summary.
+# Raises ValueError on a corrupt gzip body, once the batches before it are written.
+def ingest_ndjson(chunks, summary, gzipped=False):
+    max_errors = config['INGEST_MAX_ERRORS']
+    for batch in iter_batches(iter_ndjson_lines(chunks, gzipped), config['INGEST_BATCH_SIZE']):
+        parsed_records = []
+        for line_number, line in batch:
+            summary["rows"] += 1
+            try:
+                parsed_records.append({"Line": line_number, **parse_ingest_record(line)})
+            except ValueError as e:
+                summary["invalid"] += 1
+                if len(summary["errors"]) < max_errors:
+                    summary["errors"].append({"Line": line_number, "Error": str(e)})
+        upsert_parcels_batch(parsed_records, summary)
+
+    logger.info("Ingested %d parcels: %d created, %d updated, %d unchanged, %d invalid", summary["rows"],
+                summary["created"], summary["updated"], summary["unchanged"], summary["invalid"])
+    return summary
@@ -0,0 +1,385 @@
+import base64
+import logging
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytz
+from flask import Blueprint, Response, current_app, request, jsonify
+from pymongo.errors import ExecutionTimeout
+from csv_spool import read_in_chunks
+from listing import (parcels_listing_response, listing_etag, not_modified_response, parse_since,
+                     aggregate_parcels_by, query_time_budget)
+from overdue_index import overdue_query
+from parcel_updates import (set_parcel_status, apply_parcel_updates_batch, ingest_ndjson, publish_parcel_changes,
+                            overdue_counts)
+from audit_archive import history_token, parse_history_token
+from services import (config, redis_client, mongo, parcels_collection, audits_collection, audits_write_behind,
+                      csv_jobs_collection, csv_spool, status_catalog, report_rollups, report_cache, overdue_index,
+                      audit_archive, event_feed)
+from tasks import start_csv_job_task
+from log_setup import truncate
+
+# Parcel listings, status updates, CSV imports, parcel history and live events
+
+logger = logging.getLogger(__name__)
+
+blueprint = Blueprint('parcels', __name__)
+
+# Open /events streams of this process, each one holding a server thread
+event_stream_slots = threading.BoundedSemaphore(config['EVENTS_MAX_CONNECTIONS'])
+
+
+@blueprint.route('/get_parcels', methods=['GET'])
+def get_parcels():
+    try:
+        logger.debug("get_parcels endpoint called")
+        # Delta mode: only the parcels updated since the given time
+        since = parse_since()
+        query = {"Updated DT": {"$gt": since}} if since else {}
+        return parcels_listing_response(query, etag=listing_etag())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ExecutionTimeout:
+        raise  # answered with a 503 by query_timeout
+    except Exception as e:
+        logger.error("Error occurred: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route('/get_parcels_for_parcels_management', methods=['GET'])
+def get_parcels_for_parcels_management():
+    try:
+        logger.debug("get_parcels_for_parcels_management endpoint called")
+
+        # Calculate the datetime for 48 hours ago, to the minute so the ETag holds for a minute without writes
+        forty_eight_hours_ago = (datetime.now(timezone.utc) - timedelta(hours=48)).replace(second=0, microsecond=0)
+        etag = listing_etag(forty_eight_hours_ago)
+        not_modified = not_modified_response(etag)
+        if not_modified is not None:
+            return not_modified
+
+        since = parse_since()
+        if since:
+            # Delta mode: the parcels updated since then, whether still overdue or not so the client
+            # can drop the others, and the parcels that became overdue since then
+            query = {"$or": [
+                {"Updated DT": {"$gt": since}},
+                {**overdue_query(forty_eight_hours_ago), "Status DT": {"$gte": since - timedelta(hours=48),
+                                                                        "$lt": forty_eight_hours_ago}}
+            ]}
+        else:
+            # Query to filter parcels: an indexed Status DT range scan, kept on MongoDB even when the
+            # overdue index is available so every page costs the same and no parcel depends on the index
+            query = overdue_query(forty_eight_hours_ago)
+
+        return parcels_listing_response(query, etag=etag)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ExecutionTimeout:
+        raise  # answered with a 503 by query_timeout
+    except Exception as e:
+        logger.error("Error occurred: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route('/get_overdue_counts', methods=['GET'])
+def get_overdue_counts():
+    try:
+        forty_eight_hours_ago = datetime.now(timezone.utc) - timedelta(hours=48)
+        if overdue_index.ready():
+            counts = overdue_index.counts(forty_eight_hours_ago)
+        else:
+            counts = {keys["Distributor"]: count for keys, count
+                      in aggregate_parcels_by(overdue_query(forty_eight_hours_ago), ["Distributor"])}
+        return jsonify([{"Distributor": distributor, "Count": count}
+                        for distributor, count in sorted(counts.items())]), 200
+    except ExecutionTimeout:
+        raise  # answered with a 503 by query_timeout
+    except Exception as e:
+        logger.error("Error occurred: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+# Server-sent events of the live dashboards:
+# - status: the new state of a written parcel {ID, Distributor, Site, Status, Exelot Code, Status DT}
+# - overdue: overdue parcel counts {"Counts": {distributor: count}} of the distributors of a write,
+#   or of every distributor (on connection and every SCHEDULE_PUBLISH_OVERDUE_COUNTS)
+# - reset: events were missed, reload the listings
+# A reconnecting browser sends Last-Event-ID (or lastEventId in the query string) and gets the events it missed.
+@blueprint.route('/events', methods=['GET'])
+def get_events():
+    if redis_client is None:
+        return jsonify({"error": "Live events require REDIS_URL"}), 503
+    if not event_stream_slots.acquire(blocking=False):
+        response = jsonify({"error": "Too many open event streams, retry later"})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+
+    def snapshot():
+        counts = overdue_counts()
+        return [("overdue", {"Counts": counts})] if counts is not None else []
+
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    response = Response(event_feed.iter_sse(last_id, heartbeat=current_app.config['EVENTS_HEARTBEAT_SECONDS'],
+                                            max_seconds=current_app.config['EVENTS_MAX_STREAM_SECONDS'],
+                                            snapshot=snapshot),
+                        mimetype='text/event-stream')
+    # Free the slot once the stream is closed, by its end or by the client going away
+    response.call_on_close(event_stream_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@blueprint.route('/update_parcel/<parcel_id>', methods=['PATCH'])
+def update_parcel(parcel_id):
+    data = request.get_json()
+    logger.debug("Received data for parcel %s: %s", parcel_id, truncate(data))
+
+    # Validate input
+    if 'Status' not in data or not isinstance(data['Status'], str):
+        return jsonify({"error": "Status is required and must be a string"}), 400
+    if 'Comments' in data and not isinstance(data['Comments'], str):
+        return jsonify({"error": "Comments, if provided, must be a string"}), 400
+
+    # Distributors the status is valid for, from the in-memory catalog
+    exelot_codes_by_distributor = status_catalog.distributors_with_status(data["Status"])
+    comments = data.get("Comments", "")
+    now = datetime.now(pytz.utc)
+
+    def write(session=None, acknowledged=True):
+        parcel = None
+        if exelot_codes_by_distributor:
+            parcel = set_parcel_status(parcel_id, data["Status"], comments, exelot_codes_by_distributor, now,
+                                       session=session)
+        if not parcel:
+            return None
+
+        new_exelot_code = exelot_codes_by_distributor[parcel["Distributor"]]
+        audit_record = {
+            "Parcel ID": parcel_id,
+            "Old Status": parcel["Status"],
+            "New Status": data["Status"],
+            "Old Exelot Code": parcel.get("Exelot Code", ""),
+            "New Exelot Code": new_exelot_code,
+            "Change DT": now  # Current UTC date and time
+        }
+        audits = audits_collection if acknowledged else audits_write_behind
+        audits.insert_one(audit_record, session=session)
+
+        # Move the parcel between report rollup buckets
+        updated_parcel = {**parcel, "Status": data["Status"], "Exelot Code": new_exelot_code, "Status DT": now}
+        report_rollups.apply_changes([(parcel, updated_parcel)], session=session)
+        return updated_parcel
+
+    if current_app.config['AUDIT_WRITE_MODE'] == 'transaction':
+        # The parcel, its audit and its rollups are committed together
+        with mongo.client.start_session() as session:
+            parcel = session.with_transaction(lambda s: write(session=s))
+    else:
+        # The audit is written behind the parcel update, the rollup increments stay acknowledged
+        parcel = write(acknowledged=False)
+
+    if not parcel:
+        # Tell a missing parcel from a status that is invalid for its distributor
+        if not parcels_collection.find_one({"ID": parcel_id}, {"_id": 1}):
+            return jsonify({"error": "Parcel not found"}), 404
+        return jsonify({"error": "Invalid status for the given distributor"}), 400
+
+    # Invalidate the cached reports, move the parcel in the overdue index and tell the live dashboards
+    report_cache.bump_generation()
+    overdue_index.record([parcel])
+    publish_parcel_changes([parcel])
+
+    return jsonify({"message": "Parcel updated successfully"}), 200
+
+
+@blueprint.route('/update_parcels', methods=['PATCH'])
+def update_parcels():
+    data = request.get_json()
+
+    # Validate input
+    if not isinstance(data, list) or not data:
+        return jsonify({"error": "A non-empty array of updates is required"}), 400
+    if len(data) > current_app.config['BULK_UPDATE_MAX_ITEMS']:
+        return jsonify({"error": f"At most {current_app.config['BULK_UPDATE_MAX_ITEMS']} updates per request"}), 400
+
+    now = datetime.now(pytz.utc)
+    summary = {"rows": len(data), "updated": 0, "missing": 0, "invalid": 0, "errors": []}
+    parsed_rows = []
+    for index, item in enumerate(data):
+        parcel_id = item.get('ID') if isinstance(item, dict) else None
+        if not isinstance(parcel_id, str):
+            error = "ID is required and must be a string"
+        elif not isinstance(item.get('Status'), str):
+            error = "Status is required and must be a string"
+        elif 'Comments' in item and not isinstance(item['Comments'], str):
+            error = "Comments, if provided, must be a string"
+        else:
+            parsed_rows.append({"Row": index, "ID": parcel_id, "Status": item['Status'],
+                                "Comments": item.get('Comments', ""), "Status DT": now})
+            continue
+        summary["invalid"] += 1
+        summary["errors"].append({"Row": index, "ID": parcel_id, "Error": error})
+
+    apply_parcel_updates_batch(parsed_rows, summary)
+
+    # One result per item, in the order of the request
+    errors = {error["Row"]: error["Error"] for error in summary["errors"]}
+    results = [
+        {"ID": item.get('ID') if isinstance(item, dict) else None, "success": index not in errors,
+         **({"error": errors[index]} if index in errors else {})}
+        for index, item in enumerate(data)
+    ]
+    logger.info("Bulk update of %d parcels: %d updated, %d missing, %d invalid",
+                len(data), summary["updated"], summary["missing"], summary["invalid"])
+    return jsonify({
+        "updated": summary["updated"],
+        "failed": len(data) - summary["updated"],
+        "results": results
+    }), 200
+
+
+# Create or update parcels from upstream systems. The body is NDJSON, one parcel per line
+# ({ID, Distributor, Site, Status, Status DT, Comments}), gzipped with Content-Encoding: gzip or
+# Content-Type: application/gzip. Records are upserts keyed on ID, and a record equal to the stored parcel
+# writes nothing, so a retried upload is safe. The body is read one batch at a time, each batch written
+# before the next is read: TCP flow control slows a fast sender down to the write rate.
+@blueprint.route('/ingest_parcels', methods=['POST'])
+def ingest_parcels():
+    gzipped = request.content_encoding == 'gzip' or request.mimetype == 'application/gzip'
+    summary = {"rows": 0, "created": 0, "updated": 0, "unchanged": 0, "invalid": 0, "errors": []}
+    try:
+        ingest_ndjson(read_in_chunks(request.stream), summary, gzipped=gzipped)
+    except ValueError as e:
+        # The batches before the error are written, the rest of the body is not read
+        return jsonify({"error": str(e), **summary}), 400
+    except Exception as e:
+        logger.error("Error ingesting parcels after %d records: %s", summary["rows"], e)
+        return jsonify({"error": str(e), **summary}), 500
+    return jsonify(summary), 200
+
+
+@blueprint.route('/update_parcels_with_csv', methods=['POST'])
+def update_parcels_with_csv():
+    try:
+        logger.debug("Starting to process CSV upload")
+        if request.is_json:
+            # Legacy mode: the CSV arrives base64 encoded inside a JSON body
+            data = request.get_json()
+            csv_content_base64 = data.get('csvContent', '')
+            if not csv_content_base64:
+                raise ValueError("No CSV file data found in the request")
+            chunks = [base64.b64decode(csv_content_base64)]
+            filename = data.get('fileName', 'upload.csv')
+        elif request.files:
+            # Multipart mode: werkzeug spools the file part to disk, copy it over block by block
+            upload = request.files.get('file') or next(iter(request.files.values()))
+            chunks = read_in_chunks(upload.stream)
+            filename = upload.filename or 'upload.csv'
+        else:
+            # Raw mode: the request body is the CSV itself
+            chunks = read_in_chunks(request.stream)
+            filename = request.args.get('fileName', 'upload.csv')
+
+        # Spool the file and only hand its reference to the worker
+        upload_id, size = csv_spool.save(chunks, filename)
+        logger.info("Spooled CSV %s (%d bytes)", upload_id, size)
+        if size == 0:
+            csv_spool.delete(upload_id)
+            raise ValueError("No CSV file data found in the request")
+
+        # Register the job and process the CSV rows asynchronously
+        job_id = uuid.uuid4().hex
+        csv_jobs_collection.insert_one({
+            "_id": job_id,
+            "Upload ID": upload_id,
+            "File Name": filename,
+            "Status": "queued",
+            "Rows Processed": 0,
+            "Updated": 0,
+            "Missing": 0,
+            "Invalid": 0,
+            "Errors": [],
+            "Created DT": datetime.now(pytz.utc)
+        })
+        start_csv_job_task.delay(job_id, upload_id)
+
+        return jsonify({"message": "CSV processing started", "job_id": job_id}), 200
+    except Exception as e:
+        logger.warning("Error processing CSV: %s", e)
+        return jsonify({"error": str(e)}), 400
+
+
+@blueprint.route('/csv_jobs/<job_id>', methods=['GET'])
+def get_csv_job(job_id):
+    try:
+        job = csv_jobs_collection.find_one({"_id": job_id})
+        if not job:
+            return jsonify({"error": "CSV job not found"}), 404
+
+        # Rows per second since the chunks started, up to now or until the job finished
+        started = job.get("Started DT")
+        rate = 0
+        if started:
+            finished = job.get("Finished DT") or datetime.now(pytz.utc)
+            elapsed = (finished.replace(tzinfo=timezone.utc) - started.replace(tzinfo=timezone.utc)).total_seconds()
+            if elapsed > 0:
+                rate = round(job["Rows Processed"] / elapsed, 2)
+
+        job["Job ID"] = job.pop("_id")
+        job["Rows Per Second"] = rate
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# History of a parcel sorted by Change DT, from the recent audits and the archive.
+# Paginated like the parcel listings: limit, and after set to the X-Next-After header of the previous page.
+@blueprint.route('/get_parcel_history/<parcel_id>', methods=['GET'])
+def get_parcel_history(parcel_id):
+    try:
+        limit = request.args.get('limit')
+        if limit is not None:
+            if not limit.isdigit():
+                raise ValueError("limit must be a positive integer")
+            limit = int(limit)
+            if not 1 <= limit <= current_app.config['PARCELS_PAGE_MAX']:
+                raise ValueError(f"limit must be between 1 and {current_app.config['PARCELS_PAGE_MAX']}")
+        after = request.args.get('after')
+        after = parse_history_token(after) if after else None
+
+        history = audit_archive.history([parcel_id], after=after, limit=limit, max_time_ms=query_time_budget())
+        next_after = history_token(history[-1]) if limit is not None and len(history) == limit else None
+        for record in history:
+            record['_id'] = str(record['_id'])
+        response = jsonify(history)
+        if next_after:
+            response.headers['X-Next-After'] = next_after
+        return response
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ExecutionTimeout:
+        raise  # answered with a 503 by query_timeout
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+# History of several parcels in one call: {"IDs": [...]} -> {parcel ID: [audit records]}
+@blueprint.route('/get_parcels_history', methods=['POST'])
+def get_parcels_history():
+    data = request.get_json()
+    parcel_ids = data.get('IDs') if isinstance(data, dict) else None
+    if (not isinstance(parcel_ids, list) or not parcel_ids
+            or not all(isinstance(parcel_id, str) for parcel_id in parcel_ids)):
+        return jsonify({"error": "IDs is required and must be a non-empty array of strings"}), 400
+    if len(parcel_ids) > current_app.config['HISTORY_BATCH_MAX_IDS']:
+        return jsonify({"error": f"At most {current_app.config['HISTORY_BATCH_MAX_IDS']} IDs per request"}), 400
+    try:
+        history = {parcel_id: [] for parcel_id in parcel_ids}
+        for record in audit_archive.history(list(history)):
+            record['_id'] = str(record['_id'])
+            history[record['Parcel ID']].append(record)
+        return jsonify(history), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
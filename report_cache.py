@@ -0,0 +1,123 @@
+import functools
+import hashlib
+import json
+from datetime import datetime, timezone
+import redis
+
+# Query parameters holding ISO dates, normalized to UTC before building the cache key
+DATE_PARAMS = ('startDate', 'endDate')
+
+# Query parameters the reports read as a wildcard when one of their values is 'all'
+WILDCARD_PARAMS = ('distributors', 'sites')
+
+
+# Canonical form of an ISO date parameter: UTC, rounded down to rounding_seconds
+# (to MongoDB's millisecond precision when rounding_seconds is 0). Unparsable values are kept as is.
+def _normalize_date(value, rounding_seconds):
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    timestamp = parsed.timestamp()
+    if rounding_seconds:
+        timestamp -= timestamp % rounding_seconds
+    return f"{timestamp:.3f}"
+
+
+# Caches the JSON responses of the report endpoints in Redis.
+# Entries are keyed on the endpoint, its canonicalized parameters and the parcels write generation,
+# which every parcel update bumps: a write makes all the cached reports unreachable at once,
+# and the TTL reclaims them.
+class ReportCache:
+    GENERATION_KEY = 'parcels:write_generation'
+    STATS_KEY = 'report_cache:stats'
+
+    def __init__(self, redis_client, ttl=300, date_rounding_seconds=0):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.date_rounding_seconds = date_rounding_seconds
+
+    def generation(self):
+        return int(self.redis.get(self.GENERATION_KEY) or 0)
+
+    # Called after every write to the parcels
+    def bump_generation(self):
+        if self.redis is None:
+            return
+        try:
+            self.redis.incr(self.GENERATION_KEY)
+        except redis.RedisError:
+            pass
+
+    def canonical_params(self, args):
+        params = {}
+        for name in sorted(args):
+            values = args.getlist(name)
+            if name in DATE_PARAMS:
+                values = [_normalize_date(value, self.date_rounding_seconds) for value in values]
+            # 'all' selects everything whatever else is listed, for the parameters read as a wildcard
+            params[name] = ['all'] if name in WILDCARD_PARAMS and 'all' in values else sorted(set(values))
+        return params
+
+    def cache_key(self, endpoint, args, generation):
+        canonical = json.dumps(self.canonical_params(args), sort_keys=True, separators=(',', ':'))
+        digest = hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+        return f"report_cache:{generation}:{endpoint}:{digest}"
+
+    def _count(self, endpoint, outcome):
+        try:
+            self.redis.hincrby(self.STATS_KEY, f"{endpoint}:{outcome}", 1)
+        except redis.RedisError:
+            pass
+
+    # Hit and miss counters per endpoint, shared by every process
+    def stats(self):
+        stats = {}
+        if self.redis is None:
+            return stats
+        for field, value in self.redis.hgetall(self.STATS_KEY).items():
+            endpoint, outcome = field.decode('utf-8').rsplit(':', 1)
+            stats.setdefault(endpoint, {"hits": 0, "misses": 0})[outcome] = int(value)
+        for counters in stats.values():
+            total = counters["hits"] + counters["misses"]
+            counters["hit_ratio"] = round(counters["hits"] / total, 4) if total else 0
+        return stats
+
+    # Decorator for a report view: serve the cached body when there is one, otherwise cache successful responses.
+    # Exports (any format but JSON) are streamed and never cached. A view run to fill the cache finds
+    # g.generation_stamped set, and reads the primary.
+    def cached(self, view):
+        from flask import Response, g, request
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.redis is None or request.args.get('format', 'json') != 'json':
+                return view(*args, **kwargs)
+
+            endpoint = view.__name__
+            try:
+                key = self.cache_key(endpoint, request.args, self.generation())
+                body = self.redis.get(key)
+            except redis.RedisError:
+                return view(*args, **kwargs)
+
+            if body is not None:
+                self._count(endpoint, "hits")
+                response = Response(body, status=200, mimetype='application/json')
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            self._count(endpoint, "misses")
+            g.generation_stamped = True
+            response = view(*args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200 and response.is_json:
+                try:
+                    self.redis.set(key, response.get_data(), ex=self.ttl)
+                except redis.RedisError:
+                    pass
+                response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
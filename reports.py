@@ -0,0 +1,241 @@
+import logging
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, request, jsonify
+from pymongo.errors import ExecutionTimeout
+from listing import parcels_listing_response, aggregate_parcels_by, query_time_budget, generation_stamped
+from services import metrics_registry, status_catalog, report_rollups, report_cache
+from log_setup import truncate
+
+# Parcel reports, counted from the rollups or aggregated, and their exports
+
+logger = logging.getLogger(__name__)
+
+blueprint = Blueprint('reports', __name__)
+
+
+# format=csv on a report exports the parcels it counts, streamed like a parcel listing
+def report_parcels_export(query):
+    try:
+        return parcels_listing_response(query)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+# Count the parcels of a report, from the rollups when they cover the requested range
+def count_parcels_by(query, fields):
+    groups = report_rollups.count_by(query, fields, aggregate_parcels_by, max_time_ms=query_time_budget(),
+                                     primary=generation_stamped())
+    if groups is None:
+        groups = aggregate_parcels_by(query, fields)
+    return groups
+
+
+@blueprint.route('/get_parcels_by_status_and_distributor', methods=['GET'])
+@report_cache.cached
+def get_parcels_by_status_and_distributor():
+    start_date_str = request.args.get('startDate')
+    end_date_str = request.args.get('endDate')
+    distributors = request.args.getlist('distributors')  # Get the list of distributors
+
+    try:
+        # Parse the ISO string dates to datetime objects
+        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+
+    # Query MongoDB with the date range
+    query = {
+        "Status DT": {"$gte": start_date, "$lte": end_date},
+    }
+    if distributors and 'all' not in distributors:
+        query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
+    if request.args.get('format') == 'csv':
+        return report_parcels_export(query)
+    with metrics_registry.phase('query'):
+        groups = count_parcels_by(query, ["Status", "Distributor", "Exelot Code"])
+
+    with metrics_registry.phase('processing'):
+        # Exelot Code descriptions from the in-memory catalog
+        exelot_codes = status_catalog.descriptions()
+
+        # Merge the groups by description, codes sharing a description are reported together
+        report = {}
+        for group, count in groups:
+            exelot_description = exelot_codes.get(group['Exelot Code'], 'No description')
+            key = (group['Status'], group['Distributor'], exelot_description)
+            report[key] = report.get(key, 0) + count
+
+        # Format the report as a list of dictionaries
+        report_data = [
+            {"Status": k[0], "Distributor": k[1], "ExelotCodeDescription": k[2], "Count": v}
+            for k, v in report.items()
+        ]
+
+    with metrics_registry.phase('serialization'):
+        return jsonify(report_data)
+
+
+@blueprint.route('/get_lost_parcels', methods=['GET'])
+@report_cache.cached
+def get_lost_parcels():
+    start_date_str = request.args.get('startDate')
+    end_date_str = request.args.get('endDate')
+    distributors = request.args.getlist('distributors')  # Get the list of distributors
+    sites = request.args.getlist('sites')  # Get the list of sites
+    status = request.args.get('status')  # Status code for lost parcels
+    logger.debug("Received start date: %s, end date: %s, distributors: %s, sites: %s, status: %s",
+                 start_date_str, end_date_str, truncate(distributors), truncate(sites), status)
+
+    try:
+        # Parse the ISO string dates to datetime objects
+        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+
+    # Query MongoDB with the date range
+    lost_parcels_query = {
+        'Status': status,
+        "Status DT": {"$gte": start_date, "$lte": end_date},
+    }
+
+    # Build the query filter
+    if distributors and 'all' not in distributors:
+        lost_parcels_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
+    if sites and 'all' not in sites:
+        lost_parcels_query['Site'] = {'$in': sites}
+
+    logger.debug("MongoDB query: %s", truncate(lost_parcels_query))
+    if request.args.get('format') == 'csv':
+        return report_parcels_export(lost_parcels_query)
+
+    # Count the parcels by distributor and site
+    with metrics_registry.phase('query'):
+        groups = count_parcels_by(lost_parcels_query, ["Distributor", "Site"])
+
+    # Format the report as a list of dictionaries
+    with metrics_registry.phase('processing'):
+        report_data = [
+            {"Distributor": group["Distributor"], "Site": group["Site"], "TotalLost": count}
+            for group, count in groups
+        ]
+    logger.debug("Generated report data: %s", truncate(report_data))
+
+    with metrics_registry.phase('serialization'):
+        return jsonify(report_data)
+
+
+@blueprint.route('/get_parcels_for_held_report', methods=['GET'])
+@report_cache.cached
+def get_parcels_for_held_report():
+    start_date_str = request.args.get('startDate')
+    end_date_str = request.args.get('endDate')
+    distributors = request.args.getlist('distributors')  # Get the list of distributors
+    sites = request.args.getlist('sites')  # Get the list of sites
+    exelot_codes = request.args.getlist('exelotCodes')  # Get the list of exelot codes for held parcels
+    logger.debug("Received start date: %s, end date: %s, distributors: %s, sites: %s, exelot codes: %s",
+                 start_date_str, end_date_str, truncate(distributors), truncate(sites), truncate(exelot_codes))
+
+    try:
+        # Parse the ISO string dates to datetime objects
+        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+
+    # Query MongoDB with the date range
+    parcels_for_held_report_query = {
+        "Exelot Code": {"$in": exelot_codes},
+        "Status DT": {"$gte": start_date, "$lte": end_date},
+    }
+
+    # Build the query filter
+    if distributors and 'all' not in distributors:
+        parcels_for_held_report_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
+    if sites and 'all' not in sites:
+        parcels_for_held_report_query['Site'] = {'$in': sites}
+
+    logger.debug("MongoDB query: %s", truncate(parcels_for_held_report_query))
+    if request.args.get('format') == 'csv':
+        return report_parcels_export(parcels_for_held_report_query)
+
+    # Count the parcels by site and distributor
+    with metrics_registry.phase('query'):
+        groups = count_parcels_by(parcels_for_held_report_query, ["Distributor", "Site"])
+
+    # Format the report as a list of dictionaries
+    with metrics_registry.phase('processing'):
+        report_data = [
+            {"Distributor": group["Distributor"], "Site": group["Site"], "TotalParcels": count}
+            for group, count in groups
+        ]
+    logger.debug("Generated report data: %s", truncate(report_data))
+
+    with metrics_registry.phase('serialization'):
+        return jsonify(report_data)
+
+
+@blueprint.route('/get_parcels_for_pudo_report', methods=['GET'])
+@report_cache.cached
+def get_parcels_for_pudo_report():
+    start_date_str = request.args.get('startDate')
+    end_date_str = request.args.get('endDate')
+    distributors = request.args.getlist('distributors')  # Get the list of distributors
+    sites = request.args.getlist('sites')  # Get the list of sites
+    exelot_codes = request.args.getlist('exelotCodes')  # Get the list of exelot codes for held parcels
+    logger.debug("Received start date: %s, end date: %s, distributors: %s, sites: %s, exelot codes: %s",
+                 start_date_str, end_date_str, truncate(distributors), truncate(sites), truncate(exelot_codes))
+
+    try:
+        # Parse the ISO string dates to datetime objects
+        start_date = datetime.fromisoformat(start_date_str.replace('Z', '+00:00'))
+        end_date = datetime.fromisoformat(end_date_str.replace('Z', '+00:00'))
+        seven_days_ago = datetime.now(timezone.utc) - timedelta(hours=168)
+    except ValueError:
+        return jsonify({"error": "Invalid date format"}), 400
+
+    # Query MongoDB with the date range and the 7-day threshold (only parcels older than 7 days)
+    parcels_for_pudo_report_query = {
+        "Exelot Code": {"$in": exelot_codes},
+        "Status DT": {"$gte": start_date, "$lte": end_date, "$lt": seven_days_ago},
+    }
+
+    # Build the query filter
+    if distributors and 'all' not in distributors:
+        parcels_for_pudo_report_query["Distributor"] = {"$in": distributors}  # Filter by distributors if provided
+    if sites and 'all' not in sites:
+        parcels_for_pudo_report_query['Site'] = {'$in': sites}
+
+    logger.debug("MongoDB query: %s", truncate(parcels_for_pudo_report_query))
+    if request.args.get('format') == 'csv':
+        return report_parcels_export(parcels_for_pudo_report_query)
+
+    try:
+        # Count the parcels by site and distributor
+        with metrics_registry.phase('query'):
+            groups = count_parcels_by(parcels_for_pudo_report_query, ["Distributor", "Site"])
+    except ExecutionTimeout:
+        raise  # answered with a 503 by query_timeout
+    except Exception as e:
+        logger.error("Error querying MongoDB: %s", e)
+        return jsonify({"error": "Error querying database"}), 500
+
+    # Format the report as a list of dictionaries
+    with metrics_registry.phase('processing'):
+        report_data = [
+            {"Distributor": group["Distributor"], "Site": group["Site"], "TotalParcels": count}
+            for group, count in groups
+        ]
+    logger.debug("Generated report data: %s", truncate(report_data))
+
+    with metrics_registry.phase('serialization'):
+        return jsonify(report_data)
+
+
+@blueprint.route('/report_cache/stats', methods=['GET'])
+def get_report_cache_stats():
+    try:
+        return jsonify(report_cache.stats()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,250 @@
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import DUPLICATE_KEY
+from dates import to_utc
+
+# Dimensions of a rollup bucket, besides its day
+DIMENSIONS = ("Distributor", "Site", "Status", "Exelot Code")
+ONE_DAY = timedelta(days=1)
+# MongoDB stores dates with millisecond precision
+ONE_MILLISECOND = timedelta(milliseconds=1)
+# A rebuild also recounts the buckets touched shortly before it began, by a transaction committed during it
+REBUILD_OVERLAP = timedelta(minutes=1)
+REBUILD_BATCH_SIZE = 1000
+RECOUNT_ROUNDS = 3
+
+
+def _day(value):
+    return to_utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Rollup bucket of a parcel: its Status DT day and its dimensions, or None without a Status DT
+def bucket_key(parcel):
+    status_dt = parcel.get("Status DT")
+    if not isinstance(status_dt, datetime):
+        return None
+    return (_day(status_dt),) + tuple(parcel.get(dimension) for dimension in DIMENSIONS)
+
+
+# Parcel counts per (day, Distributor, Site, Status, Exelot Code), kept in step with every status change.
+# The reports read the fully covered days from the rollups and only aggregate the parcels of the
+# partial days at the edges of the requested range.
+class ReportRollups:
+    STATE_ID = 'report_rollups'
+
+    # The reports read the buckets through rollups_reads (the rollups collection with its read preference),
+    # the increments and rebuilds write through rollups_collection
+    def __init__(self, parcels_collection, rollups_collection, state_collection, rollups_reads=None,
+                 ready_check_interval=60.0):
+        self.parcels_collection = parcels_collection
+        self.rollups_collection = rollups_collection
+        self.rollups_reads = rollups_reads if rollups_reads is not None else rollups_collection
+        self.state_collection = state_collection
+        self.ready_check_interval = ready_check_interval
+        self._ready = False
+        self._ready_checked_at = None
+
+    # Record the move of parcels between buckets: changes is an iterable of (old parcel, new parcel).
+    # The increments can join a transaction through session. They are always acknowledged: a lost
+    # increment would leave the reports wrong until the next rebuild.
+    def apply_changes(self, changes, session=None):
+        deltas = {}
+        for old_parcel, new_parcel in changes:
+            old_key, new_key = bucket_key(old_parcel), bucket_key(new_parcel)
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                deltas[old_key] = deltas.get(old_key, 0) - 1
+            if new_key is not None:
+                deltas[new_key] = deltas.get(new_key, 0) + 1
+
+        # Touched DT, on the server clock, tells a rebuild which buckets moved while it counted
+        operations = [
+            UpdateOne(dict(zip(("Day",) + DIMENSIONS, key)),
+                      {"$inc": {"Count": delta}, "$currentDate": {"Touched DT": True}}, upsert=True)
+            for key, delta in deltas.items() if delta
+        ]
+        self._bulk_write(operations, session=session)
+
+    # Write bucket updates, sending again the upserts that lost a race to create their bucket
+    def _bulk_write(self, operations, session=None):
+        if not operations:
+            return
+        try:
+            self.rollups_collection.bulk_write(operations, ordered=False, session=session)
+        except BulkWriteError as e:
+            # Two first upserts of a bucket race on its unique index: the one that lost is sent again,
+            # and now updates the bucket the other one inserted. Inside a transaction the error has
+            # aborted it, so it goes back to the caller.
+            errors = e.details["writeErrors"]
+            if session is not None or any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            self.rollups_collection.bulk_write([operations[error["index"]] for error in errors],
+                                               ordered=False)
+
+    # Rebuild every bucket from the parcels, in place: the increments of the parcels moved meanwhile keep
+    # landing in the same collection, nothing is swapped over them.
+    # - Every bucket the aggregation finds is set to its count, the buckets it no longer finds are removed.
+    # - A parcel moved during the aggregation may have been counted before or after its move, so the buckets
+    #   touched since the rebuild began are then recounted from their parcels, again while moves land
+    #   during a recount, up to RECOUNT_ROUNDS.
+    # Returns the number of buckets counted.
+    def rebuild(self):
+        rebuild_id = ObjectId()
+        touched_since = self._server_time() - REBUILD_OVERLAP
+        pipeline = [
+            {"$match": {"Status DT": {"$type": "date"}}},
+            {"$group": {
+                "_id": {
+                    "Day": {"$dateTrunc": {"date": "$Status DT", "unit": "day"}},
+                    # Missing and null fields share a bucket, as they do in the unique index
+                    **{dimension: {"$ifNull": [f"${dimension}", None]} for dimension in DIMENSIONS}
+                },
+                "Count": {"$sum": 1}
+            }},
+        ]
+        counted = 0
+        operations = []
+        for group in self.parcels_collection.aggregate(pipeline, allowDiskUse=True):
+            operations.append(UpdateOne(group["_id"], {"$set": {"Count": group["Count"], "Rebuild": rebuild_id}},
+                                        upsert=True))
+            if len(operations) == REBUILD_BATCH_SIZE:
+                self._bulk_write(operations)
+                counted += len(operations)
+                operations = []
+        self._bulk_write(operations)
+        counted += len(operations)
+        self.rollups_collection.delete_many({"Rebuild": {"$ne": rebuild_id},
+                                             "Touched DT": {"$not": {"$gte": touched_since}}})
+
+        for _ in range(RECOUNT_ROUNDS):
+            recount_started = self._server_time() - REBUILD_OVERLAP
+            touched = self.rollups_collection.find({"Touched DT": {"$gte": touched_since}},
+                                                   {"_id": 0, "Day": 1, **{dimension: 1 for dimension in DIMENSIONS}})
+            keys = {(_day(bucket["Day"]),) + tuple(bucket.get(dimension) for dimension in DIMENSIONS)
+                    for bucket in touched}
+            if not keys:
+                break
+            self._recount(list(keys))
+            touched_since = recount_started
+
+        self._set_ready(True)
+        return counted
+
+    # Set the count of the given buckets to the number of their parcels
+    def _recount(self, keys):
+        for start in range(0, len(keys), REBUILD_BATCH_SIZE):
+            batch = keys[start:start + REBUILD_BATCH_SIZE]
+            counts = dict.fromkeys(batch, 0)
+            parcels_query = {"$or": [
+                {"Status DT": {"$gte": key[0], "$lt": key[0] + ONE_DAY}, **dict(zip(DIMENSIONS, key[1:]))}
+                for key in batch
+            ]}
+            for parcel in self.parcels_collection.find(parcels_query, {"_id": 0, "Status DT": 1,
+                                                                       **{dimension: 1 for dimension in DIMENSIONS}}):
+                key = bucket_key(parcel)
+                if key in counts:
+                    counts[key] += 1
+            self._bulk_write([UpdateOne(dict(zip(("Day",) + DIMENSIONS, key)), {"$set": {"Count": count}}, upsert=True)
+                              for key, count in counts.items()])
+
+    # The current time on the MongoDB server, the clock Touched DT is stamped with
+    def _server_time(self):
+        state = self.state_collection.find_one_and_update(
+            {"_id": self.STATE_ID},
+            {"$currentDate": {"Rebuild DT": True}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return state["Rebuild DT"]
+
+    def _set_ready(self, ready):
+        self.state_collection.update_one(
+            {"_id": self.STATE_ID},
+            {"$set": {"Ready": ready, "Updated DT": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        self._ready = ready
+        self._ready_checked_at = time.monotonic()
+
+    # Whether the rollups were built, re-read from the DB at most once per ready_check_interval
+    def ready(self):
+        now = time.monotonic()
+        if self._ready_checked_at is None or now - self._ready_checked_at >= self.ready_check_interval:
+            state = self.state_collection.find_one({"_id": self.STATE_ID})
+            self._ready = bool(state and state.get("Ready"))
+            self._ready_checked_at = now
+        return self._ready
+
+    # Split a report query into the whole days answered by the rollups and the partial days around them.
+    # Returns (first_day, end_day, edge_queries) or None when the query cannot use the rollups.
+    def _split(self, query, fields):
+        if not self.ready():
+            return None
+        if any(field not in DIMENSIONS for field in fields):
+            return None
+        if any(key != "Status DT" and key not in DIMENSIONS for key in query):
+            return None
+
+        status_dt = query.get("Status DT")
+        if not isinstance(status_dt, dict) or "$gte" not in status_dt or set(status_dt) - {"$gte", "$lte", "$lt"}:
+            return None
+        if "$lte" not in status_dt and "$lt" not in status_dt:
+            return None
+
+        lower = to_utc(status_dt["$gte"])
+        # The upper bound as an exclusive instant: $lt as is, $lte one millisecond later
+        upper_bounds = []
+        if "$lt" in status_dt:
+            upper_bounds.append(to_utc(status_dt["$lt"]))
+        if "$lte" in status_dt:
+            upper_bounds.append(to_utc(status_dt["$lte"]) + ONE_MILLISECOND)
+        upper = min(upper_bounds)
+
+        first_day = _day(lower)
+        if first_day < lower:
+            first_day += ONE_DAY
+        end_day = _day(upper)
+        if end_day <= first_day:
+            return None
+
+        edge_queries = []
+        if lower < first_day:
+            edge_queries.append({**query, "Status DT": {"$gte": lower, "$lt": first_day}})
+        if end_day < upper:
+            edge_queries.append({**query, "Status DT": {"$gte": end_day, "$lt": upper}})
+        return first_day, end_day, edge_queries
+
+    # Count parcels matching a report query grouped by fields, like count_raw(query, fields) does,
+    # but reading whole days from the rollups, within max_time_ms when given and from the primary when asked.
+    # Returns None when the rollups cannot answer the query.
+    def count_by(self, query, fields, count_raw, max_time_ms=None, primary=False):
+        split = self._split(query, fields)
+        if split is None:
+            return None
+        first_day, end_day, edge_queries = split
+
+        rollups_query = {key: value for key, value in query.items() if key != "Status DT"}
+        rollups_query["Day"] = {"$gte": first_day, "$lt": end_day}
+        pipeline = [
+            {"$match": rollups_query},
+            {"$group": {
+                "_id": {field: {"$ifNull": [f"${field}", "Unknown"]} for field in fields},
+                "Count": {"$sum": "$Count"}
+            }}
+        ]
+
+        counts = {}
+        options = {"maxTimeMS": max_time_ms} if max_time_ms else {}
+        collection = self.rollups_collection if primary else self.rollups_reads
+        groups = list(collection.aggregate(pipeline, **options))
+        for edge_query in edge_queries:
+            groups.extend({"_id": group, "Count": count} for group, count in count_raw(edge_query, fields))
+        for group in groups:
+            key = tuple(group["_id"][field] for field in fields)
+            counts[key] = counts.get(key, 0) + group["Count"]
+
+        return [(dict(zip(fields, key)), count) for key, count in counts.items() if count > 0]
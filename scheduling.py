@@ -0,0 +1,130 @@
+import logging
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+import redis
+from bson import ObjectId
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.triggers.cron import CronTrigger
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+# Redis lock held by a single process at a time, kept as long as its holder renews it before the lease expires
+class LeaderLock:
+    # Extend the lease only if the lock is still ours
+    RENEW_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('pexpire', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    def __init__(self, redis_client, key, lease_seconds):
+        self.redis = redis_client
+        self.key = key
+        self.lease_ms = int(lease_seconds * 1000)
+        self.token = uuid.uuid4().hex
+
+    # Take the lock if it is free, or renew it if we hold it. Returns whether we hold it.
+    def acquire_or_renew(self):
+        try:
+            if self.redis.set(self.key, self.token, nx=True, px=self.lease_ms):
+                return True
+            return bool(self.redis.eval(self.RENEW_SCRIPT, 1, self.key, self.token, self.lease_ms))
+        except redis.RedisError as e:
+            logger.warning("Scheduler leader lock unavailable: %s", e)
+            return False
+
+
+# Latest fire time of a trigger in (now - window, now], or None
+def latest_fire_time(trigger, now, window):
+    latest = None
+    fire_time = trigger.get_next_fire_time(None, now - window)
+    while fire_time is not None and fire_time <= now:
+        latest = fire_time
+        fire_time = trigger.get_next_fire_time(fire_time, fire_time + timedelta(seconds=1))
+    return latest
+
+
+# Runs the scheduled jobs once per fire time across every worker process.
+# Each process ticks every lease/3 seconds, but only the holder of the Redis leader lock looks for due jobs.
+# A due fire time is claimed by inserting its run record, unique on (Job, Scheduled DT), so a fire time
+# never runs twice even if two leaders overlap, and dispatched to the workers. A fire time missed while
+# no process was leading is caught up on the next tick if it is less than catchup old.
+# Without Redis every process ticks and the unique run record alone picks the one that runs the job.
+class ClusterScheduler:
+    LOCK_KEY = 'scheduler:leader'
+
+    def __init__(self, runs_collection, redis_client, dispatch, timezone_name, lease_seconds=30,
+                 catchup=timedelta(hours=12)):
+        self.runs_collection = runs_collection
+        self.lock = LeaderLock(redis_client, self.LOCK_KEY, lease_seconds) if redis_client is not None else None
+        self.dispatch = dispatch
+        self.timezone_name = timezone_name
+        self.lease_seconds = lease_seconds
+        self.catchup = catchup
+        self.triggers = {}
+        self._claimed = {}  # job -> last fire time this process knows is claimed
+        self._leading = False
+
+    # Schedule a job on a crontab expression ("minute hour day month day_of_week"), an empty one disables it
+    def add_job(self, name, crontab):
+        if crontab:
+            self.triggers[name] = CronTrigger.from_crontab(crontab, timezone=self.timezone_name)
+
+    def tick(self):
+        leading = self.lock.acquire_or_renew() if self.lock is not None else True
+        if leading != self._leading:
+            logger.info("Scheduler leadership %s", "acquired" if leading else "lost")
+            self._leading = leading
+        if not leading:
+            return
+
+        now = datetime.now(timezone.utc)
+        for name, trigger in self.triggers.items():
+            scheduled = latest_fire_time(trigger, now, self.catchup)
+            if scheduled is None or self._claimed.get(name) == scheduled:
+                continue
+            run_id = self._claim(name, scheduled)
+            self._claimed[name] = scheduled
+            if run_id is not None:
+                logger.info("Dispatching %s scheduled at %s", name, scheduled)
+                self.dispatch(str(run_id))
+
+    def _claim(self, name, scheduled):
+        run = {
+            "Job": name,
+            "Scheduled DT": scheduled,
+            "Status": "queued",
+            "Host": socket.gethostname(),
+            "Queued DT": datetime.now(timezone.utc)
+        }
+        try:
+            return self.runs_collection.insert_one(run).inserted_id
+        except DuplicateKeyError:
+            return None
+
+    # Execute a claimed run and record its outcome
+    def run(self, run_id, func):
+        run_id = ObjectId(run_id)
+        self.runs_collection.update_one({"_id": run_id}, {"$set": {
+            "Status": "running", "Started DT": datetime.now(timezone.utc)
+        }})
+        try:
+            func()
+        except Exception as e:
+            self.runs_collection.update_one({"_id": run_id}, {"$set": {
+                "Status": "failed", "Error": str(e), "Finished DT": datetime.now(timezone.utc)
+            }})
+            raise
+        self.runs_collection.update_one({"_id": run_id}, {"$set": {
+            "Status": "succeeded", "Finished DT": datetime.now(timezone.utc)
+        }})
+
+    def start(self):
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(self.tick, 'interval', seconds=max(1, self.lease_seconds // 3), name='scheduler_tick')
+        scheduler.start()
+        return scheduler
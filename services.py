@@ -0,0 +1,85 @@
+import logging
+import os
+import redis
+from pymongo import ReadPreference, WriteConcern
+from config import Config
+from database import MongoConnection
+from csv_spool import make_csv_spool
+from status_catalog import StatusCatalog
+from rollups import ReportRollups
+from overdue_index import OverdueIndex
+from audit_archive import AuditArchive
+from outbox import EmailOutbox, RateLimiter
+from events import EventFeed
+from report_cache import ReportCache
+from metrics import MetricsRegistry
+from log_setup import configure_logging
+
+# Connections and stores shared by the web and worker processes. Nothing here imports Flask, Celery,
+# APScheduler or smtplib, and no connection is opened until first use.
+
+# The settings of config.py, as loaded by app.config.from_object
+config = {key: getattr(Config, key) for key in dir(Config) if key.isupper()}
+
+# Setup logging
+configure_logging(config)
+logger = logging.getLogger(__name__)
+
+# Set up the Redis connection shared by the caches and the metrics (the Celery broker instance)
+redis_client = redis.Redis.from_url(config['REDIS_URL']) if config['REDIS_URL'] else None
+
+# Set up the request, task and MongoDB command metrics
+metrics_registry = MetricsRegistry(redis_client, flush_interval=config['METRICS_FLUSH_SECONDS'])
+
+# Set up MongoDB connection, opened by each process on first use (after the gunicorn / Celery fork)
+mongo_uri = os.getenv('MONGO_URI')
+mongo = MongoConnection(mongo_uri, config['MONGO_DB_NAME'],
+                        event_listeners=[metrics_registry.command_listener],
+                        maxPoolSize=config['MONGO_MAX_POOL_SIZE'],
+                        minPoolSize=config['MONGO_MIN_POOL_SIZE'],
+                        maxIdleTimeMS=config['MONGO_MAX_IDLE_TIME_MS'])
+db = mongo.database()
+parcels_collection = db['Parcels']
+# Listing and report reads, served by a secondary when there is one so they stay off the writes' primary
+parcels_reads = parcels_collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+statuses_collection = db['Statuses']
+audits_collection = db['Audits']
+# Audits written without waiting for the server acknowledgement
+audits_write_behind = audits_collection.with_options(write_concern=WriteConcern(w=0))
+exelot_codes_collection = db['Exelot Codes']
+distributors_collection = db['Distributors']
+csv_jobs_collection = db['CSV Jobs']
+report_rollups_collection = db['Report Rollups']
+rollups_state_collection = db['Rollups State']
+scheduled_runs_collection = db['Scheduled Runs']
+email_outbox_collection = db['Email Outbox']
+
+# Set up the store for uploaded CSV files
+csv_spool = make_csv_spool(config, db)
+
+# Set up the in-memory catalog of valid statuses and Exelot Code descriptions
+status_catalog = StatusCatalog(statuses_collection, exelot_codes_collection, redis_client,
+                               check_interval=config['STATUS_CATALOG_CHECK_SECONDS'])
+
+# Set up the report rollups maintained on every status change, read like the parcels of the reports
+report_rollups = ReportRollups(parcels_collection, report_rollups_collection, rollups_state_collection,
+                               rollups_reads=report_rollups_collection.with_options(
+                                   read_preference=ReadPreference.SECONDARY_PREFERRED))
+
+# Set up the Redis cache of the report responses
+report_cache = ReportCache(redis_client, ttl=config['REPORT_CACHE_TTL_SECONDS'],
+                           date_rounding_seconds=config['REPORT_CACHE_DATE_ROUNDING_SECONDS'])
+
+# Set up the Redis index of the open parcels by Status DT, maintained on every status change
+overdue_index = OverdueIndex(redis_client)
+
+# Set up the monthly archive collections of the old audits
+audit_archive = AuditArchive(db, audits_collection, compressor=config['AUDIT_ARCHIVE_COMPRESSOR'],
+                             batch_size=config['AUDIT_ARCHIVE_BATCH_SIZE'])
+
+# Set up the Redis stream of the parcel events served by GET /events
+event_feed = EventFeed(redis_client, max_len=config['EVENTS_STREAM_MAX_LEN'])
+
+# Set up the outbox of the notification emails and the SMTP rate limits shared by the delivery workers
+email_outbox = EmailOutbox(email_outbox_collection, sending_timeout=config['EMAIL_SENDING_TIMEOUT_SECONDS'])
+email_rate_limiter = RateLimiter(redis_client)
@@ -0,0 +1,95 @@
+import threading
+import time
+import redis
+
+
+# In-process copy of the Statuses and Exelot Codes catalogs.
+# Every process keeps its own copy and compares a version stamp stored in Redis
+# (at most once every check_interval seconds) to notice writes made by other processes.
+# Without Redis the copy is simply reloaded every max_age seconds.
+class StatusCatalog:
+    VERSION_KEY = 'status_catalog:version'
+
+    def __init__(self, statuses_collection, exelot_codes_collection, redis_client=None,
+                 check_interval=1.0, max_age=60.0):
+        self.statuses_collection = statuses_collection
+        self.exelot_codes_collection = exelot_codes_collection
+        self.redis = redis_client
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._exelot_codes = {}   # distributor -> status -> Exelot Code
+        self._distributors = {}   # status -> distributor -> Exelot Code
+        self._descriptions = {}   # Exelot Code -> description
+
+    def _read_version(self):
+        if self.redis is None:
+            return None
+        try:
+            return self.redis.get(self.VERSION_KEY)
+        except redis.RedisError:
+            return None
+
+    def _load(self, version):
+        exelot_codes = {}
+        distributors = {}
+        for status in self.statuses_collection.find({}, {"Distributor": 1, "Status": 1, "Exelot Code": 1}):
+            exelot_codes.setdefault(status["Distributor"], {})[status["Status"]] = status["Exelot Code"]
+            distributors.setdefault(status["Status"], {})[status["Distributor"]] = status["Exelot Code"]
+        descriptions = {
+            code['Exelot Code']: code['Description']
+            for code in self.exelot_codes_collection.find({}, {"Exelot Code": 1, "Description": 1})
+        }
+        self._exelot_codes = exelot_codes
+        self._distributors = distributors
+        self._descriptions = descriptions
+        self._version = version
+        self._loaded_at = time.monotonic()
+
+    # Reload the catalogs if they were never loaded, are too old, or another process bumped the version
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded_at is not None and now - self._checked_at < self.check_interval:
+                return
+            version = self._read_version()
+            if (self._loaded_at is None or version != self._version
+                    or (version is None and now - self._loaded_at >= self.max_age)):
+                self._load(version)
+            self._checked_at = now
+
+    # Exelot Code of a distributor's status, or None when the status is not valid for the distributor
+    def exelot_code(self, distributor, status):
+        self._ensure_fresh()
+        return self._exelot_codes.get(distributor, {}).get(status)
+
+    # Status -> Exelot Code mapping of a distributor
+    def statuses(self, distributor):
+        self._ensure_fresh()
+        return self._exelot_codes.get(distributor, {})
+
+    # Distributor -> Exelot Code mapping of the distributors a status is valid for
+    def distributors_with_status(self, status):
+        self._ensure_fresh()
+        return self._distributors.get(status, {})
+
+    # Exelot Code -> description mapping
+    def descriptions(self):
+        self._ensure_fresh()
+        return self._descriptions
+
+    # Called after every write to the catalogs: bump the shared version and drop the local copy
+    def invalidate(self):
+        if self.redis is not None:
+            try:
+                self.redis.incr(self.VERSION_KEY)
+            except redis.RedisError:
+                pass
+        with self._lock:
+            self._loaded_at = None
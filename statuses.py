@@ -0,0 +1,62 @@
+from bson import ObjectId
+from flask import Blueprint, request, jsonify
+from services import statuses_collection, status_catalog
+
+# Statuses of the distributors, cached in the status catalog
+
+blueprint = Blueprint('statuses', __name__)
+
+
+@blueprint.route('/get_valid_statuses/<distributor>', methods=['GET'])
+def get_valid_statuses(distributor):
+    try:
+        statuses = statuses_collection.find({
+            "Distributor": distributor,
+            "Active": True  # Only fetch active statuses
+        })
+        valid_statuses = [status["Status"] for status in statuses]
+        return jsonify(valid_statuses), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@blueprint.route('/get_statuses', methods=['GET'])
+def get_statuses():
+    statuses = list(statuses_collection.find({'Active': True}))  # Only fetch active statuses
+    for status in statuses:
+        status['_id'] = str(status['_id'])
+    return jsonify(statuses), 200
+
+
+@blueprint.route('/add_status', methods=['POST'])
+def add_status():
+    data = request.get_json()
+    result = statuses_collection.insert_one(data)
+    status_catalog.invalidate()
+    return jsonify({'inserted_id': str(result.inserted_id)}), 201
+
+
+@blueprint.route('/update_status/<status_id>', methods=['PATCH'])
+def update_status(status_id):
+    data = request.get_json()
+    result = statuses_collection.update_one({'_id': ObjectId(status_id)}, {'$set': data})
+    if result.matched_count == 0:
+        return jsonify({'error': 'Status not found'}), 404
+    status_catalog.invalidate()
+    return jsonify({'message': 'Status updated successfully'}), 200
+
+
+@blueprint.route('/deactivate_status/<status_id>', methods=['PATCH'])
+def deactivate_status(status_id):
+    try:
+        # Set the Active field to false
+        result = statuses_collection.update_one(
+            {'_id': ObjectId(status_id)},
+            {'$set': {'Active': False}}
+        )
+        if result.matched_count == 0:
+            return jsonify({'error': 'Status not found'}), 404
+        status_catalog.invalidate()
+        return jsonify({'message': 'Status deactivated successfully'}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,401 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+import pytz
+from bson import ObjectId
+from celery import chord
+from celery.signals import worker_ready
+from celery_config import make_celery
+from csv_spool import iter_csv_rows, iter_chunk_offsets
+from indexes import ensure_indexes
+from overdue_index import overdue_query
+from parcel_updates import apply_parcel_updates, merge_summary, overdue_counts
+from services import (config, redis_client, metrics_registry, db, parcels_collection, parcels_reads,
+                      distributors_collection, csv_jobs_collection, scheduled_runs_collection, csv_spool,
+                      overdue_index, report_rollups, audit_archive, email_outbox, email_rate_limiter, event_feed)
+from log_setup import truncate
+
+# Celery tasks and scheduled jobs: the app run by the worker processes (celery -A tasks.celery).
+# The web process imports it only to queue tasks, so the SMTP and APScheduler modules are imported
+# on first use, in the workers.
+
+logger = logging.getLogger(__name__)
+
+# Set up Celery
+celery = make_celery(__name__, config)
+metrics_registry.init_celery()
+
+
+# Mailer reusing an authenticated SMTP session per delivery thread
+def make_mailer():
+    from mailer import SMTPMailer
+
+    return SMTPMailer(config['SMTP_HOST'], config['SMTP_PORT'],
+                      os.getenv('SENDING_EMAIL'), os.getenv('EMAIL_PASSWORD'), use_tls=config['SMTP_USE_TLS'])
+
+
+# SMTP sessions of this worker process, reused by every delivery it runs
+_delivery_mailer = None
+
+
+def delivery_mailer():
+    global _delivery_mailer
+    if _delivery_mailer is None:
+        _delivery_mailer = make_mailer()
+    return _delivery_mailer
+
+
+# Deliver one email of the outbox, on the 'emails' queue. A rate limited email is put back and
+# rescheduled without counting an attempt; a failed send is retried with exponential backoff.
+@celery.task(bind=True, queue='emails', acks_late=True, max_retries=config['EMAIL_MAX_RETRIES'])
+def deliver_email_task(self, key):
+    email = email_outbox.claim(key)
+    if email is None:
+        return  # sent already, or being sent by another worker
+
+    # The distributor's hourly limit goes first, so an email it holds back never takes a global slot,
+    # and its slot is given back when the global limit holds the email back instead
+    distributor_scope = f"distributor:{email['Distributor']}"
+    distributor_limit = config['EMAIL_RATE_LIMIT_PER_DISTRIBUTOR_PER_HOUR']
+    wait = email_rate_limiter.acquire(distributor_scope, distributor_limit, 3600)
+    if not wait:
+        wait = email_rate_limiter.acquire('smtp', config['EMAIL_RATE_LIMIT_PER_MINUTE'], 60)
+        if wait:
+            email_rate_limiter.refund(distributor_scope, distributor_limit, 3600)
+    if wait:
+        email_outbox.release(key, retry_in=wait)
+        deliver_email_task.apply_async(args=[key], countdown=wait)
+        return
+
+    try:
+        delivery_mailer().send(email["To"], email["Subject"], email["Body"])
+    except Exception as e:
+        final = self.request.retries >= self.max_retries
+        countdown = config['EMAIL_RETRY_BACKOFF_SECONDS'] * 2 ** self.request.retries
+        email_outbox.mark_failed(key, e, final, retry_in=countdown)
+        logger.error("Error sending email %s to %s (attempt %d): %s",
+                     key, email["To"], self.request.retries + 1, e)
+        if final:
+            return
+        raise self.retry(exc=e, countdown=countdown)
+    email_outbox.mark_sent(key)
+    logger.info("Email %s sent to %s", key, email["To"])
+
+
+# Queue emails ((key, to_email, subject, body, distributor) tuples) for delivery.
+# Keys already in the outbox are skipped, so a rerun never sends an email twice.
+def queue_emails(emails):
+    keys = email_outbox.enqueue(emails)
+    for key in keys:
+        deliver_email_task.delay(key)
+    return keys
+
+
+# Number of overdue parcels listed in each distributor's email
+MAX_PARCELS_TO_SHOW = 5
+
+
+# Count the overdue parcels of each distributor and pick the oldest ones as samples.
+# Reads the overdue index when it is available, otherwise runs a single aggregation ($topN requires MongoDB 5.2+)
+def overdue_parcels_by_distributor(threshold):
+    if overdue_index.ready():
+        return overdue_parcels_from_index(threshold)
+    pipeline = [
+        {"$match": overdue_query(threshold)},
+        {"$group": {
+            "_id": "$Distributor",
+            "Total": {"$sum": 1},
+            "Samples": {"$topN": {
+                "n": MAX_PARCELS_TO_SHOW,
+                "sortBy": {"Status DT": 1},
+                "output": {"ID": "$ID", "Status": "$Status", "Status DT": "$Status DT"}
+            }}
+        }}
+    ]
+    return {group["_id"]: group for group in parcels_reads.aggregate(pipeline)}
+
+
+# Same result as overdue_parcels_by_distributor from the overdue index: the counts and the oldest IDs
+# come from Redis, and only the sample parcels are read from MongoDB
+def overdue_parcels_from_index(threshold):
+    counts = overdue_index.counts(threshold)
+    sample_ids = overdue_index.overdue_ids(threshold, limit=MAX_PARCELS_TO_SHOW)
+    ids = [parcel_id for parcel_ids in sample_ids.values() for parcel_id in parcel_ids]
+    overdue = {distributor: {"_id": distributor, "Total": total, "Samples": []}
+               for distributor, total in counts.items()}
+    samples = parcels_collection.find(
+        {"ID": {"$in": ids}, **overdue_query(threshold)},
+        {"_id": 0, "ID": 1, "Distributor": 1, "Status": 1, "Status DT": 1}
+    ).sort("Status DT", 1)
+    for parcel in samples:
+        if parcel["Distributor"] in overdue:
+            overdue[parcel["Distributor"]]["Samples"].append(
+                {"ID": parcel["ID"], "Status": parcel["Status"], "Status DT": parcel["Status DT"]})
+    return overdue
+
+
+def build_overdue_email_body(distributor_name, total_parcels, samples):
+    body = (f"Hello {distributor_name},"
+            f"\n\nWe have identified parcels whose status has not been updated for over 48 hours.\n")
+    body += f"Total parcels requiring update: {total_parcels}\n"
+
+    for parcel in samples:
+        body += (f"- Parcel ID: {parcel['ID']}, Status: {parcel['Status']}, "
+                 f"Last Update: {parcel['Status DT']}\n")
+
+    if total_parcels > MAX_PARCELS_TO_SHOW:
+        body += f"\n...and {total_parcels - MAX_PARCELS_TO_SHOW} more parcels."
+
+    body += ("\n\nPlease update the status of these parcels as soon as possible, at the link:"
+             "\nhttps://aviachen.wixsite.com/overdue-system-manag"
+             ".\n\nBest regards,"
+             "\nOverdue Management System Team")
+    return body
+
+
+def check_parcels_and_notify():
+    try:
+        logger.info("Executing check_parcels_and_notify")
+        forty_eight_hours_ago = datetime.now(pytz.utc) - timedelta(hours=48)
+        overdue = overdue_parcels_by_distributor(forty_eight_hours_ago)
+        logger.info("Found %d parcels that need updates.", sum(group['Total'] for group in overdue.values()))
+
+        if overdue:
+            distributor_names = list(overdue)
+            logger.info("Distributor Names: %s", truncate(distributor_names))
+
+            distributors = list(distributors_collection.find({"Name": {"$in": distributor_names}},
+                                                             {"Name": 1, "Email": 1}))
+            logger.info("Found %d distributors.", len(distributors))
+
+            subject = "Parcels status update is required"
+            # One notification per distributor and day: a rerun on the same day queues nothing new
+            day = datetime.now(pytz.timezone(config['SCHEDULE_TIMEZONE'])).date().isoformat()
+            emails = []
+            for distributor in distributors:
+                group = overdue[distributor["Name"]]
+                body = build_overdue_email_body(distributor["Name"], group["Total"], group["Samples"])
+                emails.append((f"overdue:{distributor['Name']}:{day}", distributor["Email"], subject, body,
+                               distributor["Name"]))
+
+            queued = queue_emails(emails)
+            logger.info("Queued %d emails, %d already in the outbox.", len(queued), len(emails) - len(queued))
+        else:
+            logger.info("No parcels found that need updates.")
+    except Exception as e:
+        logger.error("Error in check_parcels_and_notify: %s", e)
+        raise
+
+
+@celery.task
+def update_parcels_task(rows):
+    return apply_parcel_updates(rows)
+
+
+# Split a spooled CSV into fixed-size chunks and fan them out to the workers as a chord
+@celery.task
+def start_csv_job_task(job_id, upload_id):
+    try:
+        chunks = list(iter_chunk_offsets(csv_spool, upload_id, config['CSV_CHUNK_ROWS']))
+    except Exception as e:
+        logger.error("Error splitting CSV job %s: %s", job_id, e)
+        csv_jobs_collection.update_one({"_id": job_id}, {"$set": {
+            "Status": "failed",
+            "Errors": [{"Error": str(e)}],
+            "Finished DT": datetime.now(pytz.utc)
+        }})
+        csv_spool.delete(upload_id)
+        return
+
+    csv_jobs_collection.update_one({"_id": job_id}, {"$set": {
+        "Status": "running",
+        "Rows Total": sum(rows for _, _, _, rows in chunks),
+        "Chunks Total": len(chunks),
+        "Chunks Done": 0,
+        "Started DT": datetime.now(pytz.utc)
+    }})
+    logger.info("CSV job %s split into %d chunks", job_id, len(chunks))
+
+    if not chunks:
+        finish_csv_job_task.delay([], job_id, upload_id)
+        return
+
+    chunk_tasks = [process_csv_chunk_task.s(job_id, upload_id, start, end, first_row)
+                   for start, end, first_row, _ in chunks]
+    chord(chunk_tasks)(finish_csv_job_task.s(job_id, upload_id))
+
+
+# Apply one chunk of a spooled CSV, reporting progress on the job after every batch
+@celery.task
+def process_csv_chunk_task(job_id, upload_id, start, end, first_row):
+    max_errors = config['CSV_JOB_MAX_ERRORS']
+    # What the batches flushed so far applied, kept for the result of a chunk that fails midway
+    applied = {"rows": 0, "updated": 0, "missing": 0, "invalid": 0, "errors": []}
+
+    def report_progress(summary):
+        merge_summary(applied, summary, max_errors)
+        csv_jobs_collection.update_one({"_id": job_id}, {
+            "$inc": {
+                "Rows Processed": summary["rows"],
+                "Updated": summary["updated"],
+                "Missing": summary["missing"],
+                "Invalid": summary["invalid"]
+            },
+            "$push": {"Errors": {"$each": summary["errors"], "$slice": max_errors}}
+        })
+
+    try:
+        result = apply_parcel_updates(iter_csv_rows(csv_spool, upload_id, start, end),
+                                      first_row, on_batch=report_progress)
+    except Exception as e:
+        # Keep the chord alive so the other chunks are still aggregated, and report the batches
+        # this chunk applied before failing: the job totals are set from the chunk results
+        logger.error("Error processing chunk of CSV job %s at row %d: %s", job_id, first_row, e)
+        result = applied
+        result["errors"] = result["errors"][:max_errors - 1] + [
+            {"Row": first_row + result["rows"], "Error": f"Chunk failed: {e}"}]
+
+    csv_jobs_collection.update_one({"_id": job_id}, {"$inc": {"Chunks Done": 1}})
+    result.pop("batches", None)
+    return result
+
+
+# Chord callback: aggregate the chunk outcomes into the final job result and drop the spooled file
+@celery.task
+def finish_csv_job_task(chunk_results, job_id, upload_id):
+    max_errors = config['CSV_JOB_MAX_ERRORS']
+    result = {"rows": 0, "updated": 0, "missing": 0, "invalid": 0, "errors": []}
+    # The chord hands back the chunk results in file order
+    for chunk_result in chunk_results:
+        merge_summary(result, chunk_result, max_errors)
+
+    csv_jobs_collection.update_one({"_id": job_id}, {"$set": {
+        "Status": "completed",
+        "Rows Processed": result["rows"],
+        "Updated": result["updated"],
+        "Missing": result["missing"],
+        "Invalid": result["invalid"],
+        "Errors": result["errors"],
+        "Finished DT": datetime.now(pytz.utc)
+    }})
+    csv_spool.delete(upload_id)
+    logger.info("CSV job %s completed: %d of %d rows updated", job_id, result['updated'], result['rows'])
+    return result
+
+
+# Rebuild the overdue index from MongoDB, repairing the writes it missed (Redis unavailable, direct DB edits)
+def reconcile_overdue_index():
+    if redis_client is None:
+        return
+    try:
+        indexed = overdue_index.reconcile(parcels_collection)
+        logger.info("Overdue index reconciled: %d open parcels", indexed)
+    except Exception as e:
+        logger.error("Error in reconcile_overdue_index: %s", e)
+        raise
+
+
+@celery.task
+def reconcile_overdue_index_task():
+    reconcile_overdue_index()
+
+
+# Rebuild the report rollups from MongoDB, repairing the increments they missed (direct DB edits, a failed write)
+def rebuild_report_rollups():
+    try:
+        counted = report_rollups.rebuild()
+        logger.info("Report rollups rebuilt: %d buckets", counted)
+    except Exception as e:
+        logger.error("Error in rebuild_report_rollups: %s", e)
+        raise
+
+
+@celery.task
+def rebuild_report_rollups_task():
+    rebuild_report_rollups()
+
+
+# Move the old audits to the archive, they stay readable through get_parcel_history
+def archive_audits():
+    older_than = datetime.now(timezone.utc) - timedelta(days=config['AUDIT_ARCHIVE_AFTER_DAYS'])
+    archived = audit_archive.archive(older_than)
+    logger.info("Archived %d audits older than %s", archived, older_than)
+    return archived
+
+
+@celery.task
+def archive_audits_task():
+    return archive_audits()
+
+
+# Make sure the indexes exist whenever a worker starts
+@worker_ready.connect
+def ensure_indexes_on_worker_start(**kwargs):
+    try:
+        ensure_indexes(db)
+        logger.info("MongoDB indexes ensured.")
+    except Exception as e:
+        logger.error("Error ensuring MongoDB indexes: %s", e)
+
+
+# Queue again the pending emails whose delivery task was lost (broker restart, failed dispatch)
+def redeliver_emails():
+    keys = email_outbox.stale_pending(config['EMAIL_REDELIVER_AFTER_SECONDS'])
+    for key in keys:
+        deliver_email_task.delay(key)
+    logger.info("Queued %d stale emails again", len(keys))
+
+
+# Publish the overdue counts of every distributor to the /events streams:
+# parcels also become overdue as time passes, without any write
+def publish_overdue_counts():
+    counts = overdue_counts()
+    if counts is not None:
+        event_feed.publish([("overdue", {"Counts": counts})])
+
+
+# Jobs run by the scheduler, with the config key of their crontab schedule
+SCHEDULED_JOBS = {
+    'check_parcels_and_notify': (check_parcels_and_notify, 'SCHEDULE_CHECK_PARCELS_AND_NOTIFY'),
+    'redeliver_emails': (redeliver_emails, 'SCHEDULE_REDELIVER_EMAILS'),
+    'reconcile_overdue_index': (reconcile_overdue_index, 'SCHEDULE_RECONCILE_OVERDUE_INDEX'),
+    'rebuild_report_rollups': (rebuild_report_rollups, 'SCHEDULE_REBUILD_REPORT_ROLLUPS'),
+    'archive_audits': (archive_audits, 'SCHEDULE_ARCHIVE_AUDITS'),
+    'publish_overdue_counts': (publish_overdue_counts, 'SCHEDULE_PUBLISH_OVERDUE_COUNTS'),
+}
+
+
+# Run a scheduled job claimed by the scheduler leader, on whichever worker picks it up
+@celery.task
+def run_scheduled_job_task(run_id):
+    run = scheduled_runs_collection.find_one({"_id": ObjectId(run_id)}, {"Job": 1})
+    func, _ = SCHEDULED_JOBS[run["Job"]]
+    cluster_scheduler().run(run_id, func)
+
+
+# The scheduler, which runs each job once per schedule whatever the number of worker processes.
+# Set up on first use, only the worker processes import APScheduler.
+_cluster_scheduler = None
+
+
+def cluster_scheduler():
+    global _cluster_scheduler
+    if _cluster_scheduler is None:
+        from scheduling import ClusterScheduler
+
+        scheduler = ClusterScheduler(
+            scheduled_runs_collection, redis_client, dispatch=run_scheduled_job_task.delay,
+            timezone_name=config['SCHEDULE_TIMEZONE'], lease_seconds=config['SCHEDULER_LEASE_SECONDS'],
+            catchup=timedelta(hours=config['SCHEDULE_CATCHUP_HOURS'])
+        )
+        for job_name, (_, config_key) in SCHEDULED_JOBS.items():
+            scheduler.add_job(job_name, config[config_key])
+        _cluster_scheduler = scheduler
+    return _cluster_scheduler
+
+
+# Scheduler setup for worker process
+if os.getenv('WORKER') == 'true':
+    logger.info("Worker process detected. Setting up scheduler.")
+    cluster_scheduler().start()
+    logger.info("Scheduler started with jobs %s.", ", ".join(cluster_scheduler().triggers))
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The tests run without MongoDB or Redis servers: services connects to MongoDB on first use only and
+# REDIS_URL is cleared, each test hands the code it exercises a fakeredis or mongomock instance instead
+os.environ['REDIS_URL'] = ''
+os.environ['WORKER'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,148 @@
+import threading
+import time
+import fakeredis
+import pytest
+from events import EventFeed
+
+
+@pytest.fixture
+def feed():
+    return EventFeed(fakeredis.FakeRedis(), max_len=10)
+
+
+def publish(feed, count):
+    for number in range(count):
+        feed.publish([("status", {"ID": str(number)})])
+    return [entry_id.decode('utf-8') for entry_id, _ in feed.redis.xrange(EventFeed.STREAM_KEY)]
+
+
+# Parse the chunks of a stream into (id, event type, data) tuples, comments as ('comment', text)
+def parse(chunks):
+    events = []
+    for chunk in chunks:
+        for block in chunk.split("\n\n"):
+            if not block:
+                continue
+            if block.startswith(":"):
+                events.append(("comment", block[1:].strip()))
+                continue
+            fields = dict(line.split(": ", 1) for line in block.split("\n"))
+            if "event" in fields:
+                events.append((fields.get("id"), fields["event"], fields["data"]))
+    return events
+
+
+def stream(feed, last_id=None, snapshot=None, heartbeat=0.05, max_seconds=0.2):
+    return parse(feed.iter_sse(last_id, heartbeat=heartbeat, max_seconds=max_seconds, snapshot=snapshot))
+
+
+def test_resume_from_last_event_id(feed):
+    ids = publish(feed, 5)
+
+    events = [event for event in stream(feed, last_id=ids[1]) if event[0] != "comment"]
+
+    assert [event[0] for event in events] == ids[2:]
+    assert all(event_type == "status" for _, event_type, _ in events)
+
+
+def test_new_subscriber_gets_snapshot_and_no_history(feed):
+    publish(feed, 3)
+
+    events = [event for event in stream(feed, snapshot=lambda: [("overdue", {"Counts": {"YDM": 2}})])
+              if event[0] != "comment"]
+
+    assert events == [(None, "overdue", '{"Counts": {"YDM": 2}}')]
+
+
+def test_reset_when_events_after_last_event_id_were_trimmed(feed):
+    first_id = publish(feed, 1)[0]
+    publish(feed, 20)
+
+    events = stream(feed, last_id=first_id, snapshot=lambda: [("overdue", {"Counts": {}})])
+
+    assert events[0] == (None, "reset", "{}")
+    assert events[1] == (None, "overdue", '{"Counts": {}}')
+
+
+def test_no_reset_when_only_the_last_event_itself_was_trimmed(feed):
+    remaining = publish(feed, 12)
+    last_trimmed = feed.redis.get(EventFeed.TRIMMED_KEY).decode('utf-8')
+    assert len(remaining) == 10 and last_trimmed not in remaining
+
+    events = [event for event in stream(feed, last_id=last_trimmed) if event[0] != "comment"]
+
+    assert [event[0] for event in events] == remaining
+
+
+@pytest.mark.parametrize("last_id", ["not-an-id", "12", "1-2-3"])
+def test_reset_on_invalid_last_event_id(feed, last_id):
+    publish(feed, 2)
+
+    events = stream(feed, last_id=last_id)
+
+    assert events[0] == (None, "reset", "{}")
+
+
+def test_heartbeat_while_idle(feed):
+    events = stream(feed, heartbeat=0.02, max_seconds=0.15)
+
+    assert events
+    assert all(event == ("comment", "heartbeat") for event in events)
+
+
+def test_stream_ends_after_max_seconds(feed):
+    started = time.monotonic()
+    chunks = list(feed.iter_sse(heartbeat=0.05, max_seconds=0.3))
+
+    assert 0.3 <= time.monotonic() - started < 1.5
+    assert chunks[0] == "retry: 5000\n\n"
+
+
+def test_live_events_reach_an_open_stream(feed):
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(stream(feed, heartbeat=0.05, max_seconds=0.5)))
+    reader.start()
+    time.sleep(0.1)
+    feed.publish([("status", {"ID": "P1"})])
+    reader.join()
+
+    assert [event[2] for event in received if event[0] != "comment"] == ['{"ID": "P1"}']
+
+
+@pytest.fixture
+def events_client(monkeypatch):
+    import app
+    import parcels
+
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr(parcels, 'redis_client', redis_client)
+    monkeypatch.setattr(parcels, 'event_feed', EventFeed(redis_client))
+    monkeypatch.setattr(parcels, 'event_stream_slots', threading.BoundedSemaphore(2))
+    monkeypatch.setattr(parcels, 'overdue_counts', lambda distributors=None: None)
+    return app.create_app().test_client()
+
+
+def test_get_events_answers_503_once_the_streams_are_full(events_client):
+    first = events_client.get('/events')
+    second = events_client.get('/events')
+    third = events_client.get('/events')
+
+    assert (first.status_code, second.status_code) == (200, 200)
+    assert first.mimetype == 'text/event-stream'
+    assert third.status_code == 503
+    assert third.headers['Retry-After'] == '30'
+
+    # Closing a stream frees its slot
+    first.close()
+    fourth = events_client.get('/events')
+    assert fourth.status_code == 200
+    for response in (second, fourth):
+        response.close()
+
+
+def test_get_events_answers_503_without_redis(events_client, monkeypatch):
+    import parcels
+
+    monkeypatch.setattr(parcels, 'redis_client', None)
+
+    assert events_client.get('/events').status_code == 503
@@ -0,0 +1,211 @@
+import asyncio
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+import fakeredis
+import mongomock
+import pytest
+from aiosmtpd.controller import Controller
+from mailer import SMTPMailer
+from outbox import EmailOutbox
+from overdue_index import OverdueIndex
+
+# Time the stand-in server takes to accept each message, so concurrent sends show in the run time
+DATA_DELAY_SECONDS = 0.05
+
+
+# Records every message with the SMTP session (one per connection) it came through,
+# and rejects the recipients at rejected.example.com
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith('@rejected.example.com'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(DATA_DELAY_SECONDS)
+        with self.lock:
+            self.messages.append((id(session), envelope.rcpt_tos[0], envelope.content))
+        return '250 Message accepted for delivery'
+
+    def sessions(self):
+        return {session for session, _, _ in self.messages}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    port = free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        yield handler, port
+    finally:
+        controller.stop()
+
+
+def make_mailer(port):
+    return SMTPMailer('127.0.0.1', port, 'noreply@example.com', None, use_tls=False)
+
+
+def test_send_reuses_one_session(smtp_server):
+    handler, port = smtp_server
+    with make_mailer(port) as mailer:
+        for number in range(10):
+            mailer.send(f"distributor{number}@example.com", "Subject", "Body")
+
+    assert len(handler.messages) == 10
+    assert len(handler.sessions()) == 1
+
+
+def test_send_reconnects_after_the_session_was_dropped(smtp_server):
+    handler, port = smtp_server
+    with make_mailer(port) as mailer:
+        mailer.send("first@example.com", "Subject", "Body")
+        mailer._local.server.close()
+        mailer.send("second@example.com", "Subject", "Body")
+
+    assert [to_email for _, to_email, _ in handler.messages] == ["first@example.com", "second@example.com"]
+    assert len(handler.sessions()) == 2
+
+
+# The delivery path of production: queue_emails puts the emails in a mongomock outbox and deliver_email_task
+# runs eagerly, sending through one mailer on the stand-in server
+@pytest.fixture
+def delivery(smtp_server, monkeypatch):
+    import tasks
+
+    handler, port = smtp_server
+    outbox = EmailOutbox(mongomock.MongoClient().db['Email Outbox'])
+    monkeypatch.setattr(tasks, 'email_outbox', outbox)
+    monkeypatch.setattr(tasks.celery.conf, 'CELERY_ALWAYS_EAGER', True)
+    with make_mailer(port) as mailer:
+        monkeypatch.setattr(tasks, 'delivery_mailer', lambda: mailer)
+        yield handler, outbox
+
+
+def test_deliver_email_task_sends_over_one_session(delivery):
+    import tasks
+
+    handler, outbox = delivery
+    tasks.queue_emails([(f"key{number}", f"distributor{number}@example.com", "Subject", "Body", f"D{number}")
+                        for number in range(5)])
+
+    assert len(handler.messages) == 5
+    assert len(handler.sessions()) == 1
+    assert {email["Status"] for email in outbox.collection.find()} == {"sent"}
+
+
+def test_deliver_email_task_marks_a_rejected_email_failed(delivery):
+    import tasks
+
+    handler, outbox = delivery
+    tasks.queue_emails([("ok", "ok@example.com", "Subject", "Body", "YDM"),
+                        ("rejected", "unknown@rejected.example.com", "Subject", "Body", "HFD")])
+
+    assert [to_email for _, to_email, _ in handler.messages] == ["ok@example.com"]
+    assert outbox.collection.find_one({"_id": "ok"})["Status"] == "sent"
+    rejected = outbox.collection.find_one({"_id": "rejected"})
+    assert rejected["Status"] == "failed"
+    assert "No such user" in rejected["Last Error"]
+
+
+# Stand-in for the parcels collection supporting the $topN accumulator mongomock lacks: each $group using it
+# runs as a $sort on its sortBy, a $push of its output and a $slice of the first n
+class TopNCollection:
+    def __init__(self, collection):
+        self.collection = collection
+
+    def aggregate(self, pipeline, **kwargs):
+        stages = []
+        for stage in pipeline:
+            top_n = {field: accumulator["$topN"] for field, accumulator in stage.get("$group", {}).items()
+                     if isinstance(accumulator, dict) and "$topN" in accumulator}
+            if not top_n:
+                stages.append(stage)
+                continue
+            for spec in top_n.values():
+                stages.append({"$sort": spec["sortBy"]})
+            stages.append({"$group": {field: {"$push": top_n[field]["output"]} if field in top_n else accumulator
+                                      for field, accumulator in stage["$group"].items()}})
+            stages.append({"$project": {field: {"$slice": [f"${field}", top_n[field]["n"]]} if field in top_n else 1
+                                        for field in stage["$group"] if field != "_id"}})
+        return self.collection.aggregate(stages, **kwargs)
+
+
+# Run the overdue notification over parcels_per_distributor overdue parcels of each of three distributors,
+# from the overdue index when indexed or else from the aggregation, delivering the queued emails to the
+# stand-in server. Returns the seconds taken and the emails of the outbox, sorted by recipient.
+def notify_and_send(monkeypatch, parcels_per_distributor, indexed=True):
+    import tasks
+
+    parcels = mongomock.MongoClient().db['Parcels']
+    distributors = mongomock.MongoClient().db['Distributors']
+    overdue_index = OverdueIndex(fakeredis.FakeRedis())
+    old = (datetime.utcnow() - timedelta(days=5)).replace(hour=0, minute=0, second=0, microsecond=0)
+    names = ["YDM", "HFD", "DHL"]
+    distributors.insert_many([{"Name": name, "Email": f"{name.lower()}@example.com"} for name in names])
+    parcels.insert_many([{"ID": f"{name}-{number}", "Distributor": name, "Status": "Held", "Exelot Code": "40",
+                          "Status DT": old + timedelta(seconds=number)}
+                         for name in names for number in range(parcels_per_distributor)])
+    if indexed:
+        overdue_index.reconcile(parcels)
+
+    monkeypatch.setattr(tasks, 'parcels_collection', parcels)
+    monkeypatch.setattr(tasks, 'parcels_reads', TopNCollection(parcels))
+    monkeypatch.setattr(tasks, 'distributors_collection', distributors)
+    monkeypatch.setattr(tasks, 'overdue_index', overdue_index)
+
+    started = time.perf_counter()
+    tasks.check_parcels_and_notify()
+    elapsed = time.perf_counter() - started
+    emails = list(tasks.email_outbox.collection.find().sort("To", 1))
+    assert {email["Status"] for email in emails} == {"sent"}
+    # A new day for the outbox keys of the next run
+    tasks.email_outbox.collection.delete_many({})
+    return elapsed, emails
+
+
+def test_notification_run_time_stays_flat_as_parcels_grow(delivery, monkeypatch):
+    handler, _ = delivery
+
+    small_elapsed, small_emails = notify_and_send(monkeypatch, 10)
+    small_messages = len(handler.messages)
+    large_elapsed, large_emails = notify_and_send(monkeypatch, 2000)
+
+    # One email per distributor whatever the number of parcels, listing the same number of samples
+    assert len(small_emails) == len(large_emails) == 3
+    assert len(handler.messages) - small_messages == small_messages == 3
+    assert "Total parcels requiring update: 2000" in large_emails[0]["Body"]
+    assert [len(email["Body"]) for email in large_emails] == pytest.approx(
+        [len(email["Body"]) for email in small_emails], abs=10)
+    # 200 times the parcels, about the same run time
+    assert large_elapsed < small_elapsed * 2 + 0.1
+
+
+# Without a ready overdue index the counts and samples come from the $group / $topN aggregation
+def test_aggregation_lists_the_same_parcels_as_the_overdue_index(delivery, monkeypatch):
+    handler, _ = delivery
+    _, indexed_emails = notify_and_send(monkeypatch, 20, indexed=True)
+    _, aggregated_emails = notify_and_send(monkeypatch, 20, indexed=False)
+
+    assert [(email["To"], email["Body"]) for email in aggregated_emails] == [
+        (email["To"], email["Body"]) for email in indexed_emails]
+    # The oldest parcels of each distributor, oldest first
+    assert "DHL-0, Status: Held" in aggregated_emails[0]["Body"]
+    assert "DHL-4, Status: Held" in aggregated_emails[0]["Body"]
+    assert "DHL-5," not in aggregated_emails[0]["Body"]
+    assert "Total parcels requiring update: 20" in aggregated_emails[0]["Body"]
+    assert len(handler.messages) == 6
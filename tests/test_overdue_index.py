@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+import fakeredis
+import mongomock
+from overdue_index import OverdueIndex
+
+
+def test_reconcile_keeps_a_write_landing_during_it():
+    parcels = mongomock.MongoClient().db['Parcels']
+    parcels.insert_many([{"ID": parcel_id, "Distributor": "YDM", "Exelot Code": "10",
+                          "Status DT": datetime(2026, 1, 10), "Updated DT": datetime(2026, 1, 10)}
+                         for parcel_id in ("A", "B")])
+    index = OverdueIndex(fakeredis.FakeRedis())
+    find = parcels.find
+
+    # A moves to Cheetah and B is closed once the rebuild has read them, record() writing the live sets
+    def find_racing_writes(query, projection=None):
+        if "Updated DT" in query:
+            return find(query, projection)
+        read = list(find(query, projection))
+        now = datetime.now(timezone.utc)
+        parcels.update_one({"ID": "A"}, {"$set": {"Distributor": "Cheetah", "Updated DT": now}})
+        parcels.update_one({"ID": "B"}, {"$set": {"Exelot Code": "99", "Updated DT": now}})
+        index.forget([{"ID": "A", "Distributor": "YDM"}])
+        index.record(find({"ID": {"$in": ["A", "B"]}}))
+        return iter(read)
+
+    parcels.find = find_racing_writes
+    index.reconcile(parcels)
+
+    assert index.overdue_ids(datetime(2026, 2, 1)) == {"Cheetah": ["A"]}
@@ -0,0 +1,57 @@
+from datetime import datetime
+import fakeredis
+import mongomock
+import pytest
+
+
+# Report app whose parcels live only on the primary: a read routed to the secondary finds nothing
+@pytest.fixture
+def report_client(monkeypatch):
+    import app
+    import listing
+    import services
+
+    primary = mongomock.MongoClient().db['Parcels']
+    primary.insert_many([{"ID": str(number), "Distributor": "YDM", "Site": "Haifa", "Status": "Lost",
+                          "Exelot Code": "99", "Status DT": datetime(2026, 1, 10)} for number in range(3)])
+    secondary = mongomock.MongoClient().db['Parcels']
+    monkeypatch.setattr(listing, 'parcels_collection', primary)
+    monkeypatch.setattr(listing, 'parcels_reads', secondary)
+    monkeypatch.setattr(services.report_rollups, 'ready', lambda: False)
+    return app.create_app().test_client()
+
+
+def lost_parcels(client):
+    response = client.get('/get_lost_parcels?status=Lost&startDate=2026-01-01T00:00:00&endDate=2026-01-31T00:00:00')
+    assert response.status_code == 200
+    return sum(group["TotalLost"] for group in response.json)
+
+
+def test_report_going_into_the_cache_reads_the_primary(report_client, monkeypatch):
+    import services
+
+    monkeypatch.setattr(services.report_cache, 'redis', fakeredis.FakeRedis())
+
+    assert lost_parcels(report_client) == 3
+
+
+def test_report_without_cache_reads_the_secondary(report_client, monkeypatch):
+    import services
+
+    monkeypatch.setattr(services.report_cache, 'redis', None)
+
+    assert lost_parcels(report_client) == 0
+
+
+def test_listing_with_an_etag_reads_the_primary(report_client, monkeypatch):
+    import listing
+    import services
+
+    redis_client = fakeredis.FakeRedis()
+    monkeypatch.setattr(listing, 'redis_client', redis_client)
+    monkeypatch.setattr(services.report_cache, 'redis', redis_client)
+
+    response = report_client.get('/get_parcels')
+
+    assert response.headers['ETag']
+    assert len(response.json) == 3